@@ -13,13 +13,24 @@ test_require = [
 
 docs_require = []
 
+async_require = ["httpx"]
+
+http2_require = ["httpx[http2]"]
+
+orjson_require = ["orjson"]
+
 setup(
     name="wagtail-analytics",
     version="0.5.3",
     description="",
     author="Moori",
     install_requires=install_requires,
-    extras_require={"test": test_require},
+    extras_require={
+        "test": test_require,
+        "async": async_require,
+        "http2": http2_require,
+        "orjson": orjson_require,
+    },
     package_dir={"": "src"},
     packages=find_packages("src"),
     include_package_data=True,
@@ -0,0 +1,15 @@
+from django.apps import AppConfig
+from django.utils.translation import gettext_lazy as _
+
+
+class WagtailAnalyticsAppConfig(AppConfig):
+    name = "wagtail_analytics"
+    label = "wagtail_analytics"
+    verbose_name = _("Wagtail Analytics")
+    default_auto_field = "django.db.models.AutoField"
+
+    def ready(self):
+        from wagtail_analytics import checks  # noqa: F401
+        from wagtail_analytics.signal_handlers import register_signal_handlers
+
+        register_signal_handlers()
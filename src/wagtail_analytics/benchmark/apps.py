@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+from django.utils.translation import gettext_lazy as _
+
+
+class WagtailAnalyticsBenchmarkAppConfig(AppConfig):
+    name = "wagtail_analytics.benchmark"
+    label = "wagtail_analytics_benchmark"
+    verbose_name = _("Wagtail Analytics benchmark")
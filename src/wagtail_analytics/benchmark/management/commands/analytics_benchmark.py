@@ -0,0 +1,187 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from wagtail.models import Site
+
+from wagtail_analytics.benchmark.upstreams import (
+    BenchmarkGoogleAnalyticsAPIClient,
+    FakeGoogleAnalyticsServer,
+    FakePlausibleServer,
+    run_benchmark,
+)
+from wagtail_analytics.lib.cache import ReportCache
+from wagtail_analytics.lib.providers import PlausibleProvider
+from wagtail_analytics.views import AnalyticsReportView
+
+
+class UncachedReportCache(ReportCache):
+    def __init__(self, **kwargs) -> None:
+        super().__init__(timeout=0)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the report pipeline against local stand-ins of Plausible and "
+        "Google Analytics, and print the results as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=50)
+        parser.add_argument("--warmup", type=int, default=3)
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=50,
+            help="Injected upstream latency in milliseconds.",
+        )
+        parser.add_argument(
+            "--jitter",
+            type=float,
+            default=0,
+            help="Random extra upstream latency in milliseconds.",
+        )
+        parser.add_argument(
+            "--error-rate",
+            type=float,
+            default=0,
+            help="Share of upstream calls that fail, between 0 and 1.",
+        )
+        parser.add_argument(
+            "--rows", type=int, default=10, help="Rows returned per upstream call."
+        )
+        parser.add_argument(
+            "--provider",
+            choices=["plausible", "google_analytics"],
+            action="append",
+            dest="providers",
+            help="Only benchmark this provider, may be repeated.",
+        )
+        parser.add_argument(
+            "--cache",
+            action="store_true",
+            help="Let the view use the report cache instead of bypassing it.",
+        )
+        parser.add_argument(
+            "--budget",
+            action="append",
+            default=[],
+            help=(
+                "Fail when a p95 latency exceeds this many milliseconds. Use "
+                "NAME=MS to set the budget of a single benchmark."
+            ),
+        )
+        parser.add_argument("--output", help="Write the results to this file.")
+
+    def handle(self, *args, **options):
+        upstream_options = {
+            "latency": options["latency"] / 1000,
+            "jitter": options["jitter"] / 1000,
+            "error_rate": options["error_rate"],
+            "rows": options["rows"],
+        }
+        benchmark_options = {
+            "iterations": options["iterations"],
+            "warmup": options["warmup"],
+        }
+        providers = options["providers"] or ["plausible", "google_analytics"]
+        site = Site.objects.get(is_default_site=True)
+        report_cache_class = ReportCache if options["cache"] else UncachedReportCache
+
+        results = []
+        if "plausible" in providers:
+            with FakePlausibleServer(**upstream_options) as upstream:
+
+                def get_client():
+                    client = PlausibleProvider().get_client_class()(
+                        site.hostname, "benchmark"
+                    )
+                    client.base_url = upstream.base_url
+                    client.query_url = upstream.query_url
+                    # The stand-ins don't limit requests
+                    client.rate_limit_bucket = None
+                    return client
+
+                results += self.benchmark_provider(
+                    "plausible",
+                    site,
+                    get_client,
+                    upstream,
+                    report_cache_class,
+                    benchmark_options,
+                )
+
+        if "google_analytics" in providers:
+            with FakeGoogleAnalyticsServer(**upstream_options) as upstream:
+                data_client = upstream.create_client()
+
+                def get_client():
+                    client = BenchmarkGoogleAnalyticsAPIClient("0", data_client)
+                    client.rate_limit_bucket = None
+                    return client
+
+                results += self.benchmark_provider(
+                    "google_analytics",
+                    site,
+                    get_client,
+                    upstream,
+                    report_cache_class,
+                    benchmark_options,
+                )
+
+        output = json.dumps(
+            {"config": {**upstream_options, **benchmark_options}, "results": results},
+            indent=2,
+        )
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        self.stdout.write(output)
+
+        failures = self.check_budgets(results, options["budget"])
+        if failures:
+            raise CommandError("Over budget: %s" % ", ".join(failures))
+
+    def benchmark_provider(
+        self, provider, site, get_client, upstream, report_cache_class, options
+    ):
+        class BenchmarkReportView(AnalyticsReportView):
+            def get_client(self, site, analytics_settings):
+                return get_client()
+
+        view = BenchmarkReportView.as_view(report_cache_class=report_cache_class)
+        request = RequestFactory().get("/")
+
+        def get_view():
+            response = view(request, site_id=site.pk)
+            if response.status_code != 200:
+                raise CommandError(response.content.decode())
+            return response
+
+        return [
+            run_benchmark(
+                f"{provider}.get_report",
+                lambda: get_client().get_report(),
+                upstream=upstream,
+                **options,
+            ),
+            run_benchmark(f"{provider}.view", get_view, upstream=upstream, **options),
+        ]
+
+    def check_budgets(self, results, budgets):
+        default, named = None, {}
+        for budget in budgets:
+            if "=" in budget:
+                name, value = budget.split("=", 1)
+                named[name] = float(value)
+            else:
+                default = float(budget)
+
+        failures = []
+        for result in results:
+            budget = named.get(result["name"], default)
+            if budget is not None and result["p95_ms"] > budget:
+                failures.append(
+                    "%s p95 %sms > %sms" % (result["name"], result["p95_ms"], budget)
+                )
+        return failures
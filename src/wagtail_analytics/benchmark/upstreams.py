@@ -0,0 +1,311 @@
+import json
+import math
+import random
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from statistics import mean
+from typing import Callable, Optional
+from urllib.parse import parse_qs, urlparse
+
+import grpc
+from google.analytics.data_v1beta import BetaAnalyticsDataClient
+from google.analytics.data_v1beta.services.beta_analytics_data.transports import (
+    BetaAnalyticsDataGrpcTransport,
+)
+from google.analytics.data_v1beta.types import (
+    BatchRunReportsRequest,
+    BatchRunReportsResponse,
+    DimensionValue,
+    MetricValue,
+    Row,
+    RunReportRequest,
+    RunReportResponse,
+)
+from google.auth.credentials import AnonymousCredentials
+
+from wagtail_analytics.lib.google_analytics import GoogleAnalyticsAPIClient
+
+
+class FakeUpstream:
+    """
+    Base class for the local stand-ins of the analytics providers.
+
+    Every call is delayed by ``latency`` seconds (plus up to ``jitter``), fails
+    with a probability of ``error_rate`` and returns ``rows`` rows.
+    """
+
+    def __init__(self, latency=0.05, jitter=0.0, error_rate=0.0, rows=10) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rows = rows
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def handle_call(self) -> bool:
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency + random.uniform(0, self.jitter))
+        return random.random() >= self.error_rate
+
+    def get_dates(self, start: date, end: date):
+        days = min(self.rows, (end - start).days + 1)
+        return [start + timedelta(days=i) for i in range(days)]
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+class FakePlausibleServer(FakeUpstream):
+    def start(self):
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if not upstream.handle_call():
+                    return self.respond(503, {"error": "Injected failure"})
+                url = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                self.respond(200, {"results": upstream.get_results(url.path, query)})
+
+            def do_POST(self):
+                if not upstream.handle_call():
+                    return self.respond(503, {"error": "Injected failure"})
+                length = int(self.headers.get("Content-Length", 0))
+                query = json.loads(self.rfile.read(length))
+                self.respond(200, {"results": upstream.get_query_results(query)})
+
+            def respond(self, status, data):
+                body = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def base_url(self) -> str:
+        return "http://127.0.0.1:%s/api/v1/stats" % self.server.server_port
+
+    @property
+    def query_url(self) -> str:
+        return "http://127.0.0.1:%s/api/v2/query" % self.server.server_port
+
+    def get_results(self, path: str, query: dict):
+        if path.endswith("/timeseries"):
+            start, end = [date.fromisoformat(d) for d in query["date"].split(",")]
+            return [
+                {"date": str(day), "visitors": random.randint(0, 1000)}
+                for day in self.get_dates(start, end)
+            ]
+        if path.endswith("/aggregate"):
+            return {"visitors": {"value": random.randint(0, 10000)}}
+        name = "page" if query.get("property") == "event:page" else "source"
+        limit = min(self.rows, int(query.get("limit", self.rows)))
+        return [
+            {
+                name: f"/{name}-{i}/",
+                "visitors": random.randint(0, 1000),
+                "pageviews": random.randint(0, 1000),
+            }
+            for i in range(limit)
+        ]
+
+    def get_query_results(self, query: dict):
+        metrics = [random.randint(0, 1000) for metric in query["metrics"]]
+        dimensions = query.get("dimensions", [])
+        if not dimensions:
+            return [{"dimensions": [], "metrics": metrics}]
+        if dimensions[0].startswith("time:"):
+            start, end = [date.fromisoformat(d) for d in query["date_range"]]
+            values = [[]]
+            if len(dimensions) > 1:
+                name = "page" if dimensions[1] == "event:page" else "source"
+                values = [[f"/{name}-{i}/"] for i in range(self.rows)]
+            return [
+                {
+                    "dimensions": [str(day)] + value,
+                    "metrics": [random.randint(0, 1000) for m in query["metrics"]],
+                }
+                for day in self.get_dates(start, end)
+                for value in values
+            ]
+        name = "page" if dimensions[0] == "event:page" else "source"
+        limit = min(self.rows, query.get("pagination", {}).get("limit", self.rows))
+        return [
+            {
+                "dimensions": [f"/{name}-{i}/"],
+                "metrics": [random.randint(0, 1000) for m in query["metrics"]],
+            }
+            for i in range(limit)
+        ]
+
+
+class FakeGoogleAnalyticsServer(FakeUpstream):
+    service = "google.analytics.data.v1beta.BetaAnalyticsData"
+
+    def start(self):
+        handler = grpc.method_handlers_generic_handler(
+            self.service,
+            {
+                "RunReport": grpc.unary_unary_rpc_method_handler(
+                    self.run_report,
+                    request_deserializer=RunReportRequest.deserialize,
+                    response_serializer=RunReportResponse.serialize,
+                ),
+                "BatchRunReports": grpc.unary_unary_rpc_method_handler(
+                    self.batch_run_reports,
+                    request_deserializer=BatchRunReportsRequest.deserialize,
+                    response_serializer=BatchRunReportsResponse.serialize,
+                ),
+            },
+        )
+        self.server = grpc.server(ThreadPoolExecutor(max_workers=32))
+        self.server.add_generic_rpc_handlers((handler,))
+        self.port = self.server.add_insecure_port("127.0.0.1:0")
+        self.server.start()
+
+    def stop(self):
+        self.server.stop(grace=None)
+
+    def create_client(self) -> BetaAnalyticsDataClient:
+        channel = grpc.insecure_channel("127.0.0.1:%s" % self.port)
+        transport = BetaAnalyticsDataGrpcTransport(
+            credentials=AnonymousCredentials(), channel=channel
+        )
+        return BetaAnalyticsDataClient(transport=transport)
+
+    def run_report(self, request, context):
+        if not self.handle_call():
+            context.abort(grpc.StatusCode.UNAVAILABLE, "Injected failure")
+        return self.get_response(request)
+
+    def batch_run_reports(self, request, context):
+        if not self.handle_call():
+            context.abort(grpc.StatusCode.UNAVAILABLE, "Injected failure")
+        return BatchRunReportsResponse(
+            reports=[self.get_response(report) for report in request.requests]
+        )
+
+    def get_response(self, request: RunReportRequest) -> RunReportResponse:
+        pages = [["/page-%s/" % i] for i in range(self.rows)]
+        if request.dimensions and request.dimensions[0].name == "date":
+            date_range = request.date_ranges[0]
+            values = [
+                [day.strftime("%Y%m%d")] + page
+                for day in self.get_dates(
+                    date.fromisoformat(date_range.start_date),
+                    date.fromisoformat(date_range.end_date),
+                )
+                for page in (pages if len(request.dimensions) > 1 else [[]])
+            ]
+        else:
+            values = pages
+        return RunReportResponse(
+            rows=[
+                Row(
+                    dimension_values=[DimensionValue(value=value) for value in row],
+                    metric_values=[MetricValue(value=str(random.randint(0, 1000)))],
+                )
+                for row in values
+            ]
+        )
+
+
+class BenchmarkGoogleAnalyticsAPIClient(GoogleAnalyticsAPIClient):
+    """Talks to a given data client instead of the process-wide registry."""
+
+    client = None
+
+    def __init__(self, property_id, client: BetaAnalyticsDataClient) -> None:
+        super().__init__(property_id, credentials=None)
+        self.client = client
+
+
+def percentile(values, pct: float) -> float:
+    values = sorted(values)
+    if not values:
+        return 0.0
+    # Nearest-rank method
+    index = min(len(values) - 1, max(0, math.ceil(pct / 100 * len(values)) - 1))
+    return values[index]
+
+
+def run_benchmark(
+    name: str,
+    fn: Callable[[], object],
+    iterations: int = 50,
+    warmup: int = 3,
+    upstream: Optional[FakeUpstream] = None,
+    memory_iterations: int = 5,
+) -> dict:
+    """
+    Call ``fn`` repeatedly and return its latency, upstream call and allocation
+    statistics as a dictionary that serializes to JSON.
+    """
+    for i in range(warmup):
+        fn()
+
+    calls_before = upstream.calls if upstream else 0
+    timings, errors = [], 0
+    for i in range(iterations):
+        start = time.perf_counter()
+        try:
+            fn()
+        except Exception:
+            errors += 1
+        timings.append((time.perf_counter() - start) * 1000)
+    calls = (upstream.calls - calls_before) if upstream else 0
+
+    # Allocations are measured separately, tracemalloc slows everything down
+    tracemalloc.start()
+    snapshot_start, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    for i in range(memory_iterations):
+        try:
+            fn()
+        except Exception:
+            pass
+    snapshot_end, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "name": name,
+        "iterations": iterations,
+        "errors": errors,
+        "mean_ms": round(mean(timings), 3) if timings else 0.0,
+        "min_ms": round(min(timings), 3) if timings else 0.0,
+        "max_ms": round(max(timings), 3) if timings else 0.0,
+        "p50_ms": round(percentile(timings, 50), 3),
+        "p95_ms": round(percentile(timings, 95), 3),
+        "p99_ms": round(percentile(timings, 99), 3),
+        "upstream_calls_per_iteration": (
+            round(calls / iterations, 3) if iterations else 0.0
+        ),
+        "retained_kb_per_iteration": round(
+            (snapshot_end - snapshot_start) / 1024 / max(1, memory_iterations), 3
+        ),
+        "peak_kb": round(peak / 1024, 3),
+    }
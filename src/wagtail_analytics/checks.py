@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+from wagtail_analytics import settings as wagtail_analytics_settings
+
+LOCAL_CACHE_BACKENDS = (
+    "django.core.cache.backends.dummy.DummyCache",
+    "django.core.cache.backends.locmem.LocMemCache",
+)
+
+
+@register()
+def check_cache_alias(app_configs, **kwargs):
+    """
+    The report locks, rate limits and settings version are shared through the
+    ``CACHE_ALIAS`` cache, which only works across processes when they share it.
+    """
+    alias = wagtail_analytics_settings.CACHE_ALIAS
+    backend = settings.CACHES.get(alias, {}).get("BACKEND")
+    if backend not in LOCAL_CACHE_BACKENDS:
+        return []
+    return [
+        Warning(
+            f"The {alias!r} cache is local to each process.",
+            hint=(
+                "Set WAGTAIL_ANALYTICS_CACHE_ALIAS to a cache shared by every "
+                "process, such as Redis or Memcached. Otherwise each process "
+                "fetches reports and spends the rate limits on its own, and "
+                "doesn't notice changed analytics settings."
+            ),
+            id="wagtail_analytics.W001",
+        )
+    ]
@@ -1,39 +1,403 @@
+import asyncio
+import contextvars
+import importlib
+import logging
+import threading
+import time
 from abc import ABC, abstractmethod
-from datetime import date, datetime, timedelta
-from typing import List, Tuple
-
-import requests
-from google.analytics.data_v1beta import BetaAnalyticsDataClient
-from google.analytics.data_v1beta.types import (
-    DateRange,
-    Dimension,
-    Metric,
-    RunReportRequest,
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import date
+from functools import cached_property, partial
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+
+from wagtail_analytics import settings as wagtail_analytics_settings
+from wagtail_analytics.lib.dates import Period, get_period, get_today
+from wagtail_analytics.lib.exceptions import RateLimitError, UpstreamTimeout
+from wagtail_analytics.lib.instrumentation import record_report_built, section
+from wagtail_analytics.lib.providers import provider_registry
+from wagtail_analytics.lib.ratelimit import INTERACTIVE, TokenBucket, get_bucket
+from wagtail_analytics.types import (
+    PageReport,
+    Report,
+    ReportSection,
+    Timeseries,
+    TopPage,
+    TopSource,
 )
 
-from wagtail_analytics.types import Report, TopPage, TopSource
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Return the process-wide pool used to fetch report sections."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=wagtail_analytics_settings.REPORT_MAX_WORKERS,
+                thread_name_prefix="wagtail-analytics",
+            )
+    return _executor
 
 
 class APIClient(ABC):
-    def get_report(self) -> Report:
-        visitors_this_week = self.get_visitors_this_week()
-        visitors_last_week = self.get_visitors_last_week()
-        top_pages = self.get_top_pages()
-        top_sources = self.get_top_sources()
-        report = Report(
-            visitors_this_week=visitors_this_week,
-            visitors_last_week=visitors_last_week,
-            top_pages=top_pages,
-            top_sources=top_sources,
+    provider = None
+    rate_limiter = None
+    priority = INTERACTIVE
+    time_zone = None
+
+    # The sections of a report which can be fetched on their own, with the fields
+    # of the report they fill in
+    section_fields = {
+        "visitors": ("visitors_this_week", "visitors_last_week"),
+        "top_pages": ("top_pages",),
+        "top_sources": ("top_sources",),
+    }
+
+    def get_report(self, period: Period = None, comparison: Period = None) -> Report:
+        start = time.perf_counter()
+        period, comparison = self.get_periods(period, comparison)
+        results, errors = self.fetch_sections(
+            self.get_report_sections(period, comparison)
+        )
+        return self.build_report(results, errors, start)
+
+    async def aget_report(
+        self, period: Period = None, comparison: Period = None
+    ) -> Report:
+        start = time.perf_counter()
+        period, comparison = self.get_periods(period, comparison)
+        results, errors = await self.afetch_sections(
+            self.get_async_report_sections(period, comparison)
+        )
+        return self.build_report(results, errors, start)
+
+    def build_report(self, results, errors, start: float) -> Report:
+        report = self.make_report(results, errors)
+        record_report_built(
+            self.__class__,
+            self.provider,
+            "report",
+            time.perf_counter() - start,
+            report.errors,
+        )
+        return report
+
+    def make_report(self, results, errors) -> Report:
+        return Report(
+            visitors_this_week=Timeseries.from_rows(
+                results.get("visitors_this_week", [])
+            ),
+            visitors_last_week=Timeseries.from_rows(
+                results.get("visitors_last_week", [])
+            ),
+            top_pages=results.get("top_pages", []),
+            top_sources=results.get("top_sources", []),
+            errors=list(errors),
+        )
+
+    def get_section(
+        self, name: str, period: Period = None, comparison: Period = None
+    ) -> ReportSection:
+        """Fetch a single section of the report, see :attr:`section_fields`."""
+        start = time.perf_counter()
+        period, comparison = self.get_periods(period, comparison)
+        results, errors = self.fetch_sections(
+            self.select_sections(name, self.get_report_sections(period, comparison))
+        )
+        return self.build_section(name, results, errors, start)
+
+    async def aget_section(
+        self, name: str, period: Period = None, comparison: Period = None
+    ) -> ReportSection:
+        start = time.perf_counter()
+        period, comparison = self.get_periods(period, comparison)
+        results, errors = await self.afetch_sections(
+            self.select_sections(
+                name, self.get_async_report_sections(period, comparison)
+            )
+        )
+        return self.build_section(name, results, errors, start)
+
+    def select_sections(self, name: str, sections: dict) -> dict:
+        """Return the report sections which fill in the fields of section ``name``."""
+        fields = self.section_fields[name]
+        return {
+            key: fetch
+            for key, fetch in sections.items()
+            if key == name or key in fields
+        }
+
+    def get_report_section(self, name: str, report: Report) -> ReportSection:
+        """Return section ``name`` of a whole report."""
+        fields = self.section_fields[name]
+        return ReportSection(
+            name=name,
+            data={field: getattr(report, field) for field in fields},
+            errors=[
+                error for error in report.errors if error == name or error in fields
+            ],
+        )
+
+    def build_section(self, name: str, results, errors, start: float):
+        section = self.get_report_section(name, self.make_report(results, errors))
+        record_report_built(
+            self.__class__,
+            self.provider,
+            "section",
+            time.perf_counter() - start,
+            section.errors,
+        )
+        return section
+
+    def get_page_report(
+        self, path: str, period: Period = None, comparison: Period = None
+    ) -> PageReport:
+        start = time.perf_counter()
+        period, comparison = self.get_periods(period, comparison)
+        results, errors = self.fetch_sections(
+            self.get_page_report_sections(path, period, comparison)
+        )
+        return self.build_page_report(path, results, errors, start)
+
+    async def aget_page_report(
+        self, path: str, period: Period = None, comparison: Period = None
+    ) -> PageReport:
+        start = time.perf_counter()
+        period, comparison = self.get_periods(period, comparison)
+        results, errors = await self.afetch_sections(
+            self.get_async_page_report_sections(path, period, comparison)
+        )
+        return self.build_page_report(path, results, errors, start)
+
+    def build_page_report(self, path: str, results, errors, start: float):
+        report = PageReport(
+            path=path,
+            visitors_this_week=Timeseries.from_rows(
+                results.get("visitors_this_week", [])
+            ),
+            visitors_last_week=Timeseries.from_rows(
+                results.get("visitors_last_week", [])
+            ),
+            errors=list(errors),
+        )
+        record_report_built(
+            self.__class__,
+            self.provider,
+            "page-report",
+            time.perf_counter() - start,
+            report.errors,
         )
         return report
 
+    def get_pageviews(
+        self, paths: Iterable[str], period: Period = None
+    ) -> Dict[str, int]:
+        return self.get_pageviews_between(*(period or self.get_this_week()), paths)
+
+    async def aget_pageviews(
+        self, paths: Iterable[str], period: Period = None
+    ) -> Dict[str, int]:
+        return await self.aget_pageviews_between(
+            *(period or self.get_this_week()), paths
+        )
+
+    def get_today(self) -> date:
+        return get_today(self.time_zone)
+
+    def get_this_week(self) -> Period:
+        return get_period("week", self.get_today())
+
+    def get_last_week(self) -> Period:
+        return self.get_this_week().previous()
+
+    def get_periods(
+        self, period: Period = None, comparison: Period = None
+    ) -> Tuple[Period, Period]:
+        """Default to this week, compared with the period before."""
+        period = period or self.get_this_week()
+        return period, comparison or period.previous()
+
+    def get_date_window(self, period: Period = None, comparison: Period = None) -> str:
+        period, comparison = self.get_periods(period, comparison)
+        return f"{period.key}:{comparison.key}"
+
+    def is_concurrent(self) -> bool:
+        return wagtail_analytics_settings.CONCURRENT_REPORTS
+
+    def batches_reports(self) -> bool:
+        """Whether every section of a report is fetched with a single request."""
+        return False
+
+    def get_rate_limit_account(self) -> Optional[str]:
+        """Return what the provider limits requests by, None for no limit."""
+        return None
+
+    @cached_property
+    def rate_limit_bucket(self) -> Optional[TokenBucket]:
+        account = self.get_rate_limit_account()
+        if account is None:
+            return None
+        return get_bucket(self.provider, account)
+
+    def throttle(self):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        if self.rate_limit_bucket is not None:
+            self.rate_limit_bucket.acquire(self.priority)
+
+    async def athrottle(self):
+        if self.rate_limiter is not None:
+            await sync_to_async(self.rate_limiter.acquire, thread_sensitive=False)()
+        if self.rate_limit_bucket is not None:
+            await self.rate_limit_bucket.aacquire(self.priority)
+
+    def handle_rate_limit(self, error: RateLimitError):
+        """Hold back the requests of every process once the provider limits us."""
+        if self.rate_limit_bucket is not None:
+            self.rate_limit_bucket.block(
+                error.retry_after or wagtail_analytics_settings.RATE_LIMIT_BACKOFF
+            )
+
+    def get_report_sections(
+        self, period: Period, comparison: Period
+    ) -> Dict[str, Callable[[], list]]:
+        return {
+            "visitors_this_week": partial(self.get_visitors_between, *period),
+            "visitors_last_week": partial(self.get_visitors_between, *comparison),
+            "top_pages": partial(self.get_top_pages_between, *period),
+            "top_sources": partial(self.get_top_sources_between, *period),
+        }
+
+    def get_async_report_sections(self, period: Period, comparison: Period) -> dict:
+        return {
+            "visitors_this_week": partial(self.aget_visitors_between, *period),
+            "visitors_last_week": partial(self.aget_visitors_between, *comparison),
+            "top_pages": partial(self.aget_top_pages_between, *period),
+            "top_sources": partial(self.aget_top_sources_between, *period),
+        }
+
+    def get_page_report_sections(
+        self, path: str, period: Period, comparison: Period
+    ) -> Dict[str, Callable[[], list]]:
+        return {
+            "visitors_this_week": partial(
+                self.get_visitors_between, *period, path=path
+            ),
+            "visitors_last_week": partial(
+                self.get_visitors_between, *comparison, path=path
+            ),
+        }
+
+    def get_async_page_report_sections(
+        self, path: str, period: Period, comparison: Period
+    ) -> dict:
+        return {
+            "visitors_this_week": partial(
+                self.aget_visitors_between, *period, path=path
+            ),
+            "visitors_last_week": partial(
+                self.aget_visitors_between, *comparison, path=path
+            ),
+        }
+
+    def fetch_sections(self, sections):
+        if self.is_concurrent():
+            results, errors = self.fetch_concurrently(sections)
+        else:
+            results, errors = self.fetch_serially(sections)
+        if errors and not results:
+            # Nothing to show, let the caller deal with the first failure
+            raise next(iter(errors.values()))
+        return results, errors
+
+    def run_section(self, name: str, fetch: Callable[[], list]):
+        with section(name):
+            return fetch()
+
+    def fetch_serially(self, sections):
+        results, errors = {}, {}
+        for name, fetch in sections.items():
+            try:
+                results[name] = self.run_section(name, fetch)
+            except Exception as e:
+                self.handle_section_error(name, e)
+                errors[name] = e
+        return results, errors
+
+    def fetch_concurrently(self, sections):
+        executor = get_executor()
+        # Each section runs in a copy of the current context, so timings are
+        # collected for the request that asked for the report
+        futures = {
+            name: executor.submit(
+                contextvars.copy_context().run, self.run_section, name, fetch
+            )
+            for name, fetch in sections.items()
+        }
+        wait(futures.values(), timeout=wagtail_analytics_settings.REPORT_TIMEOUT)
+
+        results, errors = {}, {}
+        for name, future in futures.items():
+            if not future.done():
+                future.cancel()
+                e = UpstreamTimeout(f"Section {name} did not finish in time")
+                self.handle_section_error(name, e)
+                errors[name] = e
+                continue
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                self.handle_section_error(name, e)
+                errors[name] = e
+        return results, errors
+
+    async def afetch_sections(self, sections):
+        tasks = {
+            name: asyncio.ensure_future(self.arun_section(name, fetch))
+            for name, fetch in sections.items()
+        }
+        await asyncio.wait(
+            tasks.values(), timeout=wagtail_analytics_settings.REPORT_TIMEOUT
+        )
+
+        results, errors = {}, {}
+        for name, task in tasks.items():
+            if not task.done():
+                task.cancel()
+                e = UpstreamTimeout(f"Section {name} did not finish in time")
+                self.handle_section_error(name, e)
+                errors[name] = e
+                continue
+            try:
+                results[name] = task.result()
+            except Exception as e:
+                self.handle_section_error(name, e)
+                errors[name] = e
+        if errors and not results:
+            raise next(iter(errors.values()))
+        return results, errors
+
+    async def arun_section(self, name: str, fetch):
+        with section(name):
+            return await fetch()
+
+    def handle_section_error(self, name: str, error: Exception):
+        if not wagtail_analytics_settings.PARTIAL_REPORTS:
+            raise error
+        logger.warning("Unable to fetch %s report section: %s", name, error)
+
     @abstractmethod
-    def get_visitors_this_week(self) -> List[Tuple[datetime, int]]:
+    def get_visitors_this_week(self) -> List[Tuple[str, int]]:
         return []
 
     @abstractmethod
-    def get_visitors_last_week(self) -> List[Tuple[datetime, int]]:
+    def get_visitors_last_week(self) -> List[Tuple[str, int]]:
         return []
 
     @abstractmethod
@@ -44,156 +408,124 @@ class APIClient(ABC):
     def get_top_sources(self) -> List[TopSource]:
         return []
 
+    def get_visitors_between(
+        self, start: date, end: date, path: str = None
+    ) -> List[Tuple[str, int]]:
+        raise NotImplementedError
 
-class PlausibleAPIClient(APIClient):
-    base_url = "https://plausible.io/api/v1/stats"
-    today = date.today()
-    start_this_week = today - timedelta(days=today.weekday())
-    end_this_week = start_this_week + timedelta(days=6)
-    start_last_week = start_this_week - timedelta(days=7)
-    end_last_week = end_this_week - timedelta(days=7)
-    this_week_range = f"{start_this_week},{end_this_week}"
-    last_week_range = f"{start_last_week},{end_last_week}"
-
-    def __init__(self, site_id, api_key) -> None:
-        self.site_id = site_id
-        self.api_key = api_key
-        self.headers = {"Authorization": f"Bearer {self.api_key}"}
-
-    def request(self, url, headers):
-        response = requests.get(url, headers=headers)
-        if response.status_code != 200:
-            raise Exception(
-                f"Request failed with status code {response.status_code, response.text}"
-            )
-        return response.json()
+    def get_pageviews_between(
+        self, start: date, end: date, paths: Iterable[str]
+    ) -> Dict[str, int]:
+        raise NotImplementedError
 
-    def get_visitors_this_week(self) -> List[Tuple[datetime, int]]:
-        visitors_this_week = []
+    # The async versions run the sync methods in a thread, unless a client
+    # provides a native implementation
 
-        url_this_week = "{base_url}/timeseries?date={range}&site_id={site_id}&period=custom&metrics=visitors".format(
-            range=self.this_week_range, base_url=self.base_url, site_id=self.site_id
+    async def aget_visitors_between(
+        self, start: date, end: date, path: str = None
+    ) -> List[Tuple[str, int]]:
+        return await sync_to_async(self.get_visitors_between, thread_sensitive=False)(
+            start, end, path=path
         )
-        visitor_this_week_response = self.request(url_this_week, self.headers)
-        for day in visitor_this_week_response["results"]:
-            visitors_this_week.append((day["date"], day["visitors"]))
 
-        return visitors_this_week
-
-    def get_visitors_last_week(self) -> List[Tuple[datetime, int]]:
-        visitors_last_week = []
-
-        url_last_week = "{base_url}/timeseries?date={range}&site_id={site_id}&period=custom&metrics=visitors".format(
-            range=self.last_week_range, base_url=self.base_url, site_id=self.site_id
+    async def aget_top_pages_between(
+        self, start: date, end: date, limit: int = 10
+    ) -> List[TopPage]:
+        return await sync_to_async(self.get_top_pages_between, thread_sensitive=False)(
+            start, end, limit=limit
         )
-        visitor_last_week_response = self.request(url_last_week, self.headers)
-        for day in visitor_last_week_response["results"]:
-            visitors_last_week.append((day["date"], day["visitors"]))
-
-        return visitors_last_week
-
-    def get_top_pages(self) -> List[TopPage]:
-
-        top_pages = []
 
-        url_top_pages = "{base_url}/breakdown?limit=10&date={range}&site_id={site_id}&period=custom&metrics=visitors&property=event:page".format(
-            range=self.this_week_range, base_url=self.base_url, site_id=self.site_id
+    async def aget_top_sources_between(
+        self, start: date, end: date, limit: int = 10
+    ) -> List[TopSource]:
+        return await sync_to_async(
+            self.get_top_sources_between, thread_sensitive=False
+        )(start, end, limit=limit)
+
+    async def aget_pageviews_between(
+        self, start: date, end: date, paths: Iterable[str]
+    ) -> Dict[str, int]:
+        return await sync_to_async(self.get_pageviews_between, thread_sensitive=False)(
+            start, end, list(paths)
         )
-        response = self.request(url_top_pages, headers=self.headers)
-        for page in response["results"]:
-            top_pages.append(TopPage(url=page["page"], pageviews=page["visitors"]))
-        return top_pages
 
-    def get_top_sources(self) -> List[TopSource]:
-
-        top_sources = []
-
-        url_top_sources = "{base_url}/breakdown?limit=10&date={range}&site_id={site_id}&period=custom&metrics=visitors&property=visit:source".format(
-            range=self.this_week_range, base_url=self.base_url, site_id=self.site_id
+    def get_top_pages_between(
+        self, start: date, end: date, limit: int = 10
+    ) -> List[TopPage]:
+        raise NotImplementedError
+
+    def get_top_sources_between(
+        self, start: date, end: date, limit: int = 10
+    ) -> List[TopSource]:
+        raise NotImplementedError
+
+    def get_daily_top_pages_between(
+        self, start: date, end: date, limit: int = 10
+    ) -> Dict[str, List[TopPage]]:
+        """
+        Return the top pages of every day between ``start`` and ``end`` by ISO
+        date. Providers which group by date and page override this with a
+        single query.
+        """
+        return {
+            day.isoformat(): self.get_top_pages_between(day, day, limit=limit)
+            for day in Period(start, end).each_day()
+        }
+
+    def get_daily_top_sources_between(
+        self, start: date, end: date, limit: int = 10
+    ) -> Dict[str, List[TopSource]]:
+        return {
+            day.isoformat(): self.get_top_sources_between(day, day, limit=limit)
+            for day in Period(start, end).each_day()
+        }
+
+    def iter_rows(
+        self, dimension: str, start: date, end: date, page_size: int = None
+    ) -> Iterator[dict]:
+        """
+        Yield the visitors and pageviews between ``start`` and ``end`` by date,
+        page or source, fetching ``page_size`` rows at a time.
+        """
+        raise NotImplementedError
+
+    def get_visitor_totals(self) -> Tuple[int, int]:
+        """Return the number of visitors of this and last week."""
+        return tuple(
+            sum(int(visitors) for day, visitors in self.get_visitors_between(*week))
+            for week in (self.get_this_week(), self.get_last_week())
         )
-        response = self.request(url_top_sources, headers=self.headers)
-        for source in response["results"]:
-            top_sources.append(
-                TopSource(name=source["source"], pageviews=source["visitors"])
-            )
-        return top_sources
 
+    def get_overview_group(self) -> Optional[Tuple]:
+        """
+        Return a key shared by the clients whose totals can be fetched with a
+        single call to :meth:`get_visitor_totals_by_hostname`, if any.
+        """
+        return None
 
-class GoogleAnalyticsAPIClient(APIClient):
-    def __init__(self, property_id, credentials) -> None:
-        self.property_id = property_id
-        self.client = BetaAnalyticsDataClient.from_service_account_info(
-            info=credentials
-        )
+    def get_visitor_totals_by_hostname(
+        self, hostnames: Iterable[str]
+    ) -> Dict[str, Tuple[int, int]]:
+        raise NotImplementedError
 
-    def get_visitors_this_week(self) -> List[Tuple[datetime, int]]:
-        visitors_this_week = []
 
-        visitors_this_week_request = RunReportRequest(
-            property="properties/" + self.property_id,
-            date_ranges=[DateRange(start_date="7daysAgo", end_date="today")],
-            dimensions=[Dimension(name="date")],
-            metrics=[Metric(name="activeUsers")],
-        )
-        visitors_this_week_response = self.client.run_report(visitors_this_week_request)
-        for row in visitors_this_week_response.rows:
-            date_obj = datetime.strptime(row.dimension_values[0].value, "%Y%m%d")
-            formatted_date = date_obj.strftime("%Y-%m-%d")
-            visitors_this_week.append((formatted_date, row.metric_values[0].value))
-        return visitors_this_week
+def get_api_client(site, analytics_settings) -> Optional[APIClient]:
+    """Return the client of the first provider enabled for the site, if any."""
+    return provider_registry.get_client(site, analytics_settings)
 
-    def get_visitors_last_week(self) -> List[Tuple[datetime, int]]:
-        visitors_last_week = []
 
-        visitors_last_week_request = RunReportRequest(
-            property="properties/" + self.property_id,
-            date_ranges=[DateRange(start_date="14daysAgo", end_date="7daysAgo")],
-            dimensions=[Dimension(name="date")],
-            metrics=[Metric(name="activeUsers")],
-        )
-        visitors_last_week_response = self.client.run_report(visitors_last_week_request)
-        for row in visitors_last_week_response.rows:
-            date_obj = datetime.strptime(row.dimension_values[0].value, "%Y%m%d")
-            formatted_date = date_obj.strftime("%Y-%m-%d")
-            visitors_last_week.append((formatted_date, row.metric_values[0].value))
-        return visitors_last_week
+# The clients of the providers live in their own modules, so the Google Analytics
+# SDK is only imported once a site uses it
+LAZY_ATTRIBUTES = {
+    "PlausibleAPIClient": "wagtail_analytics.lib.plausible",
+    "GoogleAnalyticsAPIClient": "wagtail_analytics.lib.google_analytics",
+    "GoogleAnalyticsClientRegistry": "wagtail_analytics.lib.google_analytics",
+    "ga_client_registry": "wagtail_analytics.lib.google_analytics",
+}
 
-    def get_top_pages(self) -> List[TopPage]:
-        top_pages = []
-
-        top_pages_request = RunReportRequest(
-            property="properties/" + self.property_id,
-            date_ranges=[DateRange(start_date="7daysAgo", end_date="today")],
-            dimensions=[Dimension(name="pagePath")],
-            metrics=[Metric(name="activeUsers")],
-            limit=10,
-        )
-        response = self.client.run_report(top_pages_request)
-        for row in response.rows:
-            top_pages.append(
-                TopPage(
-                    url=row.dimension_values[0].value,
-                    pageviews=row.metric_values[0].value,
-                )
-            )
-        return top_pages
 
-    def get_top_sources(self) -> List[TopSource]:
-        top_sources = []
-
-        top_sources_request = RunReportRequest(
-            property="properties/" + self.property_id,
-            date_ranges=[DateRange(start_date="7daysAgo", end_date="today")],
-            dimensions=[Dimension(name="pagePath")],
-            metrics=[Metric(name="activeUsers")],
-            limit=10,
-        )
-        response = self.client.run_report(top_sources_request)
-        for row in response.rows:
-            top_sources.append(
-                TopSource(
-                    name=row.dimension_values[0].value,
-                    pageviews=row.metric_values[0].value,
-                )
-            )
-        return top_sources
+def __getattr__(name):
+    module = LAZY_ATTRIBUTES.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(module), name)
@@ -0,0 +1,381 @@
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from functools import partial
+from typing import Any, Awaitable, Callable, Iterable
+
+from django.core.cache import caches
+from django.db import close_old_connections
+
+from wagtail_analytics import settings as wagtail_analytics_settings
+from wagtail_analytics.lib.dates import Period
+from wagtail_analytics.lib.instrumentation import record_cache_lookup
+from wagtail_analytics.lib.overview import get_overview
+from wagtail_analytics.lib.serialization import get_etag
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "wagtail-analytics"
+
+
+class ReportCache:
+    """
+    Cache reports in one of Django's caches.
+
+    Entries are kept for ``timeout`` seconds and then served stale for another
+    ``stale_timeout`` seconds while a single background refresh runs. A lock in
+    the cache makes sure only one process fetches a missing entry at a time.
+
+    ``fetched`` holds the time the last value returned was fetched and ``etag``
+    the ETag of its JSON, so the API views can answer a revalidation without
+    encoding the value again.
+    """
+
+    poll_interval = 0.1
+
+    # Keeps a reference to the running async refreshes, the event loop doesn't
+    _background_tasks = set()
+
+    def __init__(
+        self,
+        alias: str = None,
+        timeout: int = None,
+        stale_timeout: int = None,
+        lock_timeout: int = None,
+    ) -> None:
+        self.alias = alias or wagtail_analytics_settings.CACHE_ALIAS
+        self.timeout = (
+            wagtail_analytics_settings.CACHE_TIMEOUT if timeout is None else timeout
+        )
+        self.stale_timeout = (
+            wagtail_analytics_settings.CACHE_STALE_TIMEOUT
+            if stale_timeout is None
+            else stale_timeout
+        )
+        self.lock_timeout = (
+            wagtail_analytics_settings.CACHE_LOCK_TIMEOUT
+            if lock_timeout is None
+            else lock_timeout
+        )
+        self.fetched = None
+        self.etag = None
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @property
+    def is_enabled(self) -> bool:
+        return bool(self.timeout)
+
+    def make_key(self, *parts) -> str:
+        return ":".join([KEY_PREFIX, "report"] + [str(part) for part in parts])
+
+    def get_report_key(
+        self, site, client, period: Period = None, comparison: Period = None
+    ) -> str:
+        return self.make_key(
+            site.pk, client.provider, client.get_date_window(period, comparison)
+        )
+
+    def get_pageviews_key(
+        self, site, client, paths: Iterable[str], period: Period = None
+    ) -> str:
+        period = period or client.get_this_week()
+        return self.make_key(
+            site.pk, client.provider, period.key, "pageviews", self.hash(*paths)
+        )
+
+    def get_report(
+        self,
+        site,
+        client,
+        refresh: bool = False,
+        period: Period = None,
+        comparison: Period = None,
+    ):
+        key = self.get_report_key(site, client, period, comparison)
+        fetch = partial(client.get_report, period, comparison)
+        if refresh and self.is_enabled:
+            return self.refresh(key, fetch)
+        return self.get_or_fetch(key, fetch)
+
+    def get_section(
+        self,
+        site,
+        client,
+        name: str,
+        period: Period = None,
+        comparison: Period = None,
+    ):
+        """
+        Return a section of the report. It's taken from the whole report when
+        that's cached, as ``analytics_sync`` does, or when the provider fetches
+        every section with a single request anyway.
+        """
+        report_key = self.get_report_key(site, client, period, comparison)
+        fetch_report = partial(client.get_report, period, comparison)
+        entry = self.cache.get(report_key) if self.is_enabled else None
+        if entry is not None:
+            report = self.serve_entry(report_key, entry, fetch_report)
+        elif client.batches_reports():
+            report = self.get_or_fetch(report_key, fetch_report)
+        else:
+            return self.get_or_fetch(
+                report_key + ":section:" + name,
+                partial(client.get_section, name, period, comparison),
+            )
+        section = client.get_report_section(name, report)
+        self.etag = None
+        return section
+
+    def get_page_report(
+        self, site, client, path: str, period: Period = None, comparison: Period = None
+    ):
+        key = self.get_report_key(site, client, period, comparison)
+        key += ":page:" + self.hash(path)
+        return self.get_or_fetch(
+            key, partial(client.get_page_report, path, period, comparison)
+        )
+
+    def get_pageviews(self, site, client, paths: Iterable[str], period: Period = None):
+        paths = sorted(set(paths))
+        key = self.get_pageviews_key(site, client, paths, period)
+        return self.get_or_fetch(key, partial(client.get_pageviews, paths, period))
+
+    def get_overview(self, clients):
+        key = self.make_key(
+            "overview",
+            self.hash(
+                *(
+                    f"{site.pk}:{client.provider}:{client.get_date_window()}"
+                    for site, client in clients
+                )
+            ),
+        )
+        return self.get_or_fetch(key, lambda: get_overview(clients))
+
+    async def aget_report(
+        self, site, client, period: Period = None, comparison: Period = None
+    ):
+        key = self.get_report_key(site, client, period, comparison)
+        return await self.aget_or_fetch(
+            key, partial(client.aget_report, period, comparison)
+        )
+
+    async def aget_section(
+        self,
+        site,
+        client,
+        name: str,
+        period: Period = None,
+        comparison: Period = None,
+    ):
+        report_key = self.get_report_key(site, client, period, comparison)
+        fetch_report = partial(client.aget_report, period, comparison)
+        entry = await self.cache.aget(report_key) if self.is_enabled else None
+        if entry is not None:
+            report = await self.aserve_entry(report_key, entry, fetch_report)
+        elif client.batches_reports():
+            report = await self.aget_or_fetch(report_key, fetch_report)
+        else:
+            return await self.aget_or_fetch(
+                report_key + ":section:" + name,
+                partial(client.aget_section, name, period, comparison),
+            )
+        section = client.get_report_section(name, report)
+        self.etag = None
+        return section
+
+    async def aget_page_report(
+        self, site, client, path: str, period: Period = None, comparison: Period = None
+    ):
+        key = self.get_report_key(site, client, period, comparison)
+        key += ":page:" + self.hash(path)
+        return await self.aget_or_fetch(
+            key, partial(client.aget_page_report, path, period, comparison)
+        )
+
+    async def aget_pageviews(
+        self, site, client, paths: Iterable[str], period: Period = None
+    ):
+        paths = sorted(set(paths))
+        key = self.get_pageviews_key(site, client, paths, period)
+        return await self.aget_or_fetch(
+            key, partial(client.aget_pageviews, paths, period)
+        )
+
+    def hash(self, *values: str) -> str:
+        # Keeps keys short and free of characters memcached doesn't allow
+        return hashlib.md5("\n".join(values).encode()).hexdigest()
+
+    def get_lock_key(self, key: str) -> str:
+        return f"{key}:lock"
+
+    def get_or_fetch(self, key: str, fetch: Callable[[], Any]) -> Any:
+        if not self.is_enabled:
+            return fetch()
+
+        entry = self.cache.get(key)
+        if entry is not None:
+            return self.serve_entry(key, entry, fetch)
+
+        record_cache_lookup(self.__class__, key, "miss")
+        if self.acquire_lock(key):
+            try:
+                return self.get_value(self.refresh_entry(key, fetch))
+            finally:
+                self.release_lock(key)
+
+        entry = self.wait_for(key)
+        if entry is None:
+            entry = self.refresh_entry(key, fetch)
+        return self.get_value(entry)
+
+    def serve_entry(self, key: str, entry: dict, fetch: Callable[[], Any]) -> Any:
+        """Return the value of a cached entry, refreshing it when it's stale."""
+        if entry["expires"] < time.time():
+            record_cache_lookup(self.__class__, key, "stale")
+            if self.acquire_lock(key):
+                self.refresh_in_background(key, fetch)
+        else:
+            record_cache_lookup(self.__class__, key, "hit")
+        return self.get_value(entry)
+
+    def refresh(self, key: str, fetch: Callable[[], Any]) -> Any:
+        return self.refresh_entry(key, fetch)["value"]
+
+    def refresh_entry(self, key: str, fetch: Callable[[], Any]) -> dict:
+        entry = self.make_entry(fetch())
+        if self.should_cache(entry["value"]):
+            self.cache.set(key, entry, timeout=self.timeout + self.stale_timeout)
+        return entry
+
+    def make_entry(self, value: Any) -> dict:
+        now = time.time()
+        return {
+            "value": value,
+            "expires": now + self.timeout,
+            "fetched": now,
+            "etag": get_etag(value),
+        }
+
+    def get_value(self, entry: dict) -> Any:
+        # Entries cached by older versions don't know when they were fetched
+        self.fetched = entry.get("fetched")
+        self.etag = entry.get("etag")
+        return entry["value"]
+
+    def refresh_in_background(self, key: str, fetch: Callable[[], Any]):
+        def run():
+            # The fetch may query the database, e.g. for reports from the rollups,
+            # and the thread's connection would be left open otherwise
+            close_old_connections()
+            try:
+                self.refresh(key, fetch)
+            except Exception:
+                logger.exception("Unable to refresh cached report %s", key)
+            finally:
+                self.release_lock(key)
+                close_old_connections()
+
+        threading.Thread(target=run, daemon=True).start()
+
+    async def aget_or_fetch(self, key: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        if not self.is_enabled:
+            return await fetch()
+
+        entry = await self.cache.aget(key)
+        if entry is not None:
+            return await self.aserve_entry(key, entry, fetch)
+
+        record_cache_lookup(self.__class__, key, "miss")
+        if await self.aacquire_lock(key):
+            try:
+                return self.get_value(await self.arefresh_entry(key, fetch))
+            finally:
+                await self.arelease_lock(key)
+
+        entry = await self.await_for(key)
+        if entry is None:
+            entry = await self.arefresh_entry(key, fetch)
+        return self.get_value(entry)
+
+    async def aserve_entry(
+        self, key: str, entry: dict, fetch: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        if entry["expires"] < time.time():
+            record_cache_lookup(self.__class__, key, "stale")
+            if await self.aacquire_lock(key):
+                self.arefresh_in_background(key, fetch)
+        else:
+            record_cache_lookup(self.__class__, key, "hit")
+        return self.get_value(entry)
+
+    async def arefresh(self, key: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        return (await self.arefresh_entry(key, fetch))["value"]
+
+    async def arefresh_entry(
+        self, key: str, fetch: Callable[[], Awaitable[Any]]
+    ) -> dict:
+        entry = self.make_entry(await fetch())
+        if self.should_cache(entry["value"]):
+            await self.cache.aset(key, entry, timeout=self.timeout + self.stale_timeout)
+        return entry
+
+    def arefresh_in_background(self, key: str, fetch: Callable[[], Awaitable[Any]]):
+        async def run():
+            try:
+                await self.arefresh(key, fetch)
+            except Exception:
+                logger.exception("Unable to refresh cached report %s", key)
+            finally:
+                await self.arelease_lock(key)
+
+        task = asyncio.ensure_future(run())
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    def should_cache(self, value: Any) -> bool:
+        # Don't keep partial reports around, the next request should retry them
+        return not getattr(value, "errors", None)
+
+    def acquire_lock(self, key: str) -> bool:
+        return self.cache.add(self.get_lock_key(key), 1, timeout=self.lock_timeout)
+
+    def release_lock(self, key: str):
+        self.cache.delete(self.get_lock_key(key))
+
+    def wait_for(self, key: str):
+        deadline = time.time() + self.lock_timeout
+        lock_key = self.get_lock_key(key)
+        while time.time() < deadline:
+            time.sleep(self.poll_interval)
+            entry = self.cache.get(key)
+            if entry is not None:
+                return entry
+            if self.cache.get(lock_key) is None:
+                break
+        return self.cache.get(key)
+
+    async def aacquire_lock(self, key: str) -> bool:
+        return await self.cache.aadd(
+            self.get_lock_key(key), 1, timeout=self.lock_timeout
+        )
+
+    async def arelease_lock(self, key: str):
+        await self.cache.adelete(self.get_lock_key(key))
+
+    async def await_for(self, key: str):
+        deadline = time.time() + self.lock_timeout
+        lock_key = self.get_lock_key(key)
+        while time.time() < deadline:
+            await asyncio.sleep(self.poll_interval)
+            entry = await self.cache.aget(key)
+            if entry is not None:
+                return entry
+            if await self.cache.aget(lock_key) is None:
+                break
+        return await self.cache.aget(key)
@@ -0,0 +1,312 @@
+import atexit
+import hashlib
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from wagtail_analytics import settings as wagtail_analytics_settings
+from wagtail_analytics.lib import http
+from wagtail_analytics.lib.exceptions import AnalyticsError
+from wagtail_analytics.lib.instrumentation import record_upstream_request
+from wagtail_analytics.lib.providers import get_plausible_url
+from wagtail_analytics.lib.ratelimit import RateLimiter
+from wagtail_analytics.lib.settings_cache import settings_cache
+from wagtail_analytics.types import Event
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of events the Measurement Protocol accepts per request
+GA_MAX_EVENTS = 25
+
+
+def get_client_id(event: Event) -> str:
+    """
+    Return an anonymous visitor id for the Measurement Protocol.
+
+    Like Plausible, visitors are identified by a hash of their IP address and
+    user agent which changes every day, so no cookie is needed.
+    """
+    value = "\n".join(
+        [settings.SECRET_KEY, date.today().isoformat(), event.ip, event.user_agent]
+    )
+    digest = hashlib.sha256(value.encode()).hexdigest()
+    return "%d.%d" % (int(digest[:8], 16), int(digest[8:16], 16))
+
+
+class Forwarder:
+    """
+    Send events to a provider, no more than ``COLLECT_RATE_LIMITS`` requests a
+    second per process.
+    """
+
+    provider = None
+
+    def __init__(self) -> None:
+        self.rate_limiter = RateLimiter(
+            wagtail_analytics_settings.COLLECT_RATE_LIMITS.get(self.provider, 0)
+        )
+
+    def is_enabled(self, analytics_settings) -> bool:
+        raise NotImplementedError
+
+    def forward(self, site, analytics_settings, events: List[Event]):
+        raise NotImplementedError
+
+    def send(self, operation: str, method: str, url: str, **kwargs):
+        self.rate_limiter.acquire()
+        start = time.perf_counter()
+        try:
+            response = http.request(method, url, **kwargs)
+        except AnalyticsError as e:
+            record_upstream_request(
+                self.__class__,
+                self.provider,
+                operation,
+                time.perf_counter() - start,
+                status=e.upstream_status,
+                error=e,
+            )
+            raise
+        record_upstream_request(
+            self.__class__,
+            self.provider,
+            operation,
+            time.perf_counter() - start,
+            bytes_received=len(response.content),
+            retries=response.retries,
+            status=response.status_code,
+        )
+        return response
+
+
+class PlausibleForwarder(Forwarder):
+    """
+    Forward to the Plausible Events API, which takes one event per request.
+    The events of a batch are sent ``COLLECT_CONCURRENCY`` at a time.
+    """
+
+    provider = "plausible"
+    url = "{base_url}/api/event"
+
+    def is_enabled(self, analytics_settings) -> bool:
+        return analytics_settings.plausible_enabled
+
+    def forward(self, site, analytics_settings, events: List[Event]):
+        url = self.url.format(
+            base_url=get_plausible_url(analytics_settings.plausible_domain)
+        )
+        workers = min(len(events), wagtail_analytics_settings.COLLECT_CONCURRENCY)
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = [
+                executor.submit(self.send_event, site, url, event) for event in events
+            ]
+        # Every event was tried, report the first failure
+        for future in futures:
+            if future.exception() is not None:
+                raise future.exception()
+
+    def send_event(self, site, url: str, event: Event):
+        data = {
+            "name": event.name,
+            "url": event.url,
+            "domain": site.hostname,
+            "referrer": event.referrer,
+        }
+        if event.props:
+            data["props"] = event.props
+        self.send(
+            "event",
+            "POST",
+            url,
+            json=data,
+            headers={
+                "User-Agent": event.user_agent,
+                "X-Forwarded-For": event.ip,
+            },
+        )
+
+
+class GoogleAnalyticsForwarder(Forwarder):
+    """Forward to the GA4 Measurement Protocol, in batches per visitor."""
+
+    provider = "google_analytics"
+    url = "https://www.google-analytics.com/mp/collect"
+
+    def is_enabled(self, analytics_settings) -> bool:
+        return bool(
+            analytics_settings.google_analytics_enabled
+            and analytics_settings.google_analytics_measurement_id
+            and analytics_settings.google_analytics_api_secret
+        )
+
+    def get_event_data(self, event: Event) -> dict:
+        params = dict(event.props)
+        params["page_location"] = event.url
+        if event.referrer:
+            params["page_referrer"] = event.referrer
+        return {
+            "name": "page_view" if event.name == "pageview" else event.name,
+            # Every event keeps its own time, a batch spans a visitor's events
+            "timestamp_micros": int(event.timestamp * 1000000),
+            "params": params,
+        }
+
+    def forward(self, site, analytics_settings, events: List[Event]):
+        params = {
+            "measurement_id": analytics_settings.google_analytics_measurement_id,
+            "api_secret": analytics_settings.google_analytics_api_secret,
+        }
+        visitors = {}
+        for event in events:
+            visitors.setdefault(get_client_id(event), []).append(event)
+
+        for client_id, visitor_events in visitors.items():
+            for start in range(0, len(visitor_events), GA_MAX_EVENTS):
+                end = start + GA_MAX_EVENTS
+                batch = visitor_events[start:end]
+                self.send(
+                    "mp-collect",
+                    "POST",
+                    self.url,
+                    params=params,
+                    json={
+                        "client_id": client_id,
+                        "events": [self.get_event_data(event) for event in batch],
+                    },
+                    headers={"User-Agent": batch[0].user_agent},
+                )
+
+
+class EventQueue:
+    """
+    Buffer collected events in memory and forward them from worker threads.
+
+    The queue holds at most ``maxsize`` events. When it's full new events are
+    refused, so a slow or unavailable provider can't use up the memory of the
+    process. Workers forward up to ``batch_size`` events at a time, or whatever
+    arrived within ``flush_interval`` seconds.
+    """
+
+    forwarder_classes = [PlausibleForwarder, GoogleAnalyticsForwarder]
+
+    def __init__(
+        self,
+        maxsize: int = None,
+        batch_size: int = None,
+        flush_interval: float = None,
+        workers: int = None,
+    ) -> None:
+        self.maxsize = maxsize or wagtail_analytics_settings.COLLECT_QUEUE_SIZE
+        self.batch_size = batch_size or wagtail_analytics_settings.COLLECT_BATCH_SIZE
+        self.flush_interval = (
+            wagtail_analytics_settings.COLLECT_FLUSH_INTERVAL
+            if flush_interval is None
+            else flush_interval
+        )
+        self.workers = workers or wagtail_analytics_settings.COLLECT_WORKERS
+        self.forwarders = [
+            forwarder_class() for forwarder_class in self.forwarder_classes
+        ]
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._threads = []
+
+    def ensure_started(self):
+        # A forked process inherits the queue, but not the worker threads
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.maxsize)
+            self._threads = [
+                threading.Thread(
+                    target=self.run,
+                    name="wagtail-analytics-collect-%s" % i,
+                    daemon=True,
+                )
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+            self._pid = os.getpid()
+
+    def put(self, event: Event) -> bool:
+        """Queue ``event``, returns False when the queue is full."""
+        self.ensure_started()
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def get_batch(self, timeout: Optional[float] = None) -> List[Event]:
+        batch = [self._queue.get(timeout=timeout)]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.get_batch()
+            try:
+                self.forward(batch)
+            except Exception:
+                logger.exception("Unable to forward %s events", len(batch))
+            finally:
+                for i in range(len(batch)):
+                    self._queue.task_done()
+                close_old_connections()
+
+    def forward(self, events: List[Event]):
+        sites: Dict[int, List[Event]] = {}
+        for event in events:
+            sites.setdefault(event.site_id, []).append(event)
+
+        for site_id, site_events in sites.items():
+            site = settings_cache.get_site(site_id)
+            analytics_settings = settings_cache.get_settings(site)
+            for forwarder in self.forwarders:
+                if not forwarder.is_enabled(analytics_settings):
+                    continue
+                try:
+                    forwarder.forward(site, analytics_settings, site_events)
+                except AnalyticsError as e:
+                    # Events aren't retried, the queue has to make progress
+                    logger.warning(
+                        "Unable to forward %s events to %s: %s",
+                        len(site_events),
+                        forwarder.provider,
+                        e,
+                    )
+
+    def flush(self, timeout: float = 5):
+        """Wait up to ``timeout`` seconds for the queued events to be forwarded."""
+        if self._pid != os.getpid():
+            return
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+
+event_queue = EventQueue()
+
+atexit.register(event_queue.flush)
@@ -0,0 +1,189 @@
+import calendar
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, tzinfo
+from typing import List, Mapping, Optional, Tuple
+
+from django.conf import settings
+from django.utils import timezone
+
+try:
+    import zoneinfo
+except ImportError:  # pragma: no cover
+    from backports import zoneinfo
+
+GRANULARITIES = ("day", "week", "month")
+
+COMPARISONS = ("previous", "year")
+
+# Longest range which can be requested, about ten years
+MAX_DAYS = 3660
+
+
+@dataclass(frozen=True)
+class Period:
+    """
+    An inclusive range of days.
+
+    Unpacks into its start and end, so it can be passed on to the ``*_between``
+    methods of the clients.
+    """
+
+    start: date
+    end: date
+
+    def __iter__(self):
+        yield self.start
+        yield self.end
+
+    @property
+    def key(self) -> str:
+        return f"{self.start.isoformat()}..{self.end.isoformat()}"
+
+    @property
+    def days(self) -> int:
+        return (self.end - self.start).days + 1
+
+    def each_day(self) -> List[date]:
+        return [self.start + timedelta(days=i) for i in range(self.days)]
+
+    @property
+    def months(self) -> int:
+        """Return the number of whole calendar months the period spans, or 0."""
+        if self.start.day != 1 or (self.end + timedelta(days=1)).day != 1:
+            return 0
+        return (
+            (self.end.year - self.start.year) * 12
+            + self.end.month
+            - self.start.month
+            + 1
+        )
+
+    def previous(self) -> "Period":
+        """
+        Return the period right before this one: as many calendar months for
+        whole months, so May is compared with all of April, otherwise as many
+        days.
+        """
+        end = self.start - timedelta(days=1)
+        if self.months:
+            return Period(shift_month(self.start, -self.months), end)
+        return Period(end - timedelta(days=self.days - 1), end)
+
+    def previous_year(self) -> "Period":
+        start = shift_year(self.start, -1)
+        if self.months:
+            # February has a day more or less a year earlier
+            return Period(start, shift_month(start, self.months) - timedelta(days=1))
+        return Period(start, shift_year(self.end, -1))
+
+    def compare(self, comparison: str = "previous") -> "Period":
+        if comparison == "year":
+            return self.previous_year()
+        return self.previous()
+
+
+def fill_days(values: dict, start: date, end: date, default=0) -> List[tuple]:
+    """
+    Return a row for every day between start and end, as the Plausible v1 API
+    does, taking the values by ISO date.
+    """
+    return [
+        (day.isoformat(), values.get(day.isoformat(), default))
+        for day in Period(start, end).each_day()
+    ]
+
+
+def shift_year(day: date, years: int) -> date:
+    year = day.year + years
+    # The 29th of February becomes the 28th in other years
+    return day.replace(
+        year=year, day=min(day.day, calendar.monthrange(year, day.month)[1])
+    )
+
+
+def shift_month(day: date, months: int) -> date:
+    month = day.month - 1 + months
+    year = day.year + month // 12
+    month = month % 12 + 1
+    return day.replace(
+        year=year,
+        month=month,
+        day=min(day.day, calendar.monthrange(year, month)[1]),
+    )
+
+
+def get_time_zone(name: str = None) -> tzinfo:
+    if name:
+        try:
+            return zoneinfo.ZoneInfo(name)
+        except (KeyError, ValueError):
+            raise ValueError(f"Unknown time zone {name!r}")
+    return timezone.get_default_timezone()
+
+
+def get_today(time_zone: str = None) -> date:
+    """Return today's date in the given time zone, or the default one."""
+    if not settings.USE_TZ and not time_zone:
+        return date.today()
+    return timezone.now().astimezone(get_time_zone(time_zone)).date()
+
+
+def get_local_date(value: datetime, time_zone: str = None) -> date:
+    """
+    Return the date of ``value`` in the given time zone, or the default one.
+    Naive datetimes, as stored with ``USE_TZ = False``, are in the default one.
+    """
+    if timezone.is_naive(value):
+        if not time_zone:
+            return value.date()
+        value = timezone.make_aware(value, timezone.get_default_timezone())
+    return value.astimezone(get_time_zone(time_zone)).date()
+
+
+def get_period(granularity: str = "week", day: date = None) -> Period:
+    """Return the day, week (starting on Monday) or month ``day`` falls in."""
+    day = day or get_today()
+    if granularity == "day":
+        return Period(day, day)
+    if granularity == "month":
+        last = calendar.monthrange(day.year, day.month)[1]
+        return Period(day.replace(day=1), day.replace(day=last))
+    if granularity == "week":
+        start = day - timedelta(days=day.weekday())
+        return Period(start, start + timedelta(days=6))
+    raise ValueError("Period must be one of %s" % ", ".join(GRANULARITIES))
+
+
+def parse_periods(
+    params: Mapping[str, str], today: date = None
+) -> Tuple[Optional[Period], Optional[Period]]:
+    """
+    Return the period and comparison period asked for by query parameters.
+
+    Either ``start`` and ``end`` or a ``period`` of day, week or month around
+    ``date`` (today by default) select the period. It's compared to the period
+    before it, or the same period a year earlier with ``compare=year``. Returns
+    ``(None, None)`` when no period is asked for.
+    """
+    start, end = params.get("start"), params.get("end")
+    granularity, compare = params.get("period"), params.get("compare")
+    if not (start or end or granularity or compare):
+        return None, None
+
+    today = today or get_today()
+    if start or end:
+        end = date.fromisoformat(end) if end else today
+        start = date.fromisoformat(start) if start else end
+        if start > end:
+            raise ValueError("Start must be before end")
+        period = Period(start, end)
+    else:
+        day = date.fromisoformat(params["date"]) if params.get("date") else today
+        period = get_period(granularity or "week", day)
+    if period.days > MAX_DAYS:
+        raise ValueError("Periods can't be longer than %s days" % MAX_DAYS)
+
+    compare = compare or "previous"
+    if compare not in COMPARISONS:
+        raise ValueError("Compare must be one of %s" % ", ".join(COMPARISONS))
+    return period, period.compare(compare)
@@ -0,0 +1,24 @@
+class AnalyticsError(Exception):
+    #: status code the report views respond with
+    status_code = 502
+
+    def __init__(self, message="", upstream_status=None, retry_after=None) -> None:
+        super().__init__(message)
+        self.upstream_status = upstream_status
+        self.retry_after = retry_after
+
+
+class UpstreamError(AnalyticsError):
+    pass
+
+
+class AuthenticationError(UpstreamError):
+    pass
+
+
+class RateLimitError(UpstreamError):
+    status_code = 429
+
+
+class UpstreamTimeout(UpstreamError):
+    status_code = 504
@@ -0,0 +1,66 @@
+import csv
+import json
+from datetime import date, timedelta
+from typing import Iterable, Iterator, Tuple
+
+from wagtail_analytics.lib.dates import MAX_DAYS, get_today
+
+DIMENSIONS = ("date", "page", "source")
+
+FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+
+class Echo:
+    """A file-like object which returns what's written, for streaming csv rows."""
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def get_fields(dimension: str):
+    return [dimension, "visitors", "pageviews"]
+
+
+def parse_params(
+    dimension: str = None,
+    start: str = None,
+    end: str = None,
+    format: str = None,
+    today: date = None,
+) -> Tuple[str, date, date, str]:
+    """Validate the export parameters, defaulting to the pages of the last 30 days."""
+    dimension = dimension or "page"
+    if dimension not in DIMENSIONS:
+        raise ValueError("Dimension must be one of %s" % ", ".join(DIMENSIONS))
+    format = format or "csv"
+    if format not in FORMATS:
+        raise ValueError("Format must be one of %s" % ", ".join(FORMATS))
+    end = date.fromisoformat(end) if end else today or get_today()
+    start = date.fromisoformat(start) if start else end - timedelta(days=29)
+    if start > end:
+        raise ValueError("Start must be before end")
+    if (end - start).days > MAX_DAYS:
+        raise ValueError("Date range can't be longer than %s days" % MAX_DAYS)
+    return dimension, start, end, format
+
+
+def serialize_csv(rows: Iterable[dict], dimension: str) -> Iterator[str]:
+    writer = csv.DictWriter(Echo(), fieldnames=get_fields(dimension))
+    yield writer.writeheader()
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def serialize_ndjson(rows: Iterable[dict], dimension: str) -> Iterator[str]:
+    for row in rows:
+        yield json.dumps(row) + "\n"
+
+
+def serialize(rows: Iterable[dict], dimension: str, format: str) -> Iterator[str]:
+    """Return the rows as chunks of CSV or newline delimited JSON."""
+    if format == "ndjson":
+        return serialize_ndjson(rows, dimension)
+    return serialize_csv(rows, dimension)
@@ -0,0 +1,675 @@
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import time
+from datetime import date
+from functools import partial
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from weakref import WeakKeyDictionary
+
+from google.analytics.data_v1beta import (
+    BetaAnalyticsDataAsyncClient,
+    BetaAnalyticsDataClient,
+)
+from google.analytics.data_v1beta.types import (
+    BatchRunReportsRequest,
+    DateRange,
+    Dimension,
+    Filter,
+    FilterExpression,
+    Metric,
+    OrderBy,
+    RunReportRequest,
+)
+from google.api_core import exceptions as google_exceptions
+from google.auth import exceptions as google_auth_exceptions
+
+from wagtail_analytics import settings as wagtail_analytics_settings
+from wagtail_analytics.lib.analytics import APIClient
+from wagtail_analytics.lib.dates import Period, fill_days
+from wagtail_analytics.lib.exceptions import (
+    AuthenticationError,
+    RateLimitError,
+    UpstreamError,
+    UpstreamTimeout,
+)
+from wagtail_analytics.lib.instrumentation import (
+    record_quota,
+    record_upstream_request,
+    section,
+)
+from wagtail_analytics.types import Report, TopPage, TopSource, format_date
+
+logger = logging.getLogger(__name__)
+
+AUTH_PLUGIN_FAILURE = "Getting metadata from plugin failed"
+
+
+class GoogleAnalyticsClientRegistry:
+    """
+    Keep one data client per service account for the lifetime of the process.
+
+    The clients hold a gRPC channel and credentials which refresh their own
+    tokens, and are safe to share between threads. They're looked up by the
+    hash of the key content, so other credentials get a client of their own.
+    """
+
+    def __init__(self) -> None:
+        self._clients = {}
+        self._async_clients = WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def get_key(self, credentials: Union[str, dict]) -> str:
+        if not isinstance(credentials, str):
+            credentials = json.dumps(credentials, sort_keys=True)
+        return hashlib.sha256(credentials.encode()).hexdigest()
+
+    def get_client(self, credentials: Union[str, dict]) -> BetaAnalyticsDataClient:
+        key = self.get_key(credentials)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                if isinstance(credentials, str):
+                    credentials = json.loads(credentials)
+                client = BetaAnalyticsDataClient.from_service_account_info(
+                    info=credentials
+                )
+                self._clients[key] = client
+        return client
+
+    def get_async_client(
+        self, credentials: Union[str, dict]
+    ) -> BetaAnalyticsDataAsyncClient:
+        # Async channels belong to the event loop they were created in
+        loop = asyncio.get_running_loop()
+        key = self.get_key(credentials)
+        with self._lock:
+            clients = self._async_clients.setdefault(loop, {})
+            client = clients.get(key)
+            if client is None:
+                if isinstance(credentials, str):
+                    credentials = json.loads(credentials)
+                client = BetaAnalyticsDataAsyncClient.from_service_account_info(
+                    info=credentials
+                )
+                clients[key] = client
+        return client
+
+    def clear(self):
+        """
+        Drop the clients. They aren't closed, requests in flight may still use
+        them; their channels are closed once they're garbage collected.
+        """
+        with self._lock:
+            self._clients = {}
+            self._async_clients = WeakKeyDictionary()
+
+
+ga_client_registry = GoogleAnalyticsClientRegistry()
+
+
+class GoogleAnalyticsAPIClient(APIClient):
+    provider = "google_analytics"
+    export_dimensions = {"date": "date", "page": "pagePath", "source": "sessionSource"}
+    max_page_size = 250000
+
+    def __init__(self, property_id, credentials: Union[str, dict]) -> None:
+        self.property_id = property_id
+        self.credentials = credentials
+
+    @property
+    def client(self) -> BetaAnalyticsDataClient:
+        return ga_client_registry.get_client(self.credentials)
+
+    @property
+    def async_client(self) -> BetaAnalyticsDataAsyncClient:
+        return ga_client_registry.get_async_client(self.credentials)
+
+    def run_report(self, request: RunReportRequest):
+        return self.call("run_report", request)
+
+    def batch_run_reports(self, request: BatchRunReportsRequest):
+        return self.call("batch_run_reports", request)
+
+    async def arun_report(self, request: RunReportRequest):
+        return await self.acall("run_report", request)
+
+    async def abatch_run_reports(self, request: BatchRunReportsRequest):
+        return await self.acall("batch_run_reports", request)
+
+    def get_rate_limit_account(self) -> Optional[str]:
+        return self.property_id
+
+    def call(self, operation: str, request):
+        self.throttle()
+        start = time.perf_counter()
+        try:
+            response = getattr(self.client, operation)(
+                request, timeout=wagtail_analytics_settings.REPORT_TIMEOUT
+            )
+        except Exception as e:
+            self.record_call_error(operation, start, e)
+            raise self.get_error(e) from e
+        self.record_call(operation, start, response)
+        return response
+
+    async def acall(self, operation: str, request):
+        await self.athrottle()
+        start = time.perf_counter()
+        try:
+            response = await getattr(self.async_client, operation)(
+                request, timeout=wagtail_analytics_settings.REPORT_TIMEOUT
+            )
+        except Exception as e:
+            self.record_call_error(operation, start, e)
+            raise self.get_error(e) from e
+        self.record_call(operation, start, response)
+        return response
+
+    def get_error(self, error: Exception) -> Exception:
+        """Return the API error as one of our errors, other errors as they are."""
+        if isinstance(error, google_auth_exceptions.RefreshError):
+            # The credentials were revoked or the service account deleted
+            return AuthenticationError(str(error))
+        if not isinstance(error, google_exceptions.GoogleAPICallError):
+            return error
+        status = error.code
+        if isinstance(error, google_exceptions.ServiceUnavailable) and (
+            AUTH_PLUGIN_FAILURE in error.message
+        ):
+            # gRPC reports a RefreshError of the credentials as unavailable
+            return AuthenticationError(str(error), upstream_status=status)
+        if isinstance(
+            error,
+            (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests),
+        ):
+            rate_limit_error = RateLimitError(str(error), upstream_status=status)
+            self.handle_rate_limit(rate_limit_error)
+            return rate_limit_error
+        if isinstance(
+            error,
+            (google_exceptions.Unauthenticated, google_exceptions.PermissionDenied),
+        ):
+            return AuthenticationError(str(error), upstream_status=status)
+        if isinstance(error, google_exceptions.DeadlineExceeded):
+            return UpstreamTimeout(str(error), upstream_status=status)
+        return UpstreamError(str(error), upstream_status=status)
+
+    def record_call_error(self, operation: str, start: float, error: Exception):
+        record_upstream_request(
+            self.__class__,
+            self.provider,
+            operation,
+            time.perf_counter() - start,
+            status=getattr(error, "code", None),
+            error=error,
+        )
+
+    def record_call(self, operation: str, start: float, response):
+        record_upstream_request(
+            self.__class__,
+            self.provider,
+            operation,
+            time.perf_counter() - start,
+            bytes_received=type(response).pb(response).ByteSize(),
+            status="OK",
+        )
+        reports = getattr(response, "reports", None) or [response]
+        for report in reports:
+            if report.property_quota:
+                quota = record_quota(
+                    self.__class__,
+                    self.provider,
+                    self.property_id,
+                    report.property_quota,
+                )
+                if quota and self.rate_limit_bucket is not None:
+                    self.rate_limit_bucket.report_quota(quota)
+
+    def batches_reports(self) -> bool:
+        return wagtail_analytics_settings.GA_BATCH_REQUESTS
+
+    def get_report(self, period: Period = None, comparison: Period = None) -> Report:
+        if not wagtail_analytics_settings.GA_BATCH_REQUESTS:
+            return super().get_report(period, comparison)
+        try:
+            return self.get_batched_report(period, comparison)
+        except UpstreamError as e:
+            if not self.is_batch_error(e):
+                raise
+            logger.warning("Batched report request failed, falling back: %s", e)
+            return super().get_report(period, comparison)
+
+    async def aget_report(
+        self, period: Period = None, comparison: Period = None
+    ) -> Report:
+        if not wagtail_analytics_settings.GA_BATCH_REQUESTS:
+            return await super().aget_report(period, comparison)
+        try:
+            return await self.aget_batched_report(period, comparison)
+        except UpstreamError as e:
+            if not self.is_batch_error(e):
+                raise
+            logger.warning("Batched report request failed, falling back: %s", e)
+            return await super().aget_report(period, comparison)
+
+    def is_batch_error(self, error: Exception) -> bool:
+        """
+        Whether the API rejected the batch itself, the sections might still be
+        fetched one by one. Other errors would fail those requests just the same.
+        """
+        return isinstance(error.__cause__, google_exceptions.InvalidArgument)
+
+    def get_batched_report(
+        self, period: Period = None, comparison: Period = None
+    ) -> Report:
+        start = time.perf_counter()
+        sections = self.get_batch_sections(*self.get_periods(period, comparison))
+        with section("batch"):
+            batch_response = self.batch_run_reports(self.get_batch_request(sections))
+        return self.parse_batch_response(sections, batch_response, start)
+
+    async def aget_batched_report(
+        self, period: Period = None, comparison: Period = None
+    ) -> Report:
+        start = time.perf_counter()
+        sections = self.get_batch_sections(*self.get_periods(period, comparison))
+        with section("batch"):
+            batch_response = await self.abatch_run_reports(
+                self.get_batch_request(sections)
+            )
+        return self.parse_batch_response(sections, batch_response, start)
+
+    def get_batch_sections(self, period: Period, comparison: Period):
+        return {
+            "visitors_this_week": (
+                self.get_visitors_request(*period),
+                partial(self.parse_visitors, start=period.start, end=period.end),
+            ),
+            "visitors_last_week": (
+                self.get_visitors_request(*comparison),
+                partial(
+                    self.parse_visitors, start=comparison.start, end=comparison.end
+                ),
+            ),
+            "top_pages": (self.get_top_pages_request(*period), self.parse_top_pages),
+            "top_sources": (
+                self.get_top_sources_request(*period),
+                self.parse_top_sources,
+            ),
+        }
+
+    def get_batch_request(self, sections) -> BatchRunReportsRequest:
+        return BatchRunReportsRequest(
+            property=self.get_property(),
+            requests=[request for request, parse in sections.values()],
+        )
+
+    def parse_batch_response(self, sections, batch_response, start) -> Report:
+        results = {
+            name: parse(response)
+            for (name, (request, parse)), response in zip(
+                sections.items(), batch_response.reports
+            )
+        }
+        return self.build_report(results, [], start)
+
+    def get_property(self) -> str:
+        return "properties/" + self.property_id
+
+    def get_visitors_request(
+        self, start_date, end_date, path: str = None
+    ) -> RunReportRequest:
+        request = RunReportRequest(
+            property=self.get_property(),
+            date_ranges=[DateRange(start_date=str(start_date), end_date=str(end_date))],
+            dimensions=[Dimension(name="date")],
+            metrics=[Metric(name="activeUsers")],
+            order_bys=[
+                OrderBy(dimension=OrderBy.DimensionOrderBy(dimension_name="date"))
+            ],
+            return_property_quota=True,
+        )
+        if path:
+            request.dimension_filter = FilterExpression(
+                filter=Filter(
+                    field_name="pagePath",
+                    string_filter=Filter.StringFilter(
+                        value=path, match_type=Filter.StringFilter.MatchType.EXACT
+                    ),
+                )
+            )
+        return request
+
+    def get_pageviews_request(
+        self, start_date, end_date, paths: List[str]
+    ) -> RunReportRequest:
+        return RunReportRequest(
+            property=self.get_property(),
+            date_ranges=[DateRange(start_date=str(start_date), end_date=str(end_date))],
+            dimensions=[Dimension(name="pagePath")],
+            metrics=[Metric(name="screenPageViews")],
+            dimension_filter=FilterExpression(
+                filter=Filter(
+                    field_name="pagePath",
+                    in_list_filter=Filter.InListFilter(values=paths),
+                )
+            ),
+            limit=len(paths),
+            return_property_quota=True,
+        )
+
+    def get_visitor_totals_request(self, hostnames: List[str] = None):
+        # Both weeks in one request, the rows are split by a dateRange dimension
+        request = RunReportRequest(
+            property=self.get_property(),
+            date_ranges=[
+                DateRange(start_date=str(start), end_date=str(end), name=name)
+                for name, (start, end) in (
+                    ("this_week", self.get_this_week()),
+                    ("last_week", self.get_last_week()),
+                )
+            ],
+            metrics=[Metric(name="activeUsers")],
+            return_property_quota=True,
+        )
+        if hostnames:
+            request.dimensions = [Dimension(name="hostName")]
+            request.dimension_filter = FilterExpression(
+                filter=Filter(
+                    field_name="hostName",
+                    in_list_filter=Filter.InListFilter(values=hostnames),
+                )
+            )
+        return request
+
+    def get_top_pages_request(
+        self, start_date="7daysAgo", end_date="today", limit=10
+    ) -> RunReportRequest:
+        return RunReportRequest(
+            property=self.get_property(),
+            date_ranges=[DateRange(start_date=str(start_date), end_date=str(end_date))],
+            dimensions=[Dimension(name="pagePath")],
+            metrics=[Metric(name="activeUsers")],
+            order_bys=[
+                OrderBy(
+                    metric=OrderBy.MetricOrderBy(metric_name="activeUsers"), desc=True
+                )
+            ],
+            limit=limit,
+            return_property_quota=True,
+        )
+
+    def get_top_sources_request(
+        self, start_date="7daysAgo", end_date="today", limit=10
+    ) -> RunReportRequest:
+        return RunReportRequest(
+            property=self.get_property(),
+            date_ranges=[DateRange(start_date=str(start_date), end_date=str(end_date))],
+            dimensions=[Dimension(name="sessionSource")],
+            metrics=[Metric(name="activeUsers")],
+            order_bys=[
+                OrderBy(
+                    metric=OrderBy.MetricOrderBy(metric_name="activeUsers"), desc=True
+                )
+            ],
+            limit=limit,
+            return_property_quota=True,
+        )
+
+    def get_visitors_this_week_request(self) -> RunReportRequest:
+        return self.get_visitors_request(*self.get_this_week())
+
+    def get_visitors_last_week_request(self) -> RunReportRequest:
+        return self.get_visitors_request(*self.get_last_week())
+
+    def parse_visitors(
+        self, response, start: date = None, end: date = None
+    ) -> List[Tuple[str, int]]:
+        """
+        Return the visitors by day. Given the requested range, days without
+        visitors, which the API leaves out, are filled in with zeros.
+        """
+        visitors = {
+            format_date(row.dimension_values[0].value): int(row.metric_values[0].value)
+            for row in response.rows
+        }
+        if start is None or end is None:
+            return list(visitors.items())
+        return fill_days(visitors, start, end)
+
+    def parse_top_pages(self, response) -> List[TopPage]:
+        top_pages = []
+        for row in response.rows:
+            top_pages.append(
+                TopPage(
+                    url=row.dimension_values[0].value,
+                    pageviews=int(row.metric_values[0].value),
+                )
+            )
+        return top_pages
+
+    def parse_top_sources(self, response) -> List[TopSource]:
+        top_sources = []
+        for row in response.rows:
+            top_sources.append(
+                TopSource(
+                    name=row.dimension_values[0].value,
+                    pageviews=int(row.metric_values[0].value),
+                )
+            )
+        return top_sources
+
+    def parse_pageviews(self, response, paths: List[str]) -> Dict[str, int]:
+        pageviews = dict.fromkeys(paths, 0)
+        for row in response.rows:
+            pageviews[row.dimension_values[0].value] = int(row.metric_values[0].value)
+        return pageviews
+
+    def parse_visitor_totals(self, response) -> Dict[str, Tuple[int, int]]:
+        """Return the totals of both weeks by hostname, or by None without one."""
+        names = [header.name for header in response.dimension_headers]
+        totals = {}
+        for row in response.rows:
+            values = dict(zip(names, (value.value for value in row.dimension_values)))
+            this_week, last_week = totals.get(values.get("hostName"), (0, 0))
+            visitors = int(row.metric_values[0].value)
+            if values.get("dateRange") == "last_week":
+                last_week += visitors
+            else:
+                this_week += visitors
+            totals[values.get("hostName")] = (this_week, last_week)
+        return totals
+
+    def get_visitors_this_week(self) -> List[Tuple[str, int]]:
+        response = self.run_report(self.get_visitors_this_week_request())
+        return self.parse_visitors(response, *self.get_this_week())
+
+    def get_visitors_last_week(self) -> List[Tuple[str, int]]:
+        response = self.run_report(self.get_visitors_last_week_request())
+        return self.parse_visitors(response, *self.get_last_week())
+
+    def get_top_pages(self) -> List[TopPage]:
+        response = self.run_report(self.get_top_pages_request(*self.get_this_week()))
+        return self.parse_top_pages(response)
+
+    def get_top_sources(self) -> List[TopSource]:
+        response = self.run_report(self.get_top_sources_request(*self.get_this_week()))
+        return self.parse_top_sources(response)
+
+    def get_visitors_between(
+        self, start: date, end: date, path: str = None
+    ) -> List[Tuple[str, int]]:
+        response = self.run_report(self.get_visitors_request(start, end, path=path))
+        return self.parse_visitors(response, start, end)
+
+    def get_pageviews_between(
+        self, start: date, end: date, paths: Iterable[str]
+    ) -> Dict[str, int]:
+        paths = list(paths)
+        response = self.run_report(self.get_pageviews_request(start, end, paths))
+        return self.parse_pageviews(response, paths)
+
+    def get_top_pages_between(
+        self, start: date, end: date, limit: int = 10
+    ) -> List[TopPage]:
+        response = self.run_report(self.get_top_pages_request(start, end, limit=limit))
+        return self.parse_top_pages(response)
+
+    def get_top_sources_between(
+        self, start: date, end: date, limit: int = 10
+    ) -> List[TopSource]:
+        response = self.run_report(
+            self.get_top_sources_request(start, end, limit=limit)
+        )
+        return self.parse_top_sources(response)
+
+    def get_daily_top_pages_between(
+        self, start: date, end: date, limit: int = 10
+    ) -> Dict[str, List[TopPage]]:
+        return self.get_daily_top_between("pagePath", TopPage, start, end, limit)
+
+    def get_daily_top_sources_between(
+        self, start: date, end: date, limit: int = 10
+    ) -> Dict[str, List[TopSource]]:
+        return self.get_daily_top_between("sessionSource", TopSource, start, end, limit)
+
+    def get_daily_top_between(
+        self, dimension: str, row_class, start: date, end: date, limit: int
+    ) -> dict:
+        # The API can't limit the rows of each day, so all of them are fetched
+        top = {day.isoformat(): [] for day in Period(start, end).each_day()}
+        offset = 0
+        while True:
+            response = self.run_report(
+                self.get_daily_top_request(
+                    dimension, start, end, offset, self.max_page_size
+                )
+            )
+            for row in response.rows:
+                rows = top.setdefault(format_date(row.dimension_values[0].value), [])
+                if len(rows) < limit:
+                    rows.append(
+                        row_class(
+                            row.dimension_values[1].value,
+                            int(row.metric_values[0].value),
+                        )
+                    )
+            offset += len(response.rows)
+            if not response.rows or offset >= response.row_count:
+                return top
+
+    def get_daily_top_request(
+        self, dimension: str, start: date, end: date, offset: int, limit: int
+    ) -> RunReportRequest:
+        return RunReportRequest(
+            property=self.get_property(),
+            date_ranges=[DateRange(start_date=str(start), end_date=str(end))],
+            dimensions=[Dimension(name="date"), Dimension(name=dimension)],
+            metrics=[Metric(name="activeUsers")],
+            # Day by day, the most visited first
+            order_bys=[
+                OrderBy(dimension=OrderBy.DimensionOrderBy(dimension_name="date")),
+                OrderBy(
+                    metric=OrderBy.MetricOrderBy(metric_name="activeUsers"), desc=True
+                ),
+            ],
+            offset=offset,
+            limit=limit,
+            return_property_quota=True,
+        )
+
+    def get_export_request(
+        self, dimension: str, start: date, end: date, offset: int, limit: int
+    ) -> RunReportRequest:
+        name = self.export_dimensions[dimension]
+        return RunReportRequest(
+            property=self.get_property(),
+            date_ranges=[DateRange(start_date=str(start), end_date=str(end))],
+            dimensions=[Dimension(name=name)],
+            metrics=[Metric(name="activeUsers"), Metric(name="screenPageViews")],
+            # A stable order, so the pages don't overlap
+            order_bys=[
+                OrderBy(dimension=OrderBy.DimensionOrderBy(dimension_name=name))
+            ],
+            offset=offset,
+            limit=limit,
+            return_property_quota=True,
+        )
+
+    def iter_rows(
+        self, dimension: str, start: date, end: date, page_size: int = None
+    ) -> Iterator[dict]:
+        limit = min(
+            page_size or wagtail_analytics_settings.EXPORT_PAGE_SIZE,
+            self.max_page_size,
+        )
+        offset = 0
+        while True:
+            response = self.run_report(
+                self.get_export_request(dimension, start, end, offset, limit)
+            )
+            for row in response.rows:
+                value = row.dimension_values[0].value
+                if dimension == "date":
+                    value = format_date(value)
+                yield {
+                    dimension: value,
+                    "visitors": int(row.metric_values[0].value),
+                    "pageviews": int(row.metric_values[1].value),
+                }
+            offset += len(response.rows)
+            if not response.rows or offset >= response.row_count:
+                return
+
+    def get_visitor_totals(self) -> Tuple[int, int]:
+        response = self.run_report(self.get_visitor_totals_request())
+        return self.parse_visitor_totals(response).get(None, (0, 0))
+
+    def get_overview_group(self) -> Optional[Tuple]:
+        return (
+            self.provider,
+            self.property_id,
+            ga_client_registry.get_key(self.credentials),
+        )
+
+    def get_visitor_totals_by_hostname(
+        self, hostnames: Iterable[str]
+    ) -> Dict[str, Tuple[int, int]]:
+        hostnames = list(hostnames)
+        response = self.run_report(self.get_visitor_totals_request(hostnames))
+        totals = self.parse_visitor_totals(response)
+        return {hostname: totals.get(hostname, (0, 0)) for hostname in hostnames}
+
+    async def aget_visitors_between(
+        self, start: date, end: date, path: str = None
+    ) -> List[Tuple[str, int]]:
+        response = await self.arun_report(
+            self.get_visitors_request(start, end, path=path)
+        )
+        return self.parse_visitors(response, start, end)
+
+    async def aget_pageviews_between(
+        self, start: date, end: date, paths: Iterable[str]
+    ) -> Dict[str, int]:
+        paths = list(paths)
+        response = await self.arun_report(self.get_pageviews_request(start, end, paths))
+        return self.parse_pageviews(response, paths)
+
+    async def aget_top_pages_between(
+        self, start: date, end: date, limit: int = 10
+    ) -> List[TopPage]:
+        response = await self.arun_report(
+            self.get_top_pages_request(start, end, limit=limit)
+        )
+        return self.parse_top_pages(response)
+
+    async def aget_top_sources_between(
+        self, start: date, end: date, limit: int = 10
+    ) -> List[TopSource]:
+        response = await self.arun_report(
+            self.get_top_sources_request(start, end, limit=limit)
+        )
+        return self.parse_top_sources(response)
@@ -0,0 +1,235 @@
+import asyncio
+import random
+import threading
+import time
+import weakref
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+import requests
+from asgiref.sync import sync_to_async
+from requests.adapters import HTTPAdapter
+
+from wagtail_analytics import settings as wagtail_analytics_settings
+from wagtail_analytics.lib.exceptions import (
+    AuthenticationError,
+    RateLimitError,
+    UpstreamError,
+    UpstreamTimeout,
+)
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+try:
+    import h2
+except ImportError:  # pragma: no cover
+    h2 = None
+
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+
+_session = None
+_session_lock = threading.Lock()
+_http2_client = None
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_session() -> requests.Session:
+    """Return the process-wide session, pooling connections per host."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=wagtail_analytics_settings.HTTP_POOL_SIZE,
+                pool_maxsize=wagtail_analytics_settings.HTTP_POOL_SIZE,
+            )
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+    return _session
+
+
+def use_http2() -> bool:
+    """HTTP/2 is used when it's enabled and ``httpx[http2]`` is installed."""
+    return bool(
+        wagtail_analytics_settings.HTTP2 and httpx is not None and h2 is not None
+    )
+
+
+def get_http2_client():
+    """
+    Return the process-wide ``httpx.Client`` speaking HTTP/2, which multiplexes
+    the concurrent requests of the report threads over one connection per host.
+    """
+    global _http2_client
+    with _session_lock:
+        if _http2_client is None:
+            _http2_client = httpx.Client(
+                http2=True, limits=get_limits(), timeout=get_httpx_timeout()
+            )
+    return _http2_client
+
+
+def get_limits():
+    return httpx.Limits(
+        max_connections=wagtail_analytics_settings.HTTP_POOL_SIZE,
+        max_keepalive_connections=wagtail_analytics_settings.HTTP_POOL_SIZE,
+    )
+
+
+def get_httpx_timeout():
+    return httpx.Timeout(
+        wagtail_analytics_settings.HTTP_READ_TIMEOUT,
+        connect=wagtail_analytics_settings.HTTP_CONNECT_TIMEOUT,
+    )
+
+
+def get_timeout():
+    return (
+        wagtail_analytics_settings.HTTP_CONNECT_TIMEOUT,
+        wagtail_analytics_settings.HTTP_READ_TIMEOUT,
+    )
+
+
+def get_backoff(attempt: int) -> float:
+    backoff = min(
+        wagtail_analytics_settings.HTTP_BACKOFF_MAX,
+        wagtail_analytics_settings.HTTP_BACKOFF_FACTOR * (2**attempt),
+    )
+    return random.uniform(0, backoff)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def raise_for_response(response: requests.Response):
+    status = response.status_code
+    message = f"Request failed with status code {status}: {response.text}"
+    if status in (401, 403):
+        raise AuthenticationError(message, upstream_status=status)
+    if status == 429:
+        raise RateLimitError(
+            message,
+            upstream_status=status,
+            retry_after=parse_retry_after(response.headers.get("Retry-After")),
+        )
+    raise UpstreamError(message, upstream_status=status)
+
+
+def get_error_delay(error: Exception, attempt: int, timeout: bool) -> float:
+    """Return how long to wait before retrying a failed request, or raise."""
+    if attempt >= wagtail_analytics_settings.HTTP_MAX_RETRIES:
+        if timeout:
+            raise UpstreamTimeout(str(error)) from error
+        raise UpstreamError(str(error)) from error
+    return get_backoff(attempt)
+
+
+def get_response_delay(response, attempt: int) -> Optional[float]:
+    """
+    Return how long to wait before retrying ``response``, None when it's fine or
+    raise when it shouldn't be retried.
+    """
+    if response.status_code < 400:
+        return None
+    if (
+        response.status_code not in RETRY_STATUS_CODES
+        or attempt >= wagtail_analytics_settings.HTTP_MAX_RETRIES
+    ):
+        raise_for_response(response)
+    delay = get_backoff(attempt)
+    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+    if retry_after is not None:
+        if retry_after > wagtail_analytics_settings.HTTP_BACKOFF_MAX:
+            raise_for_response(response)
+        delay = retry_after
+    return delay
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    """
+    Send a request through the shared session.
+
+    Connection errors, timeouts, 429 and 5xx gateway responses are retried with
+    jittered exponential backoff. A ``Retry-After`` header is honoured, unless
+    it asks to wait longer than the maximum backoff.
+
+    With ``WAGTAIL_ANALYTICS_HTTP2`` the request is sent over HTTP/2 by httpx.
+    """
+    if use_http2():
+        client = get_http2_client()
+        timeout_errors = httpx.TimeoutException
+        connection_errors = httpx.TransportError
+    else:
+        kwargs.setdefault("timeout", get_timeout())
+        client = get_session()
+        timeout_errors = requests.Timeout
+        connection_errors = requests.ConnectionError
+
+    attempt = 0
+    while True:
+        try:
+            response = client.request(method, url, **kwargs)
+        except timeout_errors as e:
+            delay = get_error_delay(e, attempt, timeout=True)
+        except connection_errors as e:
+            delay = get_error_delay(e, attempt, timeout=False)
+        else:
+            delay = get_response_delay(response, attempt)
+            if delay is None:
+                response.retries = attempt
+                return response
+        time.sleep(delay)
+        attempt += 1
+
+
+def get_async_client():
+    """Return the shared ``httpx.AsyncClient`` of the running event loop."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            http2=use_http2(), limits=get_limits(), timeout=get_httpx_timeout()
+        )
+        _async_clients[loop] = client
+    return client
+
+
+async def arequest(method: str, url: str, **kwargs):
+    """
+    Async version of :func:`request`, using httpx when it's installed and the
+    shared session in a thread otherwise.
+    """
+    if httpx is None:
+        return await sync_to_async(request, thread_sensitive=False)(
+            method, url, **kwargs
+        )
+
+    client = get_async_client()
+    attempt = 0
+    while True:
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.TimeoutException as e:
+            delay = get_error_delay(e, attempt, timeout=True)
+        except httpx.TransportError as e:
+            delay = get_error_delay(e, attempt, timeout=False)
+        else:
+            delay = get_response_delay(response, attempt)
+            if delay is None:
+                response.retries = attempt
+                return response
+        await asyncio.sleep(delay)
+        attempt += 1
@@ -0,0 +1,127 @@
+import contextvars
+import logging
+import re
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+from wagtail_analytics import signals
+
+logger = logging.getLogger("wagtail_analytics")
+
+current_section = contextvars.ContextVar("wagtail_analytics_section", default=None)
+current_timings = contextvars.ContextVar("wagtail_analytics_timings", default=None)
+
+
+class Timings:
+    """Collect the timings of a request, rendered as a Server-Timing header."""
+
+    def __init__(self) -> None:
+        self.entries = []
+        self._lock = threading.Lock()
+
+    def add(self, name: str, duration: float = None, description: str = None):
+        with self._lock:
+            self.entries.append((name, duration, description))
+
+    def as_header(self) -> str:
+        metrics = []
+        for name, duration, description in self.entries:
+            metric = re.sub(r"[^\w.-]", "-", name)
+            if description:
+                metric += ';desc="%s"' % description.replace('"', "")
+            if duration is not None:
+                metric += ";dur=%.1f" % (duration * 1000)
+            metrics.append(metric)
+        return ", ".join(metrics)
+
+
+@contextmanager
+def collect_timings():
+    timings = Timings()
+    token = current_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        current_timings.reset(token)
+
+
+def add_timing(name: str, duration: float = None, description: str = None):
+    timings = current_timings.get()
+    if timings is not None:
+        timings.add(name, duration, description)
+
+
+@contextmanager
+def section(name: str):
+    token = current_section.set(name)
+    try:
+        yield
+    finally:
+        current_section.reset(token)
+
+
+def record_upstream_request(
+    sender,
+    provider: str,
+    operation: str,
+    duration: float,
+    bytes_received: int = 0,
+    retries: int = 0,
+    status=None,
+    error: Optional[Exception] = None,
+):
+    section_name = current_section.get()
+    logger.debug(
+        "%s %s (%s) took %.1fms, %s bytes, %s retries, status %s",
+        provider,
+        operation,
+        section_name or "-",
+        duration * 1000,
+        bytes_received,
+        retries,
+        status,
+    )
+    add_timing("%s-%s" % (provider, section_name or operation), duration)
+    signals.upstream_request_finished.send(
+        sender=sender,
+        provider=provider,
+        operation=operation,
+        section=section_name,
+        duration=duration,
+        bytes_received=bytes_received,
+        retries=retries,
+        status=status,
+        error=error,
+    )
+
+
+def record_report_built(
+    sender, provider: str, report_type: str, duration: float, errors=None
+):
+    add_timing(report_type, duration)
+    signals.report_built.send(
+        sender=sender,
+        provider=provider,
+        report_type=report_type,
+        duration=duration,
+        errors=errors or [],
+    )
+
+
+def record_quota(sender, provider: str, property_id: str, property_quota):
+    quota = {}
+    for name in ("tokens_per_day", "tokens_per_hour", "tokens_per_project_per_hour"):
+        status = getattr(property_quota, name, None)
+        if status:
+            quota[name] = {"consumed": status.consumed, "remaining": status.remaining}
+    if quota:
+        signals.quota_reported.send(
+            sender=sender, provider=provider, property_id=property_id, quota=quota
+        )
+    return quota
+
+
+def record_cache_lookup(sender, key: str, result: str):
+    add_timing("cache", description=result)
+    signals.report_cache_lookup.send(sender=sender, key=key, result=result)
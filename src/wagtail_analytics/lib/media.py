@@ -0,0 +1,34 @@
+from dataclasses import dataclass
+
+from django.forms import Media
+from django.templatetags.static import static
+from django.utils.html import format_html
+
+
+@dataclass(frozen=True)
+class DeferredScript:
+    """
+    A script for ``forms.Media`` which is loaded with ``defer``, so it doesn't
+    block parsing the admin page. Deferred scripts still run in order.
+    """
+
+    path: str
+
+    def __html__(self) -> str:
+        return format_html('<script defer src="{}"></script>', static(self.path))
+
+
+# The charts only use a category axis, so Chart.js is loaded without the bundled
+# moment date adapter
+report_media = Media(
+    css={"all": ["chart.js/Chart.min.css", "wagtailanalytics/main.css"]},
+    js=[
+        DeferredScript("chart.js/Chart.min.js"),
+        DeferredScript("wagtailanalytics/main.js"),
+    ],
+)
+
+overview_media = Media(
+    css={"all": ["wagtailanalytics/main.css"]},
+    js=[DeferredScript("wagtailanalytics/main.js")],
+)
@@ -0,0 +1,126 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Tuple
+
+from django.db import close_old_connections
+
+from wagtail_analytics import settings as wagtail_analytics_settings
+from wagtail_analytics.lib.analytics import APIClient
+from wagtail_analytics.lib.exceptions import UpstreamTimeout
+from wagtail_analytics.lib.instrumentation import record_report_built
+from wagtail_analytics.types import Overview, SiteSummary
+
+logger = logging.getLogger(__name__)
+
+
+def get_change(this_week: int, last_week: int) -> Optional[float]:
+    """Return the week over week change as a percentage."""
+    if not last_week:
+        return None
+    return round((this_week - last_week) / last_week * 100, 1)
+
+
+def group_clients(clients: List[Tuple[object, APIClient]]) -> List[list]:
+    """Group the sites whose totals can be fetched with a single upstream call."""
+    groups = {}
+    for site, client in clients:
+        key = client.get_overview_group() or ("site", site.pk)
+        groups.setdefault(key, []).append((site, client))
+    return list(groups.values())
+
+
+def fetch_group_totals(group: list) -> Dict[int, Tuple[int, int]]:
+    if len(group) == 1:
+        site, client = group[0]
+        return {site.pk: client.get_visitor_totals()}
+
+    client = group[0][1]
+    totals = client.get_visitor_totals_by_hostname(site.hostname for site, _ in group)
+    return {site.pk: totals[site.hostname] for site, _ in group}
+
+
+def fetch_group_totals_in_thread(group: list) -> Dict[int, Tuple[int, int]]:
+    # Clients may query the database, which opens a connection for the thread
+    close_old_connections()
+    try:
+        return fetch_group_totals(group)
+    finally:
+        close_old_connections()
+
+
+def get_overview(clients: List[Tuple[object, APIClient]]) -> Overview:
+    """
+    Return the visitors of this and last week of every site.
+
+    Sites are fetched in parallel, by at most ``OVERVIEW_MAX_WORKERS`` threads.
+    Sites of the same Google Analytics property share a single query. A site
+    which can't be fetched is listed with its error instead of failing the
+    whole overview.
+    """
+    start = time.perf_counter()
+    groups = group_clients(clients)
+    totals, errors = {}, {}
+
+    executor = ThreadPoolExecutor(
+        max_workers=max(
+            1, min(wagtail_analytics_settings.OVERVIEW_MAX_WORKERS, len(groups))
+        ),
+        thread_name_prefix="wagtail-analytics-overview",
+    )
+    try:
+        # The timings of every site would make for a huge Server-Timing header,
+        # so the workers don't run in the context of the request
+        futures = {
+            executor.submit(fetch_group_totals_in_thread, group): group
+            for group in groups
+        }
+        done, not_done = wait(
+            futures, timeout=wagtail_analytics_settings.OVERVIEW_TIMEOUT
+        )
+        for future, group in futures.items():
+            if future in not_done:
+                future.cancel()
+                error = UpstreamTimeout("Overview did not finish in time")
+            else:
+                try:
+                    totals.update(future.result())
+                    continue
+                except Exception as e:
+                    error = e
+            logger.warning("Unable to fetch overview totals: %s", error)
+            for site, client in group:
+                errors[site.pk] = str(error)
+    finally:
+        executor.shutdown(wait=False)
+
+    overview = Overview(sites=[])
+    for site, client in clients:
+        this_week, last_week = totals.get(site.pk, (0, 0))
+        overview.sites.append(
+            SiteSummary(
+                site_id=site.pk,
+                name=site.site_name or site.hostname,
+                hostname=site.hostname,
+                provider=client.provider,
+                visitors_this_week=this_week,
+                visitors_last_week=last_week,
+                change=get_change(this_week, last_week),
+                error=errors.get(site.pk),
+            )
+        )
+        overview.visitors_this_week += this_week
+        overview.visitors_last_week += last_week
+    overview.change = get_change(
+        overview.visitors_this_week, overview.visitors_last_week
+    )
+    overview.errors = [summary.hostname for summary in overview.sites if summary.error]
+
+    record_report_built(
+        get_overview,
+        "overview",
+        "overview",
+        time.perf_counter() - start,
+        overview.errors,
+    )
+    return overview
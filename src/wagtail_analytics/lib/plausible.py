@@ -0,0 +1,614 @@
+import hashlib
+import time
+from datetime import date, timedelta
+from functools import partial
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import quote, urlparse
+
+from wagtail_analytics import settings as wagtail_analytics_settings
+from wagtail_analytics.lib import http
+from wagtail_analytics.lib.analytics import APIClient
+from wagtail_analytics.lib.dates import Period, fill_days
+from wagtail_analytics.lib.exceptions import AnalyticsError, RateLimitError
+from wagtail_analytics.lib.instrumentation import record_upstream_request
+from wagtail_analytics.lib.providers import get_plausible_url
+from wagtail_analytics.types import PageReport, Report, TopPage, TopSource
+
+
+class PlausibleAPIClient(APIClient):
+    provider = "plausible"
+    export_properties = {"page": "event:page", "source": "visit:source"}
+    max_page_size = 1000
+
+    def __init__(self, site_id, api_key, domain="plausible.io") -> None:
+        self.site_id = site_id
+        self.api_key = api_key
+        # Self-hosted instances are queried on their own domain
+        self.base_url = get_plausible_url(domain) + "/api/v1/stats"
+        self.headers = {"Authorization": f"Bearer {self.api_key}"}
+
+    def get_rate_limit_account(self) -> Optional[str]:
+        # Plausible limits requests per API key, which shouldn't end up in the cache
+        return hashlib.sha256(self.api_key.encode()).hexdigest()[:16]
+
+    def request(self, url, headers, data=None):
+        self.throttle()
+        operation = urlparse(url).path.rsplit("/", 1)[-1]
+        start = time.perf_counter()
+        try:
+            response = http.request(
+                "GET" if data is None else "POST", url, headers=headers, json=data
+            )
+        except AnalyticsError as e:
+            self.record_request(operation, start, error=e)
+            if isinstance(e, RateLimitError):
+                self.handle_rate_limit(e)
+            raise
+        self.record_request(operation, start, response=response)
+        return response.json()
+
+    async def arequest(self, url, headers, data=None):
+        await self.athrottle()
+        operation = urlparse(url).path.rsplit("/", 1)[-1]
+        start = time.perf_counter()
+        try:
+            response = await http.arequest(
+                "GET" if data is None else "POST", url, headers=headers, json=data
+            )
+        except AnalyticsError as e:
+            self.record_request(operation, start, error=e)
+            if isinstance(e, RateLimitError):
+                self.handle_rate_limit(e)
+            raise
+        self.record_request(operation, start, response=response)
+        return response.json()
+
+    def record_request(self, operation, start, response=None, error=None):
+        if error is not None:
+            record_upstream_request(
+                self.__class__,
+                self.provider,
+                operation,
+                time.perf_counter() - start,
+                status=error.upstream_status,
+                error=error,
+            )
+            return
+        record_upstream_request(
+            self.__class__,
+            self.provider,
+            operation,
+            time.perf_counter() - start,
+            bytes_received=len(response.content),
+            retries=response.retries,
+            status=response.status_code,
+        )
+
+    def get_page_filter(self, paths: Iterable[str]) -> str:
+        # Paths are combined with | so a literal | has to be escaped
+        paths = [path.replace("|", "\\|") for path in paths]
+        return "&filters=" + quote("event:page==" + "|".join(paths))
+
+    def get_visitors_url(self, start: date, end: date, path: str = None) -> str:
+        url = "{base_url}/timeseries?date={start},{end}&site_id={site_id}&period=custom&metrics=visitors".format(
+            start=start, end=end, base_url=self.base_url, site_id=self.site_id
+        )
+        if path:
+            url += self.get_page_filter([path])
+        return url
+
+    def get_top_pages_url(self, start: date, end: date, limit: int = 10) -> str:
+        return "{base_url}/breakdown?limit={limit}&date={start},{end}&site_id={site_id}&period=custom&metrics=visitors&property=event:page".format(
+            start=start,
+            end=end,
+            limit=limit,
+            base_url=self.base_url,
+            site_id=self.site_id,
+        )
+
+    def get_top_sources_url(self, start: date, end: date, limit: int = 10) -> str:
+        return "{base_url}/breakdown?limit={limit}&date={start},{end}&site_id={site_id}&period=custom&metrics=visitors&property=visit:source".format(
+            start=start,
+            end=end,
+            limit=limit,
+            base_url=self.base_url,
+            site_id=self.site_id,
+        )
+
+    def get_pageviews_url(self, start: date, end: date, paths: List[str]) -> str:
+        url = "{base_url}/breakdown?limit={limit}&date={start},{end}&site_id={site_id}&period=custom&metrics=pageviews&property=event:page".format(
+            start=start,
+            end=end,
+            limit=len(paths),
+            base_url=self.base_url,
+            site_id=self.site_id,
+        )
+        return url + self.get_page_filter(paths)
+
+    def get_visitor_total_url(self, start: date, end: date) -> str:
+        return "{base_url}/aggregate?date={start},{end}&site_id={site_id}&period=custom&metrics=visitors".format(
+            start=start, end=end, base_url=self.base_url, site_id=self.site_id
+        )
+
+    def parse_visitors(self, response) -> List[Tuple[str, int]]:
+        visitors = []
+        for day in response["results"]:
+            visitors.append((day["date"], day["visitors"]))
+        return visitors
+
+    def parse_top_pages(self, response) -> List[TopPage]:
+        top_pages = []
+        for page in response["results"]:
+            top_pages.append(TopPage(url=page["page"], pageviews=page["visitors"]))
+        return top_pages
+
+    def parse_top_sources(self, response) -> List[TopSource]:
+        top_sources = []
+        for source in response["results"]:
+            top_sources.append(
+                TopSource(name=source["source"], pageviews=source["visitors"])
+            )
+        return top_sources
+
+    def parse_pageviews(self, response, paths: List[str]) -> Dict[str, int]:
+        pageviews = dict.fromkeys(paths, 0)
+        for page in response["results"]:
+            pageviews[page["page"]] = page["pageviews"]
+        return pageviews
+
+    def parse_visitor_total(self, response) -> int:
+        return response["results"]["visitors"]["value"]
+
+    def get_visitors_between(
+        self, start: date, end: date, path: str = None
+    ) -> List[Tuple[str, int]]:
+        url = self.get_visitors_url(start, end, path=path)
+        return self.parse_visitors(self.request(url, self.headers))
+
+    def get_top_pages_between(
+        self, start: date, end: date, limit: int = 10
+    ) -> List[TopPage]:
+        url = self.get_top_pages_url(start, end, limit=limit)
+        return self.parse_top_pages(self.request(url, self.headers))
+
+    def get_top_sources_between(
+        self, start: date, end: date, limit: int = 10
+    ) -> List[TopSource]:
+        url = self.get_top_sources_url(start, end, limit=limit)
+        return self.parse_top_sources(self.request(url, self.headers))
+
+    def get_pageviews_between(
+        self, start: date, end: date, paths: Iterable[str]
+    ) -> Dict[str, int]:
+        paths = list(paths)
+        url = self.get_pageviews_url(start, end, paths)
+        return self.parse_pageviews(self.request(url, self.headers), paths)
+
+    def get_visitor_total_between(self, start: date, end: date) -> int:
+        url = self.get_visitor_total_url(start, end)
+        return self.parse_visitor_total(self.request(url, self.headers))
+
+    def get_export_url(
+        self, dimension: str, start: date, end: date, limit: int, page: int
+    ) -> str:
+        if dimension == "date":
+            return "{base_url}/timeseries?date={start},{end}&site_id={site_id}&period=custom&metrics=visitors,pageviews".format(
+                start=start, end=end, base_url=self.base_url, site_id=self.site_id
+            )
+        return "{base_url}/breakdown?limit={limit}&page={page}&date={start},{end}&site_id={site_id}&period=custom&metrics=visitors,pageviews&property={property}".format(
+            start=start,
+            end=end,
+            limit=limit,
+            page=page,
+            base_url=self.base_url,
+            site_id=self.site_id,
+            property=self.export_properties[dimension],
+        )
+
+    def iter_rows(
+        self, dimension: str, start: date, end: date, page_size: int = None
+    ) -> Iterator[dict]:
+        limit = min(
+            page_size or wagtail_analytics_settings.EXPORT_PAGE_SIZE,
+            self.max_page_size,
+        )
+        page = 1
+        while True:
+            url = self.get_export_url(dimension, start, end, limit, page)
+            results = self.request(url, self.headers)["results"]
+            for row in results:
+                yield {
+                    dimension: row[dimension],
+                    "visitors": row.get("visitors"),
+                    "pageviews": row.get("pageviews"),
+                }
+            # The timeseries isn't paginated, there's a row for every day
+            if dimension == "date" or len(results) < limit:
+                return
+            page += 1
+
+    def get_visitor_totals(self) -> Tuple[int, int]:
+        # Unique visitors of the whole week rather than the sum of every day
+        results, errors = self.fetch_sections(
+            {
+                "total_this_week": partial(
+                    self.get_visitor_total_between, *self.get_this_week()
+                ),
+                "total_last_week": partial(
+                    self.get_visitor_total_between, *self.get_last_week()
+                ),
+            }
+        )
+        if errors:
+            raise next(iter(errors.values()))
+        return results["total_this_week"], results["total_last_week"]
+
+    async def aget_visitors_between(
+        self, start: date, end: date, path: str = None
+    ) -> List[Tuple[str, int]]:
+        url = self.get_visitors_url(start, end, path=path)
+        return self.parse_visitors(await self.arequest(url, self.headers))
+
+    async def aget_top_pages_between(
+        self, start: date, end: date, limit: int = 10
+    ) -> List[TopPage]:
+        url = self.get_top_pages_url(start, end, limit=limit)
+        return self.parse_top_pages(await self.arequest(url, self.headers))
+
+    async def aget_top_sources_between(
+        self, start: date, end: date, limit: int = 10
+    ) -> List[TopSource]:
+        url = self.get_top_sources_url(start, end, limit=limit)
+        return self.parse_top_sources(await self.arequest(url, self.headers))
+
+    async def aget_pageviews_between(
+        self, start: date, end: date, paths: Iterable[str]
+    ) -> Dict[str, int]:
+        paths = list(paths)
+        url = self.get_pageviews_url(start, end, paths)
+        return self.parse_pageviews(await self.arequest(url, self.headers), paths)
+
+    def get_visitors_this_week(self) -> List[Tuple[str, int]]:
+        return self.get_visitors_between(*self.get_this_week())
+
+    def get_visitors_last_week(self) -> List[Tuple[str, int]]:
+        return self.get_visitors_between(*self.get_last_week())
+
+    def get_top_pages(self) -> List[TopPage]:
+        return self.get_top_pages_between(*self.get_this_week())
+
+    def get_top_sources(self) -> List[TopSource]:
+        return self.get_top_sources_between(*self.get_this_week())
+
+
+class PlausibleQueryAPIClient(PlausibleAPIClient):
+    """
+    Client of the Stats API v2.
+
+    Every section of a report is planned as a single query to ``/api/v2/query``,
+    which takes several metrics and dimensions at once. The visitors of a period
+    and of the one it's compared with are fetched together, so a report takes
+    three requests instead of four.
+    """
+
+    def __init__(self, site_id, api_key, domain="plausible.io") -> None:
+        super().__init__(site_id, api_key, domain=domain)
+        self.query_url = get_plausible_url(domain) + "/api/v2/query"
+
+    def build_query(
+        self,
+        metrics: List[str],
+        period: Period,
+        dimensions: List[str] = None,
+        filters: list = None,
+        order_by: list = None,
+        limit: int = None,
+        offset: int = 0,
+        comparison: Period = None,
+    ) -> dict:
+        query = {
+            "site_id": self.site_id,
+            "metrics": metrics,
+            "date_range": [period.start.isoformat(), period.end.isoformat()],
+        }
+        if dimensions:
+            query["dimensions"] = dimensions
+        if filters:
+            query["filters"] = filters
+        if order_by:
+            query["order_by"] = order_by
+        if limit:
+            query["pagination"] = {"limit": limit, "offset": offset}
+        if comparison:
+            query["include"] = {
+                "comparisons": {
+                    "mode": "custom",
+                    "date_range": [
+                        comparison.start.isoformat(),
+                        comparison.end.isoformat(),
+                    ],
+                }
+            }
+        return query
+
+    def get_page_filters(self, paths: Iterable[str]) -> list:
+        return [["is", "event:page", list(paths)]]
+
+    def execute(self, query: dict, parse: Callable[[list], object]):
+        return parse(self.request(self.query_url, self.headers, data=query)["results"])
+
+    async def aexecute(self, query: dict, parse: Callable[[list], object]):
+        response = await self.arequest(self.query_url, self.headers, data=query)
+        return parse(response["results"])
+
+    def plan_visitors(
+        self, period: Period, comparison: Period = None, path: str = None
+    ) -> Tuple[dict, Callable[[list], object]]:
+        """
+        Plan the query of the daily visitors of a period, and of the period it's
+        compared with if any.
+
+        Adjacent periods, like this week and last week, are fetched as one date
+        range and split by day. Others use Plausible's comparisons, which pair
+        every day with the same day of the other period.
+        """
+        filters = self.get_page_filters([path]) if path else None
+        if comparison is None:
+            query = self.build_query(
+                ["visitors"], period, dimensions=["time:day"], filters=filters
+            )
+            return query, partial(self.parse_daily_visitors, period)
+        if comparison.end + timedelta(days=1) == period.start:
+            query = self.build_query(
+                ["visitors"],
+                Period(comparison.start, period.end),
+                dimensions=["time:day"],
+                filters=filters,
+            )
+            return query, partial(self.parse_adjacent_visitors, period, comparison)
+        query = self.build_query(
+            ["visitors"],
+            period,
+            dimensions=["time:day"],
+            filters=filters,
+            comparison=comparison,
+        )
+        return query, partial(self.parse_compared_visitors, period, comparison)
+
+    def plan_breakdown(
+        self,
+        dimension: str,
+        metrics: List[str],
+        period: Period,
+        limit: int,
+        offset: int = 0,
+        filters: list = None,
+    ) -> dict:
+        return self.build_query(
+            metrics,
+            period,
+            dimensions=[dimension],
+            filters=filters,
+            order_by=[[metrics[0], "desc"]],
+            limit=limit,
+            offset=offset,
+        )
+
+    def plan_top_pages(self, start: date, end: date, limit: int = 10):
+        query = self.plan_breakdown(
+            "event:page", ["visitors"], Period(start, end), limit
+        )
+        return query, self.parse_top_pages
+
+    def plan_top_sources(self, start: date, end: date, limit: int = 10):
+        query = self.plan_breakdown(
+            "visit:source", ["visitors"], Period(start, end), limit
+        )
+        return query, self.parse_top_sources
+
+    def plan_pageviews(self, start: date, end: date, paths: List[str]):
+        query = self.plan_breakdown(
+            "event:page",
+            ["pageviews"],
+            Period(start, end),
+            len(paths),
+            filters=self.get_page_filters(paths),
+        )
+        return query, partial(self.parse_pageviews, paths=paths)
+
+    def get_daily_top_pages_between(
+        self, start: date, end: date, limit: int = 10
+    ) -> Dict[str, List[TopPage]]:
+        return self.get_daily_top_between("event:page", TopPage, start, end, limit)
+
+    def get_daily_top_sources_between(
+        self, start: date, end: date, limit: int = 10
+    ) -> Dict[str, List[TopSource]]:
+        return self.get_daily_top_between("visit:source", TopSource, start, end, limit)
+
+    def get_daily_top_between(
+        self, dimension: str, row_class, start: date, end: date, limit: int
+    ) -> dict:
+        # The API can't limit the rows of each day, so all of them are fetched
+        top = {day.isoformat(): [] for day in Period(start, end).each_day()}
+        offset = 0
+        while True:
+            query = self.build_query(
+                ["visitors"],
+                Period(start, end),
+                dimensions=["time:day", dimension],
+                order_by=[["time:day", "asc"], ["visitors", "desc"]],
+                limit=self.max_page_size,
+                offset=offset,
+            )
+            results = self.execute(query, lambda results: results)
+            for row in results:
+                (day, value), (visitors,) = row["dimensions"], row["metrics"]
+                rows = top.setdefault(day, [])
+                if len(rows) < limit:
+                    rows.append(row_class(value, visitors))
+            if len(results) < self.max_page_size:
+                return top
+            offset += self.max_page_size
+
+    def parse_daily_visitors(self, period: Period, results) -> List[Tuple[str, int]]:
+        # Days without visitors are left out of the results
+        values = {row["dimensions"][0]: row["metrics"][0] for row in results}
+        return fill_days(values, *period)
+
+    def parse_adjacent_visitors(self, period: Period, comparison: Period, results):
+        values = {row["dimensions"][0]: row["metrics"][0] for row in results}
+        return fill_days(values, *period), fill_days(values, *comparison)
+
+    def parse_compared_visitors(self, period: Period, comparison: Period, results):
+        values = {}
+        compared_values = {}
+        for row in results:
+            values[row["dimensions"][0]] = row["metrics"][0]
+            compared = row.get("comparison")
+            if compared:
+                compared_values[compared["dimensions"][0]] = compared["metrics"][0]
+        return fill_days(values, *period), fill_days(compared_values, *comparison)
+
+    def parse_top_pages(self, results) -> List[TopPage]:
+        return [
+            TopPage(url=row["dimensions"][0], pageviews=row["metrics"][0])
+            for row in results
+        ]
+
+    def parse_top_sources(self, results) -> List[TopSource]:
+        return [
+            TopSource(name=row["dimensions"][0], pageviews=row["metrics"][0])
+            for row in results
+        ]
+
+    def parse_pageviews(self, results, paths: List[str]) -> Dict[str, int]:
+        pageviews = dict.fromkeys(paths, 0)
+        for row in results:
+            pageviews[row["dimensions"][0]] = row["metrics"][0]
+        return pageviews
+
+    def get_report_sections(self, period: Period, comparison: Period):
+        return {
+            "visitors": partial(self.execute, *self.plan_visitors(period, comparison)),
+            "top_pages": partial(self.execute, *self.plan_top_pages(*period)),
+            "top_sources": partial(self.execute, *self.plan_top_sources(*period)),
+        }
+
+    def get_async_report_sections(self, period: Period, comparison: Period):
+        return {
+            "visitors": partial(self.aexecute, *self.plan_visitors(period, comparison)),
+            "top_pages": partial(self.aexecute, *self.plan_top_pages(*period)),
+            "top_sources": partial(self.aexecute, *self.plan_top_sources(*period)),
+        }
+
+    def get_page_report_sections(self, path: str, period: Period, comparison: Period):
+        return {
+            "visitors": partial(
+                self.execute, *self.plan_visitors(period, comparison, path=path)
+            )
+        }
+
+    def get_async_page_report_sections(
+        self, path: str, period: Period, comparison: Period
+    ):
+        return {
+            "visitors": partial(
+                self.aexecute, *self.plan_visitors(period, comparison, path=path)
+            )
+        }
+
+    def split_visitors(self, results: dict) -> dict:
+        if "visitors" in results:
+            this_week, last_week = results.pop("visitors")
+            results["visitors_this_week"] = this_week
+            results["visitors_last_week"] = last_week
+        return results
+
+    def make_report(self, results, errors) -> Report:
+        return super().make_report(self.split_visitors(results), errors)
+
+    def build_page_report(self, path: str, results, errors, start: float) -> PageReport:
+        return super().build_page_report(
+            path, self.split_visitors(results), errors, start
+        )
+
+    def get_visitors_between(
+        self, start: date, end: date, path: str = None
+    ) -> List[Tuple[str, int]]:
+        return self.execute(*self.plan_visitors(Period(start, end), path=path))
+
+    def get_top_pages_between(
+        self, start: date, end: date, limit: int = 10
+    ) -> List[TopPage]:
+        return self.execute(*self.plan_top_pages(start, end, limit=limit))
+
+    def get_top_sources_between(
+        self, start: date, end: date, limit: int = 10
+    ) -> List[TopSource]:
+        return self.execute(*self.plan_top_sources(start, end, limit=limit))
+
+    def get_pageviews_between(
+        self, start: date, end: date, paths: Iterable[str]
+    ) -> Dict[str, int]:
+        return self.execute(*self.plan_pageviews(start, end, list(paths)))
+
+    def get_visitor_total_between(self, start: date, end: date) -> int:
+        query = self.build_query(["visitors"], Period(start, end))
+        return self.execute(query, lambda results: results[0]["metrics"][0])
+
+    def iter_rows(
+        self, dimension: str, start: date, end: date, page_size: int = None
+    ) -> Iterator[dict]:
+        period = Period(start, end)
+        metrics = ["visitors", "pageviews"]
+        if dimension == "date":
+            query = self.build_query(metrics, period, dimensions=["time:day"])
+            results = self.execute(query, lambda results: results)
+            values = {row["dimensions"][0]: row["metrics"] for row in results}
+            for day, (visitors, pageviews) in fill_days(
+                values, start, end, default=(0, 0)
+            ):
+                yield {"date": day, "visitors": visitors, "pageviews": pageviews}
+            return
+
+        limit = min(
+            page_size or wagtail_analytics_settings.EXPORT_PAGE_SIZE,
+            self.max_page_size,
+        )
+        offset = 0
+        while True:
+            query = self.plan_breakdown(
+                self.export_properties[dimension], metrics, period, limit, offset
+            )
+            results = self.execute(query, lambda results: results)
+            for row in results:
+                visitors, pageviews = row["metrics"]
+                yield {
+                    dimension: row["dimensions"][0],
+                    "visitors": visitors,
+                    "pageviews": pageviews,
+                }
+            if len(results) < limit:
+                return
+            offset += limit
+
+    async def aget_visitors_between(
+        self, start: date, end: date, path: str = None
+    ) -> List[Tuple[str, int]]:
+        return await self.aexecute(*self.plan_visitors(Period(start, end), path=path))
+
+    async def aget_top_pages_between(
+        self, start: date, end: date, limit: int = 10
+    ) -> List[TopPage]:
+        return await self.aexecute(*self.plan_top_pages(start, end, limit=limit))
+
+    async def aget_top_sources_between(
+        self, start: date, end: date, limit: int = 10
+    ) -> List[TopSource]:
+        return await self.aexecute(*self.plan_top_sources(start, end, limit=limit))
+
+    async def aget_pageviews_between(
+        self, start: date, end: date, paths: Iterable[str]
+    ) -> Dict[str, int]:
+        return await self.aexecute(*self.plan_pageviews(start, end, list(paths)))
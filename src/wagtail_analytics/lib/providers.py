@@ -0,0 +1,127 @@
+import threading
+from typing import List, Optional
+
+from django.utils.module_loading import import_string
+from wagtail import hooks
+
+from wagtail_analytics import settings as wagtail_analytics_settings
+
+HOOK_NAME = "register_wagtail_analytics_provider"
+
+
+def get_plausible_url(domain: str) -> str:
+    """
+    Return the URL of a Plausible instance given its domain, such as plausible.io,
+    or its URL, such as http://plausible.lan:8000 for an instance without HTTPS.
+    """
+    domain = (domain or "plausible.io").strip().rstrip("/")
+    if "://" not in domain:
+        return "https://" + domain
+    return domain
+
+
+class Provider:
+    """
+    Create the API clients of the sites which use an analytics provider.
+
+    The client class is given as a dotted path and only imported once a client
+    is needed, so a provider nobody uses doesn't add to the startup time and
+    memory of every process.
+    """
+
+    name = None
+    client_class = None
+
+    def is_enabled(self, analytics_settings) -> bool:
+        raise NotImplementedError
+
+    def get_client_kwargs(self, site, analytics_settings) -> dict:
+        raise NotImplementedError
+
+    def get_client_class(self):
+        return import_string(self.client_class)
+
+    def get_client(self, site, analytics_settings):
+        client = self.get_client_class()(
+            **self.get_client_kwargs(site, analytics_settings)
+        )
+        client.time_zone = analytics_settings.time_zone or None
+        return client
+
+
+class PlausibleProvider(Provider):
+    name = "plausible"
+    client_class = "wagtail_analytics.lib.plausible.PlausibleAPIClient"
+    # Self-hosted instances older than Plausible CE 2.1 don't have the v2 API
+    v2_client_class = "wagtail_analytics.lib.plausible.PlausibleQueryAPIClient"
+
+    def is_enabled(self, analytics_settings) -> bool:
+        return analytics_settings.plausible_enabled
+
+    def get_client_class(self):
+        if wagtail_analytics_settings.PLAUSIBLE_API_VERSION == 2:
+            return import_string(self.v2_client_class)
+        return super().get_client_class()
+
+    def get_client_kwargs(self, site, analytics_settings) -> dict:
+        return {
+            "site_id": site.hostname,
+            "api_key": wagtail_analytics_settings.PLAUSIBLE_API_KEY,
+            "domain": analytics_settings.plausible_domain or "plausible.io",
+        }
+
+
+class GoogleAnalyticsProvider(Provider):
+    name = "google_analytics"
+    client_class = "wagtail_analytics.lib.google_analytics.GoogleAnalyticsAPIClient"
+
+    def is_enabled(self, analytics_settings) -> bool:
+        return analytics_settings.google_analytics_enabled
+
+    def get_client_kwargs(self, site, analytics_settings) -> dict:
+        return {
+            "property_id": analytics_settings.google_analytics_property_id,
+            "credentials": wagtail_analytics_settings.GA_KEY_CONTENT,
+        }
+
+
+class ProviderRegistry:
+    """
+    The providers registered with the ``register_wagtail_analytics_provider``
+    hook. A site uses the first one enabled in its analytics settings.
+    """
+
+    def __init__(self) -> None:
+        self._providers = None
+        self._lock = threading.Lock()
+
+    def get_providers(self) -> List[Provider]:
+        with self._lock:
+            if self._providers is None:
+                providers = []
+                for fn in hooks.get_hooks(HOOK_NAME):
+                    provider = fn()
+                    if isinstance(provider, type):
+                        provider = provider()
+                    providers.append(provider)
+                self._providers = providers
+        return self._providers
+
+    def get_provider(self, analytics_settings) -> Optional[Provider]:
+        for provider in self.get_providers():
+            if provider.is_enabled(analytics_settings):
+                return provider
+        return None
+
+    def get_client(self, site, analytics_settings):
+        provider = self.get_provider(analytics_settings)
+        if provider is None:
+            return None
+        return provider.get_client(site, analytics_settings)
+
+    def clear(self):
+        with self._lock:
+            self._providers = None
+
+
+provider_registry = ProviderRegistry()
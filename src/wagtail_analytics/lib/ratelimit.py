@@ -0,0 +1,241 @@
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+
+from wagtail_analytics import settings as wagtail_analytics_settings
+from wagtail_analytics.lib.dates import get_time_zone
+from wagtail_analytics.lib.exceptions import RateLimitError
+
+
+class RateLimiter:
+    """Space out calls so no more than ``rate`` happen per second."""
+
+    def __init__(self, rate: float) -> None:
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+KEY_PREFIX = "wagtail-analytics:ratelimit"
+
+# Google Analytics resets the daily quotas of a property at midnight Pacific time
+QUOTA_TIME_ZONE = "America/Los_Angeles"
+
+
+def get_quota_reset(name: str, now: float) -> float:
+    """Return the seconds until the Google Analytics quota ``name`` is reset."""
+    if name == "tokens_per_day":
+        today = datetime.fromtimestamp(now, get_time_zone(QUOTA_TIME_ZONE))
+        midnight = datetime.combine(
+            today.date() + timedelta(days=1), datetime.min.time(), today.tzinfo
+        )
+        return midnight.timestamp() - now
+    # The other quotas are per hour
+    return 3600 - now % 3600
+
+
+class TokenBucket:
+    """
+    A token bucket shared by every process through one of Django's caches.
+
+    The bucket holds up to ``burst`` tokens and refills at ``rate`` tokens per
+    second, every upstream request takes one. Background requests leave the last
+    ``reserve`` part of the bucket to interactive ones, so dashboards go ahead of
+    sync jobs. Requests which would have to wait longer than their priority
+    allows raise a :class:`RateLimitError` instead.
+
+    The state lives under a single key, updated while holding a short lock
+    added to the cache, like the locks of the report cache. A request which
+    can't get the lock in time tries again later instead of writing the state
+    unlocked.
+    """
+
+    lock_timeout = 1
+    lock_interval = 0.01
+
+    def __init__(
+        self,
+        name: str,
+        rate: float,
+        burst: float = None,
+        reserve: float = None,
+        alias: str = None,
+    ) -> None:
+        self.name = name
+        self.rate = rate
+        self.burst = max(1.0, burst or rate)
+        self.reserve = (
+            wagtail_analytics_settings.RATE_LIMIT_RESERVE
+            if reserve is None
+            else reserve
+        )
+        self.alias = alias or wagtail_analytics_settings.CACHE_ALIAS
+        self.key = "%s:%s" % (KEY_PREFIX, name)
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get_max_wait(self, priority: str) -> float:
+        if priority == BACKGROUND:
+            return wagtail_analytics_settings.RATE_LIMIT_BACKGROUND_MAX_WAIT
+        return wagtail_analytics_settings.RATE_LIMIT_MAX_WAIT
+
+    def get_floor(self, priority: str) -> float:
+        """Return the tokens which have to be left to take one."""
+        if priority == BACKGROUND:
+            return 1 + self.burst * self.reserve
+        return 1
+
+    def get_state(self, now: float) -> dict:
+        state = self.cache.get(self.key) or {
+            "tokens": self.burst,
+            "updated": now,
+            "blocked_until": 0,
+            "factor": 1.0,
+        }
+        refill = (now - state["updated"]) * self.rate * state["factor"]
+        state["tokens"] = min(self.burst, state["tokens"] + max(0, refill))
+        state["updated"] = now
+        return state
+
+    def set_state(self, state: dict):
+        # Keep the state around until the bucket would be full again, and for as
+        # long as it's blocked
+        timeout = None
+        if self.rate:
+            timeout = int(
+                max(self.burst / self.rate, state["blocked_until"] - state["updated"])
+            )
+            timeout += 60
+        self.cache.set(self.key, state, timeout=timeout)
+
+    @contextmanager
+    def lock(self):
+        """Yield whether the lock was acquired within ``lock_timeout``."""
+        lock_key = self.key + ":lock"
+        start = time.monotonic()
+        # The lock outlives the wait by a second, caches round their timeouts
+        while not self.cache.add(lock_key, 1, timeout=self.lock_timeout + 1):
+            if time.monotonic() - start > self.lock_timeout:
+                yield False
+                return
+            time.sleep(self.lock_interval)
+        acquired = time.monotonic()
+        try:
+            yield True
+        finally:
+            # Once expired the lock may be held by someone else, leave it be
+            if time.monotonic() - acquired < self.lock_timeout:
+                self.cache.delete(lock_key)
+
+    def take(self, priority: str = INTERACTIVE) -> float:
+        """Take a token and return 0, or return how long to wait for one."""
+        now = time.time()
+        with self.lock() as locked:
+            if not locked:
+                return self.lock_interval
+            state = self.get_state(now)
+            if state["blocked_until"] > now:
+                wait = state["blocked_until"] - now
+            else:
+                floor = self.get_floor(priority)
+                if state["tokens"] >= floor:
+                    state["tokens"] -= 1
+                    wait = 0.0
+                elif self.rate:
+                    wait = (floor - state["tokens"]) / (self.rate * state["factor"])
+                else:
+                    wait = float("inf")
+            self.set_state(state)
+        return wait
+
+    def check_wait(self, wait: float, priority: str):
+        if wait > self.get_max_wait(priority):
+            raise RateLimitError(
+                f"Rate limit of {self.name} reached",
+                retry_after=None if wait == float("inf") else wait,
+            )
+
+    def acquire(self, priority: str = INTERACTIVE):
+        """Wait for a token, or raise when it takes too long."""
+        while True:
+            wait = self.take(priority)
+            if not wait:
+                return
+            self.check_wait(wait, priority)
+            time.sleep(wait)
+
+    async def aacquire(self, priority: str = INTERACTIVE):
+        while True:
+            wait = await sync_to_async(self.take, thread_sensitive=False)(priority)
+            if not wait:
+                return
+            self.check_wait(wait, priority)
+            await asyncio.sleep(wait)
+
+    def block(self, seconds: float):
+        """Hold back every request for ``seconds``, after the upstream said so."""
+        now = time.time()
+        with self.lock():
+            # Written even without the lock, holding back matters more than
+            # the tokens another request took meanwhile
+            state = self.get_state(now)
+            state["blocked_until"] = max(state["blocked_until"], now + seconds)
+            state["tokens"] = 0
+            self.set_state(state)
+
+    def report_quota(self, quota: Dict[str, dict]):
+        """
+        Adjust the refill rate to the share of the Google Analytics quota left.
+
+        ``quota`` maps quota names to their consumed and remaining tokens, as
+        sent with the ``quota_reported`` signal. Below half of the quota left the
+        bucket refills proportionally slower, without any left it's blocked until
+        the quota is reset: the next hour, or the next day for ``tokens_per_day``.
+        """
+        now = time.time()
+        left = 1.0
+        exhausted = []
+        for name, status in quota.items():
+            total = status["consumed"] + status["remaining"]
+            if total:
+                left = min(left, status["remaining"] / total)
+                if status["remaining"] <= 0:
+                    exhausted.append(name)
+        if exhausted:
+            self.block(max(get_quota_reset(name, now) for name in exhausted))
+            return
+
+        with self.lock() as locked:
+            if locked:
+                state = self.get_state(now)
+                state["factor"] = max(0.1, min(1.0, left * 2))
+                self.set_state(state)
+
+
+def get_bucket(provider: str, account: str) -> Optional[TokenBucket]:
+    """Return the bucket of an account at a provider, None without a limit."""
+    limit = wagtail_analytics_settings.RATE_LIMITS.get(provider)
+    if not limit:
+        return None
+    return TokenBucket("%s:%s" % (provider, account), limit["rate"], limit.get("burst"))
@@ -0,0 +1,242 @@
+from datetime import date, timedelta
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Sum
+
+from wagtail_analytics import settings as wagtail_analytics_settings
+from wagtail_analytics.lib.analytics import APIClient
+from wagtail_analytics.lib.dates import Period, fill_days, get_local_date
+from wagtail_analytics.models import DailyTopPage, DailyTopSource, DailyVisitors
+from wagtail_analytics.types import TopPage, TopSource
+
+
+def daterange(start: date, end: date) -> List[date]:
+    return Period(start, end).each_day()
+
+
+def get_missing_days(
+    site, since: date, until: date, time_zone: str = None
+) -> List[date]:
+    """
+    Return the days between ``since`` and ``until`` which aren't stored yet.
+
+    Days which were stored before they were over in ``time_zone`` are considered
+    missing too, so the partial numbers of today are replaced by the next sync.
+    """
+    complete = set()
+    stored = DailyVisitors.objects.filter(
+        site=site, date__range=(since, until)
+    ).values_list("date", "updated_at")
+    for day, updated_at in stored:
+        if get_local_date(updated_at, time_zone) > day:
+            complete.add(day)
+    return [day for day in daterange(since, until) if day not in complete]
+
+
+def get_ranges(days: List[date]) -> List[Period]:
+    """Group sorted days into periods of consecutive days."""
+    ranges = []
+    for day in days:
+        if ranges and ranges[-1].end + timedelta(days=1) == day:
+            ranges[-1] = Period(ranges[-1].start, day)
+        else:
+            ranges.append(Period(day, day))
+    return ranges
+
+
+def sync_site(site, client: APIClient, since: date = None, until: date = None):
+    """
+    Store the daily numbers of ``site`` which are missing from the rollup tables.
+
+    Every range of consecutive missing days is fetched with one query per
+    rollup table, grouped by day. Each day is saved in its own transaction, an
+    interrupted sync continues where it left off. Returns the days that were
+    fetched.
+    """
+    until = until or client.get_today()
+    since = since or until - timedelta(
+        days=wagtail_analytics_settings.ROLLUP_INITIAL_DAYS - 1
+    )
+    days = get_missing_days(site, since, until, client.time_zone)
+    limit = wagtail_analytics_settings.ROLLUP_TOP_LIMIT
+    for period in get_ranges(days):
+        visitors = {
+            str(day): int(count) for day, count in client.get_visitors_between(*period)
+        }
+        top_pages = client.get_daily_top_pages_between(*period, limit=limit)
+        top_sources = client.get_daily_top_sources_between(*period, limit=limit)
+        for day in period.each_day():
+            key = day.isoformat()
+            store_day(
+                site,
+                day,
+                visitors.get(key, 0),
+                top_pages.get(key, []),
+                top_sources.get(key, []),
+            )
+    return days
+
+
+@transaction.atomic
+def store_day(site, day: date, visitors: int, top_pages, top_sources):
+    DailyTopPage.objects.filter(site=site, date=day).delete()
+    DailyTopPage.objects.bulk_create(
+        DailyTopPage(site=site, date=day, url=page.url, pageviews=int(page.pageviews))
+        for page in top_pages
+    )
+    DailyTopSource.objects.filter(site=site, date=day).delete()
+    DailyTopSource.objects.bulk_create(
+        DailyTopSource(
+            site=site, date=day, name=source.name, pageviews=int(source.pageviews)
+        )
+        for source in top_sources
+    )
+    DailyVisitors.objects.update_or_create(
+        site=site, date=day, defaults={"visitors": visitors}
+    )
+
+
+def get_report_client(site, analytics_settings, client: APIClient) -> APIClient:
+    """
+    Return the client the dashboard reads reports from: the rollup tables when
+    ``REPORT_SOURCE`` is "rollup", otherwise the provider's ``client``.
+    """
+    if wagtail_analytics_settings.REPORT_SOURCE == "rollup":
+        return RollupAPIClient(site, analytics_settings.time_zone or None)
+    return client
+
+
+class RollupAPIClient(APIClient):
+    """
+    Serve reports from the rollup tables instead of the upstream provider.
+
+    Top pages and sources are summed from the stored daily top lists, so pages
+    which never made a daily top list are not counted. A page report takes the
+    page's counts of the daily top lists as its visitors, days it wasn't in the
+    top list count as zero. Like the live clients, every day of a period has a
+    row, days which weren't synced count as zero.
+    """
+
+    provider = "rollup"
+
+    def __init__(self, site, time_zone: str = None) -> None:
+        self.site = site
+        self.time_zone = time_zone
+
+    def is_concurrent(self) -> bool:
+        # Database queries are quick and shouldn't leak connections into threads
+        return False
+
+    # The ORM is sync only, the whole report is built in Django's sync thread
+
+    async def aget_report(self, period: Period = None, comparison: Period = None):
+        return await sync_to_async(self.get_report)(period, comparison)
+
+    async def aget_section(
+        self, name: str, period: Period = None, comparison: Period = None
+    ):
+        return await sync_to_async(self.get_section)(name, period, comparison)
+
+    async def aget_page_report(
+        self, path: str, period: Period = None, comparison: Period = None
+    ):
+        return await sync_to_async(self.get_page_report)(path, period, comparison)
+
+    async def aget_pageviews(
+        self, paths: Iterable[str], period: Period = None
+    ) -> Dict[str, int]:
+        return await sync_to_async(self.get_pageviews)(list(paths), period)
+
+    def get_visitors_between(
+        self, start: date, end: date, path: str = None
+    ) -> List[Tuple[str, int]]:
+        if path:
+            rows = DailyTopPage.objects.filter(
+                site=self.site, date__range=(start, end), url=path
+            ).values_list("date", "pageviews")
+        else:
+            rows = DailyVisitors.objects.filter(
+                site=self.site, date__range=(start, end)
+            ).values_list("date", "visitors")
+        return fill_days({str(day): visitors for day, visitors in rows}, start, end)
+
+    def get_pageviews_between(
+        self, start: date, end: date, paths: Iterable[str]
+    ) -> Dict[str, int]:
+        paths = list(paths)
+        pageviews = dict.fromkeys(paths, 0)
+        rows = (
+            DailyTopPage.objects.filter(
+                site=self.site, date__range=(start, end), url__in=paths
+            )
+            .values("url")
+            .annotate(total=Sum("pageviews"))
+        )
+        for row in rows:
+            pageviews[row["url"]] = row["total"]
+        return pageviews
+
+    def get_top_pages_between(
+        self, start: date, end: date, limit: int = 10
+    ) -> List[TopPage]:
+        rows = (
+            DailyTopPage.objects.filter(site=self.site, date__range=(start, end))
+            .values("url")
+            .annotate(total=Sum("pageviews"))
+            .order_by("-total")[:limit]
+        )
+        return [TopPage(url=row["url"], pageviews=row["total"]) for row in rows]
+
+    def get_top_sources_between(
+        self, start: date, end: date, limit: int = 10
+    ) -> List[TopSource]:
+        rows = (
+            DailyTopSource.objects.filter(site=self.site, date__range=(start, end))
+            .values("name")
+            .annotate(total=Sum("pageviews"))
+            .order_by("-total")[:limit]
+        )
+        return [TopSource(name=row["name"], pageviews=row["total"]) for row in rows]
+
+    def iter_rows(
+        self, dimension: str, start: date, end: date, page_size: int = None
+    ) -> Iterator[dict]:
+        chunk_size = page_size or wagtail_analytics_settings.EXPORT_PAGE_SIZE
+        if dimension == "date":
+            rows = (
+                DailyVisitors.objects.filter(site=self.site, date__range=(start, end))
+                .order_by("date")
+                .values_list("date", "visitors")
+            )
+            for day, visitors in rows.iterator(chunk_size=chunk_size):
+                yield {"date": str(day), "visitors": visitors, "pageviews": None}
+            return
+
+        # Only the daily top lists are stored, see the class docstring
+        model, field = {
+            "page": (DailyTopPage, "url"),
+            "source": (DailyTopSource, "name"),
+        }[dimension]
+        rows = (
+            model.objects.filter(site=self.site, date__range=(start, end))
+            .values(field)
+            .annotate(total=Sum("pageviews"))
+            .order_by(field)
+            .values_list(field, "total")
+        )
+        for value, total in rows.iterator(chunk_size=chunk_size):
+            yield {dimension: value, "visitors": None, "pageviews": total}
+
+    def get_visitors_this_week(self) -> List[Tuple[str, int]]:
+        return self.get_visitors_between(*self.get_this_week())
+
+    def get_visitors_last_week(self) -> List[Tuple[str, int]]:
+        return self.get_visitors_between(*self.get_last_week())
+
+    def get_top_pages(self) -> List[TopPage]:
+        return self.get_top_pages_between(*self.get_this_week())
+
+    def get_top_sources(self) -> List[TopSource]:
+        return self.get_top_sources_between(*self.get_this_week())
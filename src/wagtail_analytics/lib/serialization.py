@@ -0,0 +1,68 @@
+import dataclasses
+import hashlib
+import json
+import sys
+from functools import partial
+from typing import Any
+
+from django.http import HttpResponse
+from django.utils.http import quote_etag
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# The ETag isn't a secret, which lets FIPS systems compute it. hashlib only takes
+# usedforsecurity on Python 3.9 and later.
+if sys.version_info >= (3, 9):
+    md5 = partial(hashlib.md5, usedforsecurity=False)
+else:  # pragma: no cover
+    md5 = hashlib.md5
+
+_field_names = {}
+
+
+def get_field_names(cls) -> tuple:
+    names = _field_names.get(cls)
+    if names is None:
+        names = _field_names[cls] = tuple(
+            field.name for field in dataclasses.fields(cls)
+        )
+    return names
+
+
+def to_data(value: Any) -> Any:
+    """
+    Return reports and other dataclasses as dicts and lists for ``json``.
+
+    Unlike ``dataclasses.asdict`` nothing is deep copied, lists of plain values
+    such as the columns of a timeseries are used as they are.
+    """
+    if dataclasses.is_dataclass(value):
+        return {
+            name: to_data(getattr(value, name)) for name in get_field_names(type(value))
+        }
+    if isinstance(value, (list, tuple)):
+        if value and not isinstance(value[0], (str, int, float)):
+            return [to_data(item) for item in value]
+        return value
+    if isinstance(value, dict):
+        return {key: to_data(item) for key, item in value.items()}
+    return value
+
+
+def dumps(value: Any) -> bytes:
+    """Encode a report, or any JSON compatible data, with orjson when installed."""
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(to_data(value), separators=(",", ":")).encode()
+
+
+def json_response(value: Any, **kwargs) -> HttpResponse:
+    return HttpResponse(dumps(value), content_type="application/json", **kwargs)
+
+
+def get_etag(value: Any) -> str:
+    """Return the ETag Django would give the JSON response of ``value``."""
+    return quote_etag(md5(dumps(value)).hexdigest())
@@ -0,0 +1,143 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.exceptions import DisallowedHost
+from wagtail.models import Site
+
+from wagtail_analytics import settings as wagtail_analytics_settings
+from wagtail_analytics.models import AnalyticsSettings
+
+VERSION_KEY = "wagtail-analytics:settings-version"
+
+MISSING = object()
+
+
+class SettingsCache:
+    """
+    Keep sites and their analytics settings in memory, so rendering the
+    tracking snippets doesn't cost any queries.
+
+    The signal handlers clear the cache when a site or its settings change and
+    bump a version number in Django's cache. Other processes compare their
+    version with it at most once every ``check_interval`` seconds.
+
+    Sites are looked up by the validated host of a request, keeping the last
+    ``max_hosts`` of them, so made up Host headers can't fill the memory.
+    """
+
+    max_hosts = 100
+
+    def __init__(self, alias: str = None, check_interval: float = None) -> None:
+        self.alias = alias or wagtail_analytics_settings.CACHE_ALIAS
+        self.check_interval = (
+            wagtail_analytics_settings.SETTINGS_CACHE_CHECK_INTERVAL
+            if check_interval is None
+            else check_interval
+        )
+        self._version = None
+        self._checked_at = 0
+        self._hosts_lock = threading.Lock()
+        self.reset()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @property
+    def is_enabled(self) -> bool:
+        return wagtail_analytics_settings.SETTINGS_CACHE
+
+    def reset(self):
+        self._entries = {}
+        self._hosts = OrderedDict()
+
+    def clear(self):
+        """Drop the entries of every process."""
+        self.reset()
+        self.cache.add(VERSION_KEY, 0, timeout=None)
+        try:
+            self._version = self.cache.incr(VERSION_KEY)
+        except ValueError:
+            # Evicted between add() and incr()
+            self._version = None
+        self._checked_at = time.monotonic()
+
+    def check_version(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        version = self.cache.get(VERSION_KEY)
+        if version != self._version:
+            self.reset()
+            self._version = version
+
+    def get(self, key: tuple, fetch):
+        if not self.is_enabled:
+            return fetch()
+        self.check_version()
+        entries = self._entries
+        try:
+            return entries[key]
+        except KeyError:
+            pass
+        value = fetch()
+        entries[key] = value
+        return value
+
+    def get_site(self, site_id) -> Site:
+        site = self.get(
+            ("site", str(site_id)),
+            lambda: Site.objects.filter(id=site_id).first(),
+        )
+        if site is None:
+            raise Site.DoesNotExist
+        return site
+
+    def get_site_for_request(self, request) -> Site:
+        if hasattr(request, "_wagtail_site"):
+            return request._wagtail_site
+        try:
+            host = request.get_host()
+        except DisallowedHost:
+            host = None
+        if host is None or not self.is_enabled:
+            return Site.find_for_request(request)
+
+        self.check_version()
+        hosts = self._hosts
+        key = (host, request.get_port())
+        with self._hosts_lock:
+            site = hosts.get(key, MISSING)
+            if site is not MISSING:
+                hosts.move_to_end(key)
+        if site is MISSING:
+            site = Site.find_for_request(request)
+            with self._hosts_lock:
+                hosts[key] = site
+                if len(hosts) > self.max_hosts:
+                    hosts.popitem(last=False)
+        request._wagtail_site = site
+        return site
+
+    def get_default_site(self) -> Site:
+        return self.get(
+            ("default-site",), lambda: Site.objects.get(is_default_site=True)
+        )
+
+    def get_site_count(self) -> int:
+        return self.get(("site-count",), Site.objects.count)
+
+    def get_settings(self, site) -> AnalyticsSettings:
+        return self.get(("settings", site.pk), lambda: AnalyticsSettings.for_site(site))
+
+    def get_settings_for_request(self, request):
+        site = self.get_site_for_request(request)
+        if site is None:
+            return None
+        return self.get_settings(site)
+
+
+settings_cache = SettingsCache()
@@ -0,0 +1,95 @@
+import logging
+from typing import List, Optional
+
+from django.template.loader import render_to_string
+from django.urls import NoReverseMatch, reverse
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+
+from wagtail_analytics import settings as wagtail_analytics_settings
+from wagtail_analytics.lib.providers import get_plausible_url
+from wagtail_analytics.lib.settings_cache import settings_cache
+
+logger = logging.getLogger(__name__)
+
+# Rendered in place of the nonce attribute, so the cached HTML can be shared
+# by requests with different nonces
+NONCE_MARKER = "__wagtail_analytics_nonce__"
+
+TEMPLATES = {
+    "head": "wagtail_analytics/tags/head.html",
+    "body": "wagtail_analytics/tags/body.html",
+}
+
+
+def get_collect_url(analytics_settings) -> Optional[str]:
+    if not analytics_settings.collect_enabled:
+        return None
+    try:
+        return reverse("wagtail-analytics-collect")
+    except NoReverseMatch:
+        logger.warning(
+            "First-party collection needs wagtail_analytics.urls in the URLconf"
+        )
+        return None
+
+
+def get_resource_hints(analytics_settings, collect_url=None) -> List[str]:
+    """Return the origins the snippets load their scripts from."""
+    origins = []
+    if (
+        analytics_settings.plausible_enabled
+        and analytics_settings.plausible_domain
+        and not collect_url
+    ):
+        origins.append(get_plausible_url(analytics_settings.plausible_domain))
+    if (
+        analytics_settings.google_tag_manager_enabled
+        and analytics_settings.google_tag_manager_container_id
+    ) or (
+        analytics_settings.google_analytics_enabled
+        and analytics_settings.google_analytics_measurement_id
+        and not collect_url
+    ):
+        origins.append("https://www.googletagmanager.com")
+    return origins
+
+
+def render_snippet(analytics_settings, name: str) -> str:
+    collect_url = get_collect_url(analytics_settings)
+    resource_hints = []
+    if wagtail_analytics_settings.RESOURCE_HINTS:
+        resource_hints = get_resource_hints(analytics_settings, collect_url)
+    html = render_to_string(
+        TEMPLATES[name],
+        {
+            "settings": analytics_settings,
+            "nonce_attribute": mark_safe(NONCE_MARKER),
+            "resource_hints": resource_hints,
+            "collect_url": collect_url,
+        },
+    )
+    # Drop the blank lines left by the template tags, it's only done once
+    return "\n".join(line for line in html.splitlines() if line.strip())
+
+
+def add_nonce(html: str, nonce: str = None) -> str:
+    attribute = format_html(' nonce="{}"', nonce) if nonce else ""
+    return html.replace(NONCE_MARKER, attribute)
+
+
+def get_snippet(request, name: str, nonce: str = None) -> str:
+    """
+    Return the head or body snippet of the site of ``request``.
+
+    The HTML is rendered once per site and kept in the settings cache, so it's
+    rendered again when the settings change.
+    """
+    analytics_settings = settings_cache.get_settings_for_request(request)
+    if analytics_settings is None:
+        return ""
+    html = settings_cache.get(
+        ("snippet", analytics_settings.site_id, name),
+        lambda: render_snippet(analytics_settings, name),
+    )
+    return add_nonce(html, nonce)
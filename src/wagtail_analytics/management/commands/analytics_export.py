@@ -0,0 +1,72 @@
+from django.core.management.base import BaseCommand, CommandError
+from wagtail.models import Site
+
+from wagtail_analytics.lib import export
+from wagtail_analytics.lib.analytics import get_api_client
+from wagtail_analytics.lib.exceptions import AnalyticsError
+from wagtail_analytics.models import AnalyticsSettings
+
+
+class Command(BaseCommand):
+    help = (
+        "Export the visitors and pageviews of a site by date, page or source as CSV "
+        "or NDJSON. Rows are fetched page by page and written as they arrive."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("site", help="Id or hostname of the site.")
+        parser.add_argument(
+            "--dimension",
+            choices=export.DIMENSIONS,
+            default="page",
+            help="Break the numbers down by date, page or source.",
+        )
+        parser.add_argument("--start", help="First day (YYYY-MM-DD).")
+        parser.add_argument("--end", help="Last day (YYYY-MM-DD), defaults to today.")
+        parser.add_argument("--format", choices=list(export.FORMATS), default="csv")
+        parser.add_argument(
+            "--page-size", type=int, help="Number of rows fetched per request."
+        )
+        parser.add_argument(
+            "--output", help="Write to this file instead of standard output."
+        )
+
+    def handle(self, *args, **options):
+        site = self.get_site(options["site"])
+        client = get_api_client(site, AnalyticsSettings.for_site(site))
+        if client is None:
+            raise CommandError(f"{site.hostname} doesn't have analytics enabled.")
+
+        try:
+            dimension, start, end, format = export.parse_params(
+                dimension=options["dimension"],
+                start=options["start"],
+                end=options["end"],
+                format=options["format"],
+                today=client.get_today(),
+            )
+        except ValueError as e:
+            raise CommandError(e)
+
+        rows = client.iter_rows(dimension, start, end, page_size=options["page_size"])
+        output = open(options["output"], "w", newline="") if options["output"] else None
+        try:
+            for chunk in export.serialize(rows, dimension, format):
+                if output is None:
+                    self.stdout.write(chunk, ending="")
+                else:
+                    output.write(chunk)
+        except AnalyticsError as e:
+            raise CommandError(f"Export failed: {e}")
+        finally:
+            if output is not None:
+                output.close()
+
+    def get_site(self, value: str) -> Site:
+        sites = Site.objects.all()
+        try:
+            if value.isdigit():
+                return sites.get(pk=value)
+            return sites.get(hostname=value)
+        except Site.DoesNotExist:
+            raise CommandError(f"Site {value} doesn't exist.")
@@ -0,0 +1,119 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from wagtail.models import Site
+
+from wagtail_analytics import settings as wagtail_analytics_settings
+from wagtail_analytics.lib.analytics import get_api_client
+from wagtail_analytics.lib.cache import ReportCache
+from wagtail_analytics.lib.ratelimit import BACKGROUND, RateLimiter
+from wagtail_analytics.lib.rollup import get_report_client, sync_site
+from wagtail_analytics.models import AnalyticsSettings
+
+
+class Command(BaseCommand):
+    help = (
+        "Fetch analytics for every site with analytics enabled, storing the daily "
+        "rollups and warming the report cache. Days already stored are skipped, so "
+        "an interrupted run continues where it left off."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--site",
+            action="append",
+            dest="sites",
+            default=[],
+            help="Only sync the site with this id or hostname, may be repeated.",
+        )
+        parser.add_argument(
+            "--since",
+            type=date.fromisoformat,
+            help="Backfill from this date (YYYY-MM-DD) instead of only new days.",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=wagtail_analytics_settings.SYNC_CONCURRENCY,
+            help="Number of sites synced in parallel.",
+        )
+        parser.add_argument(
+            "--no-rollup",
+            action="store_false",
+            dest="rollup",
+            help="Don't store daily rollups.",
+        )
+        parser.add_argument(
+            "--no-warm-cache",
+            action="store_false",
+            dest="warm_cache",
+            help="Don't refresh the cached dashboard reports.",
+        )
+
+    def handle(self, *args, **options):
+        self.verbosity = options["verbosity"]
+        self.rate_limiters = {
+            provider: RateLimiter(rate)
+            for provider, rate in wagtail_analytics_settings.SYNC_RATE_LIMITS.items()
+        }
+
+        sites = self.get_sites(options["sites"])
+        if not sites:
+            self.stdout.write("No sites with analytics enabled.")
+            return
+
+        failed = []
+        with ThreadPoolExecutor(max_workers=max(1, options["concurrency"])) as pool:
+            futures = {
+                pool.submit(
+                    self.sync,
+                    site,
+                    options["since"],
+                    options["rollup"],
+                    options["warm_cache"],
+                ): site
+                for site in sites
+            }
+            for future in as_completed(futures):
+                site = futures[future]
+                try:
+                    days = future.result()
+                except Exception as e:
+                    failed.append(site)
+                    self.stderr.write(f"{site.hostname}: {e}")
+                    continue
+                if self.verbosity >= 1:
+                    self.stdout.write(f"{site.hostname}: synced {len(days)} day(s)")
+
+        if failed:
+            raise CommandError(
+                "Sync failed for %s" % ", ".join(site.hostname for site in failed)
+            )
+
+    def get_sites(self, filters):
+        sites = Site.objects.all()
+        if filters:
+            ids = [value for value in filters if value.isdigit()]
+            hostnames = [value for value in filters if not value.isdigit()]
+            sites = sites.filter(pk__in=ids) | sites.filter(hostname__in=hostnames)
+        return [site for site in sites if AnalyticsSettings.for_site(site).is_enabled]
+
+    def sync(self, site, since, rollup, warm_cache):
+        try:
+            analytics_settings = AnalyticsSettings.for_site(site)
+            client = get_api_client(site, analytics_settings)
+            client.rate_limiter = self.rate_limiters.get(client.provider)
+            client.priority = BACKGROUND
+
+            days = []
+            if rollup:
+                days = sync_site(site, client, since=since)
+            if warm_cache:
+                # Warm the report the dashboard reads, its sections are served from it
+                report_client = get_report_client(site, analytics_settings, client)
+                ReportCache().get_report(site, report_client, refresh=True)
+            return days
+        finally:
+            close_old_connections()
@@ -0,0 +1,130 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("wagtail_analytics", "0006_analyticssettings_google_analytics_measurement_id"),
+        ("wagtailcore", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DailyTopPage",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField(verbose_name="Date")),
+                ("url", models.TextField(verbose_name="URL")),
+                (
+                    "pageviews",
+                    models.PositiveIntegerField(default=0, verbose_name="Pageviews"),
+                ),
+                (
+                    "site",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="wagtailcore.site",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Daily top page",
+                "verbose_name_plural": "Daily top pages",
+                "indexes": [
+                    models.Index(
+                        fields=["site", "date"], name="wagtail_ana_site_id_c45e2b_idx"
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="DailyTopSource",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField(verbose_name="Date")),
+                ("name", models.TextField(verbose_name="Name")),
+                (
+                    "pageviews",
+                    models.PositiveIntegerField(default=0, verbose_name="Pageviews"),
+                ),
+                (
+                    "site",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="wagtailcore.site",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Daily top source",
+                "verbose_name_plural": "Daily top sources",
+                "indexes": [
+                    models.Index(
+                        fields=["site", "date"], name="wagtail_ana_site_id_2928c9_idx"
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="DailyVisitors",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField(verbose_name="Date")),
+                (
+                    "visitors",
+                    models.PositiveIntegerField(default=0, verbose_name="Visitors"),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, verbose_name="Updated at"),
+                ),
+                (
+                    "site",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="wagtailcore.site",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Daily visitors",
+                "verbose_name_plural": "Daily visitors",
+                "ordering": ["site", "date"],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("site", "date"), name="unique_daily_visitors_site_date"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("wagtail_analytics", "0007_dailyvisitors_dailytoppage_dailytopsource"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="analyticssettings",
+            name="collect_enabled",
+            field=models.BooleanField(
+                default=False,
+                help_text="Collect events through this site and forward them to Plausible and Google Analytics, instead of loading their scripts in the browser",
+                verbose_name="First-party collection",
+            ),
+        ),
+        migrations.AddField(
+            model_name="analyticssettings",
+            name="google_analytics_api_secret",
+            field=models.CharField(
+                blank=True,
+                help_text="Measurement Protocol API secret, used by first-party collection",
+                max_length=255,
+                null=True,
+                verbose_name="Google Analytics API Secret",
+            ),
+        ),
+    ]
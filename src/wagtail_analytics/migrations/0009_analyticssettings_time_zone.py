@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("wagtail_analytics", "0008_analyticssettings_collect"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="analyticssettings",
+            name="time_zone",
+            field=models.CharField(
+                blank=True,
+                help_text="Time zone of the report periods, such as Europe/Amsterdam. Defaults to the TIME_ZONE setting",
+                max_length=63,
+                verbose_name="Time zone",
+            ),
+        ),
+    ]
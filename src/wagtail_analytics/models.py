@@ -1,10 +1,16 @@
+from urllib.parse import urlparse
+
+from django.core.exceptions import ValidationError
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 from django.utils.translation import pgettext_lazy
 from wagtail.admin.panels import FieldPanel, HelpPanel, MultiFieldPanel
 from wagtail.contrib.settings.models import BaseSiteSetting, register_setting
+from wagtail.models import Site
 
 from wagtail_analytics import settings
+from wagtail_analytics.lib.dates import get_time_zone
+from wagtail_analytics.lib.providers import get_plausible_url, provider_registry
 
 
 @register_setting(icon="view")
@@ -47,6 +53,35 @@ class AnalyticsSettings(BaseSiteSetting):
         blank=True,
     )
 
+    google_analytics_api_secret = models.CharField(
+        verbose_name=_("Google Analytics API Secret"),
+        help_text=_("Measurement Protocol API secret, used by first-party collection"),
+        max_length=255,
+        null=True,
+        blank=True,
+    )
+
+    #: first-party collection
+    collect_enabled = models.BooleanField(
+        verbose_name=_("First-party collection"),
+        help_text=_(
+            "Collect events through this site and forward them to Plausible and "
+            "Google Analytics, instead of loading their scripts in the browser"
+        ),
+        default=False,
+    )
+
+    #: reports
+    time_zone = models.CharField(
+        verbose_name=_("Time zone"),
+        help_text=_(
+            "Time zone of the report periods, such as Europe/Amsterdam. Defaults "
+            "to the TIME_ZONE setting"
+        ),
+        max_length=63,
+        blank=True,
+    )
+
     google_site_verification = models.CharField(
         verbose_name=_("Google Site Verification"),
         max_length=255,
@@ -74,9 +109,22 @@ class AnalyticsSettings(BaseSiteSetting):
                 FieldPanel("google_analytics_enabled"),
                 FieldPanel("google_analytics_property_id"),
                 FieldPanel("google_analytics_measurement_id"),
+                FieldPanel("google_analytics_api_secret"),
             ],
             heading=_("Google Analytics"),
         ),
+        MultiFieldPanel(
+            [
+                FieldPanel("collect_enabled"),
+            ],
+            heading=_("First-party collection"),
+        ),
+        MultiFieldPanel(
+            [
+                FieldPanel("time_zone"),
+            ],
+            heading=_("Reports"),
+        ),
         MultiFieldPanel(
             [
                 FieldPanel("google_site_verification"),
@@ -88,8 +136,77 @@ class AnalyticsSettings(BaseSiteSetting):
     class Meta:
         verbose_name = _("Analytics")
 
+    def clean(self):
+        super().clean()
+        if urlparse(get_plausible_url(self.plausible_domain)).scheme not in (
+            "http",
+            "https",
+        ):
+            raise ValidationError(
+                {
+                    "plausible_domain": _(
+                        "Enter a domain, such as plausible.io, or an http or https "
+                        "URL, such as http://plausible.lan:8000"
+                    )
+                }
+            )
+        if self.time_zone:
+            try:
+                get_time_zone(self.time_zone)
+            except ValueError:
+                raise ValidationError(
+                    {
+                        "time_zone": _(
+                            "Enter a valid time zone, such as Europe/Amsterdam"
+                        )
+                    }
+                )
+
+    @property
+    def plausible_url(self):
+        return get_plausible_url(self.plausible_domain)
+
     @property
     def is_enabled(self):
-        if self.plausible_enabled or self.google_analytics_enabled:
-            return True
-        return False
+        return provider_registry.get_provider(self) is not None
+
+
+class DailyVisitors(models.Model):
+    site = models.ForeignKey(Site, on_delete=models.CASCADE, related_name="+")
+    date = models.DateField(verbose_name=_("Date"))
+    visitors = models.PositiveIntegerField(verbose_name=_("Visitors"), default=0)
+    updated_at = models.DateTimeField(verbose_name=_("Updated at"), auto_now=True)
+
+    class Meta:
+        verbose_name = _("Daily visitors")
+        verbose_name_plural = _("Daily visitors")
+        ordering = ["site", "date"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["site", "date"], name="unique_daily_visitors_site_date"
+            )
+        ]
+
+
+class DailyTopPage(models.Model):
+    site = models.ForeignKey(Site, on_delete=models.CASCADE, related_name="+")
+    date = models.DateField(verbose_name=_("Date"))
+    url = models.TextField(verbose_name=_("URL"))
+    pageviews = models.PositiveIntegerField(verbose_name=_("Pageviews"), default=0)
+
+    class Meta:
+        verbose_name = _("Daily top page")
+        verbose_name_plural = _("Daily top pages")
+        indexes = [models.Index(fields=["site", "date"])]
+
+
+class DailyTopSource(models.Model):
+    site = models.ForeignKey(Site, on_delete=models.CASCADE, related_name="+")
+    date = models.DateField(verbose_name=_("Date"))
+    name = models.TextField(verbose_name=_("Name"))
+    pageviews = models.PositiveIntegerField(verbose_name=_("Pageviews"), default=0)
+
+    class Meta:
+        verbose_name = _("Daily top source")
+        verbose_name_plural = _("Daily top sources")
+        indexes = [models.Index(fields=["site", "date"])]
@@ -8,6 +8,66 @@ def get_setting(name: str, default=None):
 
 GA_KEY_CONTENT = get_setting("GA_KEY_CONTENT", default="")
 PLAUSIBLE_API_KEY = get_setting("PLAUSIBLE_API_KEY", default="")
+PLAUSIBLE_API_VERSION = get_setting("PLAUSIBLE_API_VERSION", default=1)
 PATH_PREFIX = get_setting("PATH_PREFIX", default="analytics")
 MENU_LABEL = get_setting("MENU_LABEL", default=_("Analytics"))
 MENU_ORDER = get_setting("MENU_ORDER", default=8000)
+CONCURRENT_REPORTS = get_setting("CONCURRENT_REPORTS", default=True)
+REPORT_MAX_WORKERS = get_setting("REPORT_MAX_WORKERS", default=8)
+REPORT_TIMEOUT = get_setting("REPORT_TIMEOUT", default=10)
+PARTIAL_REPORTS = get_setting("PARTIAL_REPORTS", default=True)
+CACHE_ALIAS = get_setting("CACHE_ALIAS", default="default")
+CACHE_TIMEOUT = get_setting("CACHE_TIMEOUT", default=300)
+CACHE_STALE_TIMEOUT = get_setting("CACHE_STALE_TIMEOUT", default=3600)
+CACHE_LOCK_TIMEOUT = get_setting("CACHE_LOCK_TIMEOUT", default=30)
+BROWSER_CACHE_MAX_AGE = get_setting("BROWSER_CACHE_MAX_AGE", default=60)
+BROWSER_CACHE_STALE_WHILE_REVALIDATE = get_setting(
+    "BROWSER_CACHE_STALE_WHILE_REVALIDATE", default=300
+)
+GA_BATCH_REQUESTS = get_setting("GA_BATCH_REQUESTS", default=True)
+HTTP_POOL_SIZE = get_setting("HTTP_POOL_SIZE", default=10)
+HTTP2 = get_setting("HTTP2", default=False)
+HTTP_CONNECT_TIMEOUT = get_setting("HTTP_CONNECT_TIMEOUT", default=3.05)
+HTTP_READ_TIMEOUT = get_setting("HTTP_READ_TIMEOUT", default=10)
+HTTP_MAX_RETRIES = get_setting("HTTP_MAX_RETRIES", default=2)
+HTTP_BACKOFF_FACTOR = get_setting("HTTP_BACKOFF_FACTOR", default=0.5)
+HTTP_BACKOFF_MAX = get_setting("HTTP_BACKOFF_MAX", default=10)
+REPORT_SOURCE = get_setting("REPORT_SOURCE", default="live")
+ROLLUP_INITIAL_DAYS = get_setting("ROLLUP_INITIAL_DAYS", default=14)
+ROLLUP_TOP_LIMIT = get_setting("ROLLUP_TOP_LIMIT", default=50)
+SYNC_CONCURRENCY = get_setting("SYNC_CONCURRENCY", default=4)
+SYNC_RATE_LIMITS = get_setting(
+    "SYNC_RATE_LIMITS", default={"plausible": 10, "google_analytics": 5}
+)
+RATE_LIMITS = get_setting(
+    "RATE_LIMITS",
+    default={
+        # Plausible allows 600 requests per hour per API key
+        "plausible": {"rate": 600 / 3600, "burst": 100},
+        "google_analytics": {"rate": 10, "burst": 20},
+    },
+)
+RATE_LIMIT_RESERVE = get_setting("RATE_LIMIT_RESERVE", default=0.25)
+RATE_LIMIT_MAX_WAIT = get_setting("RATE_LIMIT_MAX_WAIT", default=5)
+RATE_LIMIT_BACKGROUND_MAX_WAIT = get_setting(
+    "RATE_LIMIT_BACKGROUND_MAX_WAIT", default=300
+)
+RATE_LIMIT_BACKOFF = get_setting("RATE_LIMIT_BACKOFF", default=60)
+SERVER_TIMING = get_setting("SERVER_TIMING", default=True)
+ASYNC_VIEWS = get_setting("ASYNC_VIEWS", default=False)
+OVERVIEW_MAX_WORKERS = get_setting("OVERVIEW_MAX_WORKERS", default=8)
+OVERVIEW_TIMEOUT = get_setting("OVERVIEW_TIMEOUT", default=30)
+SETTINGS_CACHE = get_setting("SETTINGS_CACHE", default=True)
+SETTINGS_CACHE_CHECK_INTERVAL = get_setting("SETTINGS_CACHE_CHECK_INTERVAL", default=5)
+RESOURCE_HINTS = get_setting("RESOURCE_HINTS", default=True)
+COLLECT_QUEUE_SIZE = get_setting("COLLECT_QUEUE_SIZE", default=10000)
+COLLECT_BATCH_SIZE = get_setting("COLLECT_BATCH_SIZE", default=25)
+COLLECT_FLUSH_INTERVAL = get_setting("COLLECT_FLUSH_INTERVAL", default=1)
+COLLECT_WORKERS = get_setting("COLLECT_WORKERS", default=2)
+COLLECT_MAX_BODY_SIZE = get_setting("COLLECT_MAX_BODY_SIZE", default=4096)
+COLLECT_RATE_LIMITS = get_setting(
+    "COLLECT_RATE_LIMITS", default={"plausible": 50, "google_analytics": 20}
+)
+COLLECT_CONCURRENCY = get_setting("COLLECT_CONCURRENCY", default=4)
+COLLECT_IP_HEADER = get_setting("COLLECT_IP_HEADER", default=None)
+EXPORT_PAGE_SIZE = get_setting("EXPORT_PAGE_SIZE", default=1000)
@@ -0,0 +1,17 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from wagtail.models import Site
+
+from wagtail_analytics.lib.settings_cache import settings_cache
+from wagtail_analytics.models import AnalyticsSettings
+
+
+def clear_settings_cache(**kwargs):
+    # Wait for the commit, or another request could cache the old values again
+    transaction.on_commit(settings_cache.clear)
+
+
+def register_signal_handlers():
+    for model in (AnalyticsSettings, Site):
+        post_save.connect(clear_settings_cache, sender=model)
+        post_delete.connect(clear_settings_cache, sender=model)
@@ -0,0 +1,18 @@
+from django.dispatch import Signal
+
+#: Sent after every upstream API call, with ``provider``, ``operation``,
+#: ``section``, ``duration`` (seconds), ``bytes_received``, ``retries``,
+#: ``status`` and ``error`` arguments.
+upstream_request_finished = Signal()
+
+#: Sent when Google Analytics reports its property quota, with ``provider``,
+#: ``property_id`` and ``quota`` (a dict of consumed/remaining tokens).
+quota_reported = Signal()
+
+#: Sent after a report was assembled, with ``provider``, ``report_type``,
+#: ``duration`` (seconds) and ``errors`` arguments.
+report_built = Signal()
+
+#: Sent on every report cache lookup, with ``key`` and ``result`` which is one
+#: of ``"hit"``, ``"stale"`` or ``"miss"``.
+report_cache_lookup = Signal()
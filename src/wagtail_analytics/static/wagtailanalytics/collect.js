@@ -0,0 +1,20 @@
+(function () {
+  var script = document.currentScript;
+  var endpoint = script.getAttribute("data-api");
+
+  function track(name, props) {
+    var data = JSON.stringify({
+      n: name,
+      u: window.location.href,
+      r: document.referrer || null,
+      p: props || null,
+    });
+    if (navigator.sendBeacon && navigator.sendBeacon(endpoint, data)) {
+      return;
+    }
+    fetch(endpoint, { method: "POST", body: data, keepalive: true });
+  }
+
+  window.wagtailAnalytics = { track: track };
+  track("pageview");
+})();
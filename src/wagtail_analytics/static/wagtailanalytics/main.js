@@ -1,6 +1,40 @@
+// Wagtail marks admin responses as not cacheable, so keep the last response
+// of every report and let the server answer with a 304 when it hasn't changed.
+function fetchReport(reportUrl) {
+  var key = "wagtail-analytics:" + reportUrl;
+  var cached = null;
+  try {
+    cached = JSON.parse(sessionStorage.getItem(key));
+  } catch (error) {
+    cached = null;
+  }
+  var headers = {};
+  if (cached && cached.etag) {
+    headers["If-None-Match"] = cached.etag;
+  }
+  return fetch(`${reportUrl}`, { headers: headers }).then((response) => {
+    if (response.status === 304 && cached) {
+      return cached.report;
+    }
+    return response.json().then((report) => {
+      var etag = response.headers.get("ETag");
+      if (response.ok && etag) {
+        try {
+          sessionStorage.setItem(
+            key,
+            JSON.stringify({ etag: etag, report: report })
+          );
+        } catch (error) {
+          // Storage is full or disabled, the next load fetches the whole report
+        }
+      }
+      return report;
+    });
+  });
+}
+
 function getReport(reportUrl) {
-  fetch(`${reportUrl}`)
-    .then((response) => response.json())
+  fetchReport(reportUrl)
     .then((report) => {
       console.log(report);
       renderSessions("sessions-container", report);
@@ -14,8 +48,75 @@ function getReport(reportUrl) {
     });
 }
 
+// Fetch the sections of the dashboard side by side and render each one as soon
+// as it arrives, so a slow or failing section doesn't hold up the others.
+function getReportSections(sectionUrls) {
+  var sections = {
+    visitors: function (data) {
+      renderSessions("sessions-container", data);
+    },
+    top_pages: function (data) {
+      renderTopPages("top-pages-container", data["top_pages"]);
+    },
+    top_sources: function (data) {
+      renderTopReferrers("top-referrers-container", data["top_sources"]);
+    },
+  };
+  var containers = {
+    visitors: "sessions-container",
+    top_pages: "top-pages-container",
+    top_sources: "top-referrers-container",
+  };
+
+  Object.keys(sections).forEach(function (name) {
+    fetchReport(sectionUrls[name])
+      .then((section) => {
+        if (section["error"] || (section["errors"] || []).length) {
+          renderSectionError(containers[name]);
+        } else {
+          sections[name](section["data"]);
+        }
+        return true;
+      })
+      .catch(function (error) {
+        console.log("Request failed", error);
+        renderSectionError(containers[name]);
+        return false;
+      });
+  });
+}
+
+function renderSectionError(container) {
+  var element = document.getElementById(container);
+  var message = document.createElement("p");
+  message.className = "help-block help-critical";
+  message.textContent = "Unable to load this section, please try again later.";
+
+  element.innerHTML = "";
+  if (element.tagName === "TBODY") {
+    var row = element.insertRow();
+    var cell = row.insertCell();
+    cell.colSpan = 2;
+    cell.appendChild(message);
+  } else {
+    element.appendChild(message);
+  }
+}
+
+function getPageReport(reportUrl, container) {
+  fetchReport(reportUrl)
+    .then((report) => {
+      renderSessions(container, report);
+      return true;
+    })
+    .catch(function (error) {
+      console.log("Request failed", error);
+      return false;
+    });
+}
+
 function makeCanvas(container) {
-  var container = document.getElementById("sessions-container");
+  var container = document.getElementById(container);
   var canvas = document.createElement("canvas");
   var ctx = canvas.getContext("2d");
 
@@ -28,14 +129,8 @@ function makeCanvas(container) {
 }
 
 function renderSessions(container, report) {
-  this_week_integers = [];
-  last_week_integers = [];
-
-  for (var i = 0; i < report["visitors_this_week"].length; i++) {
-    this_week_integers.push(parseInt(report["visitors_this_week"][i][1]));
-    last_week_integers.push(parseInt(report["visitors_last_week"][i][1]));
-  }
-  var labels = report["visitors_this_week"].map((value) => value[0]);
+  // Timeseries come as parallel lists of ISO dates and integer counts
+  var labels = report["visitors_this_week"]["dates"];
   var data = {
     labels,
     datasets: [
@@ -43,13 +138,13 @@ function renderSessions(container, report) {
         label: "Last Week",
         backgroundColor: "rgba(252,242,242,0.5)",
         borderColor: "rgba(252,242,242,1)",
-        data: last_week_integers,
+        data: report["visitors_last_week"]["values"],
       },
       {
         label: "This Week",
         backgroundColor: "rgba(243,126,119,0.5)",
         borderColor: "rgba(243,126,119,1)",
-        data: this_week_integers,
+        data: report["visitors_this_week"]["values"],
       },
     ],
   };
@@ -92,3 +187,37 @@ function renderTopReferrers(container, report) {
 
   document.getElementById(container).innerHTML = html;
 }
+
+function getOverview(reportUrl) {
+  fetchReport(reportUrl)
+    .then((overview) => {
+      for (var i = 0; i < overview["sites"].length; i++) {
+        var site = overview["sites"][i];
+        renderOverviewRow("overview-site-" + site["site_id"], site);
+      }
+      renderOverviewRow("overview-totals", overview);
+      return true;
+    })
+    .catch(function (error) {
+      console.log("Request failed", error);
+      return false;
+    });
+}
+
+function renderOverviewRow(container, totals) {
+  var row = document.getElementById(container);
+  if (!row) {
+    return;
+  }
+  var change = "";
+  if (totals["error"]) {
+    change = totals["error"];
+  } else if (totals["change"] !== null) {
+    change = (totals["change"] > 0 ? "+" : "") + totals["change"] + "%";
+  }
+  row.querySelector('[data-field="visitors_this_week"]').textContent =
+    totals["visitors_this_week"];
+  row.querySelector('[data-field="visitors_last_week"]').textContent =
+    totals["visitors_last_week"];
+  row.querySelector('[data-field="change"]').textContent = change;
+}
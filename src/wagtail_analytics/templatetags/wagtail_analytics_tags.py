@@ -0,0 +1,26 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from wagtail_analytics.lib.snippets import get_snippet
+
+register = template.Library()
+
+
+def render_snippet(context, name: str, nonce: str = None) -> str:
+    request = context.get("request")
+    if request is None:
+        return ""
+    if nonce is None:
+        # django-csp and Django's own CSP support both provide a nonce
+        nonce = context.get("csp_nonce") or getattr(request, "csp_nonce", None)
+    return mark_safe(get_snippet(request, name, nonce=nonce))
+
+
+@register.simple_tag(takes_context=True)
+def analytics_head(context, nonce: str = None):
+    return render_snippet(context, "head", nonce=nonce)
+
+
+@register.simple_tag(takes_context=True)
+def analytics_body(context, nonce: str = None):
+    return render_snippet(context, "body", nonce=nonce)
@@ -1,23 +1,116 @@
+import sys
 from dataclasses import dataclass, field
-from datetime import datetime
-from typing import List, Tuple
+from datetime import date
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
+# Reports are cached and kept in memory a lot, slots keep them small. Dataclasses
+# only support them on Python 3.10 and later.
+if sys.version_info >= (3, 10):
+    compact = dataclass(slots=True)
+else:  # pragma: no cover
+    compact = dataclass
 
-@dataclass
+
+def format_date(value: Union[str, date]) -> str:
+    """Return a date, or a YYYYMMDD or ISO date string, as an ISO date string."""
+    if isinstance(value, date):
+        return value.strftime("%Y-%m-%d")
+    if len(value) == 8 and value.isdigit():
+        return "%s-%s-%s" % (value[:4], value[4:6], value[6:])
+    return value[:10]
+
+
+@compact
+class Timeseries:
+    """Counts per day, as parallel lists of ISO dates and integers."""
+
+    dates: List[str] = field(default_factory=list)
+    values: List[int] = field(default_factory=list)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple[Union[str, date], int]]) -> "Timeseries":
+        timeseries = cls()
+        for day, value in rows:
+            timeseries.dates.append(format_date(day))
+            timeseries.values.append(int(value or 0))
+        return timeseries
+
+    def __iter__(self) -> Iterator[Tuple[str, int]]:
+        return zip(self.dates, self.values)
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+
+@compact
 class TopPage:
     url: str
     pageviews: int
 
 
-@dataclass
+@compact
 class TopSource:
     name: str
     pageviews: int
 
 
-@dataclass
+@compact
 class Report:
-    visitors_this_week: List[Tuple[datetime, int]]
-    visitors_last_week: List[Tuple[datetime, int]]
+    visitors_this_week: Timeseries
+    visitors_last_week: Timeseries
     top_pages: List[TopPage]
     top_sources: List[TopSource]
+    errors: List[str] = field(default_factory=list)
+
+
+@compact
+class ReportSection:
+    """
+    One section of a report, with the report fields it fills in as ``data``, so
+    the dashboard can render it as soon as it arrives.
+    """
+
+    name: str
+    data: Dict[str, Union[Timeseries, List[TopPage], List[TopSource]]]
+    errors: List[str] = field(default_factory=list)
+
+
+@compact
+class PageReport:
+    path: str
+    visitors_this_week: Timeseries
+    visitors_last_week: Timeseries
+    errors: List[str] = field(default_factory=list)
+
+
+@dataclass
+class SiteSummary:
+    site_id: int
+    name: str
+    hostname: str
+    provider: str
+    visitors_this_week: int = 0
+    visitors_last_week: int = 0
+    change: Optional[float] = None
+    error: Optional[str] = None
+
+
+@dataclass
+class Overview:
+    sites: List[SiteSummary]
+    visitors_this_week: int = 0
+    visitors_last_week: int = 0
+    change: Optional[float] = None
+    errors: List[str] = field(default_factory=list)
+
+
+@dataclass
+class Event:
+    site_id: int
+    name: str
+    url: str
+    referrer: Optional[str] = None
+    props: Dict[str, str] = field(default_factory=dict)
+    user_agent: str = ""
+    ip: str = ""
+    timestamp: float = 0.0
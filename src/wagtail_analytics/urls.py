@@ -0,0 +1,35 @@
+from django.urls import path
+
+from wagtail_analytics import views
+
+urlpatterns = [
+    path(
+        "collect/",
+        views.CollectView.as_view(),
+        name="wagtail-analytics-collect",
+    ),
+    path(
+        "api/<str:site_id>/",
+        views.get_api_view(views.AnalyticsReportView, views.AsyncAnalyticsReportView),
+        name="wagtail-analytics-api-report",
+    ),
+    path(
+        "api/<str:site_id>/sections/<str:section>/",
+        views.get_api_view(views.AnalyticsSectionView, views.AsyncAnalyticsSectionView),
+        name="wagtail-analytics-api-report-section",
+    ),
+    path(
+        "api/<str:site_id>/pages/<int:page_id>/",
+        views.get_api_view(
+            views.AnalyticsPageReportView, views.AsyncAnalyticsPageReportView
+        ),
+        name="wagtail-analytics-api-page-report",
+    ),
+    path(
+        "api/<str:site_id>/pageviews/",
+        views.get_api_view(
+            views.AnalyticsPageviewsView, views.AsyncAnalyticsPageviewsView
+        ),
+        name="wagtail-analytics-api-pageviews",
+    ),
+]
@@ -1,21 +1,41 @@
-import dataclasses
+import itertools
 import json
+import time
+from urllib.parse import urlparse
 
-from django.http import Http404, HttpResponse, JsonResponse
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.http.request import split_domain_port
 from django.shortcuts import get_object_or_404, redirect
-from django.template.loader import render_to_string
-from django.urls import reverse
-from django.utils.safestring import mark_safe
+from django.urls import NoReverseMatch, reverse
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    set_response_etag,
+)
+from django.utils.decorators import method_decorator
+from django.utils.http import http_date
 from django.utils.translation import gettext_lazy as _
 from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import TemplateView
 from wagtail.admin.panels import HelpPanel, ObjectList, TabbedInterface
 from wagtail.models import Page, Site
 
 from wagtail_analytics import settings as wagtail_analytics_settings
 from wagtail_analytics.forms import SiteSwitchForm
-from wagtail_analytics.lib.analytics import GoogleAnalyticsAPIClient, PlausibleAPIClient
+from wagtail_analytics.lib import dates, export
+from wagtail_analytics.lib.cache import ReportCache
+from wagtail_analytics.lib.collect import event_queue
+from wagtail_analytics.lib.exceptions import AnalyticsError
+from wagtail_analytics.lib.instrumentation import collect_timings
+from wagtail_analytics.lib.media import overview_media, report_media
+from wagtail_analytics.lib.providers import provider_registry
+from wagtail_analytics.lib.rollup import get_report_client
+from wagtail_analytics.lib.serialization import json_response
+from wagtail_analytics.lib.settings_cache import settings_cache
 from wagtail_analytics.models import AnalyticsSettings
+from wagtail_analytics.types import Event
 
 
 class SessionsPanel(HelpPanel):
@@ -24,20 +44,32 @@ class SessionsPanel(HelpPanel):
         content="",
         template="wagtail_analytics/edit_handlers/sessions.html",
         heading=_("Sessions"),
-        classname="",
+        **kwargs,
     ):
-        super().__init__(template=template, heading=heading, classname=classname)
+        super().__init__(content=content, template=template, heading=heading, **kwargs)
 
-    def render(self):
-        return mark_safe(
-            render_to_string(
-                self.template,
+    class BoundPanel(HelpPanel.BoundPanel):
+        # Only loaded by the editors of pages with analytics panels
+        media = report_media
+
+        def get_context_data(self, parent_context=None):
+            context = super().get_context_data(parent_context)
+            page = self.instance
+            site = page.get_site() if page and page.pk else None
+            context.update(
                 {
-                    "id": None,
-                    "config_url": reverse("wagtail-analytics-config"),
-                },
+                    "page_id": page.pk if page else None,
+                    "report_url": (
+                        reverse(
+                            get_api_url_name("page-report"),
+                            kwargs={"site_id": site.id, "page_id": page.pk},
+                        )
+                        if site
+                        else None
+                    ),
+                }
             )
-        )
+            return context
 
 
 class AnalyticsPageMixin:
@@ -64,7 +96,7 @@ class DashboardView(TemplateView):
         site_id = kwargs.get("site_id", None)
 
         if not site_id:
-            site = Site.objects.get(is_default_site=True)
+            site = settings_cache.get_default_site()
             return redirect(
                 reverse("wagtail-analytics-dashboard", kwargs={"site_id": site.id})
             )
@@ -77,15 +109,15 @@ class DashboardView(TemplateView):
         site_id = self.kwargs.get("site_id", None)
 
         if site_id:
-            site = get_object_or_404(Site, id=site_id)
+            site = get_site_or_404(site_id)
         else:
-            site = Site.objects.get(is_default_site=True)
+            site = settings_cache.get_default_site()
 
-        analytics_settings = AnalyticsSettings.for_site(site)
+        analytics_settings = settings_cache.get_settings(site)
 
         # Show a site switcher form if there are multiple sites
         site_switcher = None
-        if Site.objects.count() > 1:
+        if settings_cache.get_site_count() > 1:
             site_switcher = SiteSwitchForm(site, Site)
 
         context.update(
@@ -93,36 +125,508 @@ class DashboardView(TemplateView):
                 "is_enabled": analytics_settings.is_enabled,
                 "site": site,
                 "site_switcher": site_switcher,
+                "media": (
+                    site_switcher.media + report_media
+                    if site_switcher
+                    else report_media
+                ),
                 "report_url": reverse(
-                    "wagtail-analytics-report", kwargs={"site_id": site.id}
+                    get_api_url_name("report"), kwargs={"site_id": site.id}
                 ),
+                "section_urls": {
+                    name: reverse(
+                        get_api_url_name("report-section"),
+                        kwargs={"site_id": site.id, "section": name},
+                    )
+                    for name in ("visitors", "top_pages", "top_sources")
+                },
+            }
+        )
+        return context
+
+
+class OverviewView(TemplateView):
+    template_name = "wagtail_analytics/overview.html"
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        sites = [
+            analytics_settings.site for analytics_settings in get_enabled_settings()
+        ]
+        context.update(
+            {
+                "sites": sites,
+                "media": overview_media,
+                "report_url": reverse("wagtail-analytics-overview-report"),
             }
         )
         return context
 
 
-class AnalyticsReportView(View):
+class AnalyticsAPIView(View):
+    report_cache_class = ReportCache
+    period = None
+    comparison = None
+    # Whether the data is returned as cached, so the ETag of the entry applies
+    cached_etag = True
+    # Wagtail checks the admin access of the admin URLs, wagtail_analytics.urls
+    # has to do it itself
+    check_access = False
+    # Wagtail marks the responses of admin URLs as not cacheable, there the
+    # browser has to revalidate every time
+    browser_cache = False
+
+    def setup(self, request, *args, **kwargs):
+        super().setup(request, *args, **kwargs)
+        self.report_cache = self.report_cache_class()
+
+    def has_access(self, request) -> bool:
+        return request.user.has_perm("wagtailadmin.access_admin")
+
+    def dispatch(self, request, *args, **kwargs):
+        if self.check_access and not self.has_access(request):
+            return JsonResponse({}, status=403)
+        return super().dispatch(request, *args, **kwargs)
+
+    def error_response(self, error: AnalyticsError):
+        response = JsonResponse({"error": str(error)}, status=error.status_code)
+        if error.retry_after is not None:
+            response["Retry-After"] = str(int(error.retry_after))
+        return response
+
+    def get_client(self, site, analytics_settings):
+        provider = provider_registry.get_provider(analytics_settings)
+        if provider is None:
+            return None
+
+        return get_report_client(
+            site, analytics_settings, provider.get_client(site, analytics_settings)
+        )
+
+    def get_site_and_client(self, site_id):
+        site = get_site_or_404(site_id)
+        analytics_settings = settings_cache.get_settings(site)
+        return site, self.get_client(site, analytics_settings)
+
+    def parse_periods(self, client):
+        """Read the period and comparison period from the query parameters."""
+        self.period, self.comparison = dates.parse_periods(
+            self.request.GET, client.get_today()
+        )
+
     def get(self, request, *args, **kwargs):
-        site_id = kwargs.get("site_id", None)
-        site = get_object_or_404(Site, id=site_id)
-        analytics_settings = AnalyticsSettings.for_site(site)
+        site, client = self.get_site_and_client(kwargs.get("site_id", None))
+        if client is None:
+            return JsonResponse({}, status=404)
+
+        try:
+            self.parse_periods(client)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
 
-        if analytics_settings.plausible_enabled:
-            client = PlausibleAPIClient(
-                site.hostname,
-                wagtail_analytics_settings.PLAUSIBLE_API_KEY,
+        with collect_timings() as timings:
+            try:
+                response = self.get_conditional_response(self.get_data(site, client))
+            except AnalyticsError as e:
+                response = self.error_response(e)
+        return self.add_server_timing(response, timings)
+
+    def get_conditional_response(self, data):
+        """
+        Return ``data`` with an ETag of its contents, or a 304 when the browser
+        has it already. The browser may keep it for ``BROWSER_CACHE_MAX_AGE``
+        seconds and then use it while it revalidates.
+
+        Cached reports come with the ETag of their JSON, a revalidation is then
+        answered without encoding the report.
+        """
+        etag = self.report_cache.etag if self.cached_etag else None
+        last_modified = self.report_cache.fetched
+        if last_modified is not None:
+            last_modified = int(last_modified)
+        if etag is not None:
+            response = get_conditional_response(
+                self.request, etag=etag, last_modified=last_modified
+            )
+            if response is not None:
+                return self.patch_caching(response, data, etag, last_modified)
+
+        response = json_response(data)
+        if etag is None:
+            set_response_etag(response)
+            etag = response["ETag"]
+        self.patch_caching(response, data, etag, last_modified)
+        return get_conditional_response(
+            self.request,
+            etag=etag,
+            last_modified=last_modified,
+            response=response,
+        )
+
+    def patch_caching(self, response, data, etag: str, last_modified=None):
+        response["ETag"] = etag
+        if last_modified is not None:
+            response["Last-Modified"] = http_date(last_modified)
+        if not self.browser_cache or getattr(data, "errors", None):
+            # Revalidate partial reports, they aren't cached and the next request
+            # should retry them
+            patch_cache_control(response, private=True, no_cache=True)
+        else:
+            patch_cache_control(
+                response,
+                private=True,
+                max_age=wagtail_analytics_settings.BROWSER_CACHE_MAX_AGE,
+                stale_while_revalidate=(
+                    wagtail_analytics_settings.BROWSER_CACHE_STALE_WHILE_REVALIDATE
+                ),
             )
-            report = client.get_report()
-            report_dict = dataclasses.asdict(report)
-            return JsonResponse(report_dict)
-
-        if analytics_settings.google_analytics_enabled:
-            credentials = json.loads(wagtail_analytics_settings.GA_KEY_CONTENT)
-            client = GoogleAnalyticsAPIClient(
-                analytics_settings.google_analytics_property_id,
-                credentials,
+        return response
+
+    def add_server_timing(self, response, timings):
+        if wagtail_analytics_settings.SERVER_TIMING and timings.entries:
+            response["Server-Timing"] = timings.as_header()
+        return response
+
+    def get_data(self, site, client):
+        raise NotImplementedError
+
+
+class AnalyticsReportView(AnalyticsAPIView):
+    def get_data(self, site, client):
+        report = self.report_cache.get_report(
+            site, client, period=self.period, comparison=self.comparison
+        )
+        return report
+
+
+class AnalyticsSectionView(AnalyticsAPIView):
+    """
+    Return a single section of the report: the visitors, top pages or top
+    sources. The dashboard fetches them side by side and renders each one as
+    soon as it arrives.
+    """
+
+    def get_section_name(self, client) -> str:
+        name = self.kwargs["section"]
+        if name not in client.section_fields:
+            raise Http404
+        return name
+
+    def get_data(self, site, client):
+        section = self.report_cache.get_section(
+            site, client, self.get_section_name(client), self.period, self.comparison
+        )
+        return section
+
+
+class AnalyticsPageReportView(AnalyticsAPIView):
+    def get_path(self, site) -> str:
+        page = get_object_or_404(Page, id=self.kwargs["page_id"]).specific
+        path = get_page_path(page, site)
+        if path is None:
+            raise Http404
+        return path
+
+    def get_data(self, site, client):
+        path = self.get_path(site)
+        report = self.report_cache.get_page_report(
+            site, client, path, self.period, self.comparison
+        )
+        return report
+
+
+class AnalyticsPageviewsView(AnalyticsAPIView):
+    """
+    Return the pageviews of a period (this week by default) for many pages in a
+    single upstream query.
+
+    Pages are selected with repeated ``path`` and ``page_id`` query parameters.
+    """
+
+    max_paths = 100
+    # The pageviews are returned by page as well, which isn't what's cached
+    cached_etag = False
+
+    def get_paths(self, site):
+        """Return the requested paths and the path of every requested page."""
+        paths = self.request.GET.getlist("path")
+        page_ids = [
+            page_id
+            for page_id in self.request.GET.getlist("page_id")
+            if page_id.isdigit()
+        ]
+        pages = {}
+        for page in Page.objects.filter(id__in=page_ids).specific():
+            path = get_page_path(page, site)
+            if path is not None:
+                pages[page.pk] = path
+        paths = list(dict.fromkeys(paths + list(pages.values())))[: self.max_paths]
+        return paths, pages
+
+    def get_data(self, site, client) -> dict:
+        paths, pages = self.get_paths(site)
+        pageviews = {}
+        if paths:
+            pageviews = self.report_cache.get_pageviews(
+                site, client, paths, self.period
             )
-            report = client.get_report()
-            report_dict = dataclasses.asdict(report)
-            return JsonResponse(report_dict)
-        return JsonResponse(status=404)
+        return self.format_pageviews(pageviews, pages)
+
+    def format_pageviews(self, pageviews, pages) -> dict:
+        return {
+            "pageviews": pageviews,
+            "pages": {
+                page_id: pageviews.get(path, 0) for page_id, path in pages.items()
+            },
+        }
+
+
+class AnalyticsOverviewView(AnalyticsAPIView):
+    """Return the visitors of this and last week of every enabled site."""
+
+    def get_clients(self):
+        clients = []
+        for analytics_settings in get_enabled_settings():
+            site = analytics_settings.site
+            client = self.get_client(site, analytics_settings)
+            if client is not None:
+                clients.append((site, client))
+        return clients
+
+    def get(self, request, *args, **kwargs):
+        clients = self.get_clients()
+        with collect_timings() as timings:
+            overview = self.report_cache.get_overview(clients)
+            response = self.get_conditional_response(overview)
+        return self.add_server_timing(response, timings)
+
+
+class AnalyticsExportView(AnalyticsAPIView):
+    """
+    Stream the visitors and pageviews of a date range as CSV or NDJSON.
+
+    Takes ``dimension`` (date, page or source), ``start``, ``end`` and
+    ``format`` query parameters. Rows are fetched from the provider page by
+    page while the response is sent.
+    """
+
+    def get(self, request, *args, **kwargs):
+        site, client = self.get_site_and_client(kwargs.get("site_id", None))
+        if client is None:
+            return JsonResponse({}, status=404)
+
+        try:
+            dimension, start, end, format = export.parse_params(
+                dimension=request.GET.get("dimension"),
+                start=request.GET.get("start"),
+                end=request.GET.get("end"),
+                format=request.GET.get("format"),
+                today=client.get_today(),
+            )
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+        rows = client.iter_rows(dimension, start, end)
+        # Fetch the first page up front, so failures get a proper status code
+        try:
+            first = next(rows, None)
+        except AnalyticsError as e:
+            return self.error_response(e)
+        if first is not None:
+            rows = itertools.chain([first], rows)
+
+        response = StreamingHttpResponse(
+            export.serialize(rows, dimension, format),
+            content_type=export.FORMATS[format],
+        )
+        response["Content-Disposition"] = 'attachment; filename="%s"' % (
+            "%s-%s-%s-%s.%s" % (site.hostname, dimension, start, end, format)
+        )
+        return response
+
+
+class AsyncAnalyticsAPIView(AnalyticsAPIView):
+    """
+    Serve the API without tying up a worker while the provider responds.
+
+    Wagtail wraps admin URLs in sync only decorators, so these views are
+    included through ``wagtail_analytics.urls`` and check the admin access
+    themselves.
+    """
+
+    async def get(self, request, *args, **kwargs):
+        if not await sync_to_async(self.has_access)(request):
+            return JsonResponse({}, status=403)
+
+        site, client = await sync_to_async(self.get_site_and_client)(
+            kwargs.get("site_id", None)
+        )
+        if client is None:
+            return JsonResponse({}, status=404)
+
+        try:
+            self.parse_periods(client)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+        with collect_timings() as timings:
+            try:
+                response = self.get_conditional_response(
+                    await self.aget_data(site, client)
+                )
+            except AnalyticsError as e:
+                response = self.error_response(e)
+        return self.add_server_timing(response, timings)
+
+    async def aget_data(self, site, client):
+        raise NotImplementedError
+
+
+class AsyncAnalyticsReportView(AsyncAnalyticsAPIView, AnalyticsReportView):
+    async def aget_data(self, site, client):
+        report = await self.report_cache.aget_report(
+            site, client, self.period, self.comparison
+        )
+        return report
+
+
+class AsyncAnalyticsSectionView(AsyncAnalyticsAPIView, AnalyticsSectionView):
+    async def aget_data(self, site, client):
+        section = await self.report_cache.aget_section(
+            site, client, self.get_section_name(client), self.period, self.comparison
+        )
+        return section
+
+
+class AsyncAnalyticsPageReportView(AsyncAnalyticsAPIView, AnalyticsPageReportView):
+    async def aget_data(self, site, client):
+        path = await sync_to_async(self.get_path)(site)
+        report = await self.report_cache.aget_page_report(
+            site, client, path, self.period, self.comparison
+        )
+        return report
+
+
+class AsyncAnalyticsPageviewsView(AsyncAnalyticsAPIView, AnalyticsPageviewsView):
+    async def aget_data(self, site, client) -> dict:
+        paths, pages = await sync_to_async(self.get_paths)(site)
+        pageviews = {}
+        if paths:
+            pageviews = await self.report_cache.aget_pageviews(
+                site, client, paths, self.period
+            )
+        return self.format_pageviews(pageviews, pages)
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class CollectView(View):
+    """
+    Accept the events sent by ``collect.js`` and queue them to be forwarded to
+    Plausible and Google Analytics.
+    """
+
+    event_queue = event_queue
+    max_props = 30
+
+    def post(self, request, *args, **kwargs):
+        content_length = request.META.get("CONTENT_LENGTH") or 0
+        max_size = wagtail_analytics_settings.COLLECT_MAX_BODY_SIZE
+        if not str(content_length).isdigit() or int(content_length) > max_size:
+            return HttpResponse(status=413)
+
+        site = settings_cache.get_site_for_request(request)
+        if site is None or not settings_cache.get_settings(site).collect_enabled:
+            return HttpResponse(status=404)
+
+        try:
+            event = self.get_event(request, site)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return HttpResponse(status=400)
+
+        if not self.event_queue.put(event):
+            response = HttpResponse(status=503)
+            response["Retry-After"] = "60"
+            return response
+        return HttpResponse(status=202)
+
+    def get_event(self, request, site) -> Event:
+        data = json.loads(request.body)
+        url = str(data["u"])
+        parts = urlparse(url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError("Invalid URL")
+        # Pages are counted for the site they're on, not any site posting them
+        hostnames = {site.hostname.lower(), split_domain_port(request.get_host())[0]}
+        if parts.hostname not in hostnames:
+            raise ValueError("URL of another site")
+        props = data.get("p") or {}
+        return Event(
+            site_id=site.pk,
+            name=str(data.get("n") or "pageview")[:120],
+            url=url,
+            referrer=str(data["r"]) if data.get("r") else None,
+            props={
+                str(key)[:120]: str(value)[:2000]
+                for key, value in list(props.items())[: self.max_props]
+            },
+            user_agent=request.META.get("HTTP_USER_AGENT", ""),
+            ip=get_client_ip(request),
+            timestamp=time.time(),
+        )
+
+
+def get_client_ip(request) -> str:
+    header = wagtail_analytics_settings.COLLECT_IP_HEADER
+    if header and request.META.get(header):
+        return request.META[header].split(",")[0].strip()
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def get_site_or_404(site_id) -> Site:
+    try:
+        return settings_cache.get_site(site_id)
+    except (Site.DoesNotExist, ValueError):
+        raise Http404
+
+
+def get_enabled_settings():
+    return [
+        analytics_settings
+        for analytics_settings in AnalyticsSettings.objects.select_related(
+            "site"
+        ).order_by("site__site_name", "site__hostname")
+        if analytics_settings.is_enabled
+    ]
+
+
+def get_api_view(view_class, async_view_class):
+    """
+    Return the view of an API endpoint in ``wagtail_analytics.urls``: the async
+    one with ``ASYNC_VIEWS``, the sync one checking the admin access otherwise.
+    """
+    if wagtail_analytics_settings.ASYNC_VIEWS:
+        return async_view_class.as_view(browser_cache=True)
+    return view_class.as_view(check_access=True, browser_cache=True)
+
+
+def has_api_urls() -> bool:
+    try:
+        reverse("wagtail-analytics-api-report", kwargs={"site_id": 0})
+    except NoReverseMatch:
+        return False
+    return True
+
+
+def get_api_url_name(name: str) -> str:
+    # Wagtail marks admin responses as not cacheable, the API of
+    # wagtail_analytics.urls can be cached and revalidated by the browser
+    if has_api_urls():
+        return "wagtail-analytics-api-" + name
+    return "wagtail-analytics-" + name
+
+
+def get_page_path(page, site):
+    url_parts = page.get_url_parts()
+    if url_parts is None or url_parts[0] != site.id:
+        return None
+    return url_parts[2]
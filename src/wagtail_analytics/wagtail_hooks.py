@@ -1,13 +1,13 @@
 from django.contrib.auth.models import Permission
-from django.templatetags.static import static
 from django.urls import include, path, re_path, reverse
-from django.utils.html import format_html, format_html_join
+from django.utils.html import format_html
 from django.utils.translation import gettext_lazy as _
 from wagtail import hooks
 from wagtail.admin.menu import Menu, MenuItem, SubmenuMenuItem
 
 from wagtail_analytics import settings as wagtail_analytics_settings
 from wagtail_analytics import views
+from wagtail_analytics.lib.providers import GoogleAnalyticsProvider, PlausibleProvider
 from wagtail_analytics.models import AnalyticsSettings
 
 wagtail_analytics_menu = Menu(
@@ -34,6 +34,11 @@ def register_permissions():
 @hooks.register("register_admin_urls")
 def urlconf_analytics():
     return [
+        path(
+            "%s/overview/" % wagtail_analytics_settings.PATH_PREFIX,
+            views.OverviewView.as_view(),
+            name="wagtail-analytics-overview",
+        ),
         path(
             "%s/" % wagtail_analytics_settings.PATH_PREFIX,
             views.DashboardView.as_view(),
@@ -67,38 +72,59 @@ def register_menu_item():
     )
 
 
-@hooks.register("insert_global_admin_css")
-def insert_global_admin_css():
-    css_files = ["chart.js/Chart.min.css", "wagtailanalytics/main.css"]
-    css_includes = format_html_join(
-        "\n",
-        '<link rel="stylesheet" href="{0}">',
-        ((static(filename),) for filename in css_files),
-    )
-    return css_includes
-
-
-@hooks.register("insert_editor_js")
-def insert_analytics_js():
-    js_files = [
-        "chart.js/Chart.bundle.min.js",
-        "moment/moment.min.js",
-        "wagtailanalytics/main.js",
-    ]
-    js_includes = format_html_join(
-        "\n",
-        '<script src="{0}"></script>',
-        ((static(filename),) for filename in js_files),
+@hooks.register("register_wagtail_analytics_menu_item")
+def register_overview_menu_item():
+    return WagtailAnalyticsMenuItem(
+        _("Overview"),
+        reverse("wagtail-analytics-overview"),
+        icon_name="site",
+        order=10,
     )
-    return js_includes
 
 
 @hooks.register("register_admin_urls")
 def register_api_urls():
     return [
+        path(
+            "%s/api/overview/" % wagtail_analytics_settings.PATH_PREFIX,
+            views.AnalyticsOverviewView.as_view(),
+            name="wagtail-analytics-overview-report",
+        ),
         path(
             "%s/api/<str:site_id>/" % wagtail_analytics_settings.PATH_PREFIX,
             views.AnalyticsReportView.as_view(),
             name="wagtail-analytics-report",
-        )
+        ),
+        path(
+            "%s/api/<str:site_id>/sections/<str:section>/"
+            % wagtail_analytics_settings.PATH_PREFIX,
+            views.AnalyticsSectionView.as_view(),
+            name="wagtail-analytics-report-section",
+        ),
+        path(
+            "%s/api/<str:site_id>/pages/<int:page_id>/"
+            % wagtail_analytics_settings.PATH_PREFIX,
+            views.AnalyticsPageReportView.as_view(),
+            name="wagtail-analytics-page-report",
+        ),
+        path(
+            "%s/api/<str:site_id>/pageviews/" % wagtail_analytics_settings.PATH_PREFIX,
+            views.AnalyticsPageviewsView.as_view(),
+            name="wagtail-analytics-pageviews",
+        ),
+        path(
+            "%s/api/<str:site_id>/export/" % wagtail_analytics_settings.PATH_PREFIX,
+            views.AnalyticsExportView.as_view(),
+            name="wagtail-analytics-export",
+        ),
     ]
+
+
+@hooks.register("register_wagtail_analytics_provider")
+def register_plausible_provider():
+    return PlausibleProvider()
+
+
+@hooks.register("register_wagtail_analytics_provider")
+def register_google_analytics_provider():
+    return GoogleAnalyticsProvider()
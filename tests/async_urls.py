@@ -0,0 +1,27 @@
+from django.urls import include, path
+
+from wagtail_analytics import views
+
+api_urlpatterns = [
+    path(
+        "api/<str:site_id>/",
+        views.AsyncAnalyticsReportView.as_view(browser_cache=True),
+    ),
+    path(
+        "api/<str:site_id>/sections/<str:section>/",
+        views.AsyncAnalyticsSectionView.as_view(browser_cache=True),
+    ),
+    path(
+        "api/<str:site_id>/pages/<int:page_id>/",
+        views.AsyncAnalyticsPageReportView.as_view(browser_cache=True),
+    ),
+    path(
+        "api/<str:site_id>/pageviews/",
+        views.AsyncAnalyticsPageviewsView.as_view(browser_cache=True),
+    ),
+]
+
+urlpatterns = [
+    path("analytics/", include(api_urlpatterns)),
+    path("", include("tests.urls")),
+]
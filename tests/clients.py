@@ -0,0 +1,67 @@
+from collections import Counter
+
+from wagtail_analytics.lib.analytics import APIClient
+from wagtail_analytics.lib.dates import fill_days
+from wagtail_analytics.lib.plausible import PlausibleQueryAPIClient
+from wagtail_analytics.types import TopPage, TopSource
+
+
+class StubAPIClient(APIClient):
+    """A client answering from memory, counting the calls it gets."""
+
+    provider = "stub"
+
+    def __init__(self, visitors=1, top_pages=None, top_sources=None) -> None:
+        self.visitors = visitors
+        self.top_pages = top_pages or [TopPage(url="/", pageviews=3)]
+        self.top_sources = top_sources or [TopSource(name="Google", pageviews=2)]
+        self.calls = Counter()
+
+    def is_concurrent(self) -> bool:
+        return False
+
+    def get_visitors_between(self, start, end, path=None):
+        self.calls["visitors"] += 1
+        return fill_days({}, start, end, default=self.visitors)
+
+    def get_top_pages_between(self, start, end, limit=10):
+        self.calls["top_pages"] += 1
+        return self.top_pages[:limit]
+
+    def get_top_sources_between(self, start, end, limit=10):
+        self.calls["top_sources"] += 1
+        return self.top_sources[:limit]
+
+    def get_visitors_this_week(self):
+        return self.get_visitors_between(*self.get_this_week())
+
+    def get_visitors_last_week(self):
+        return self.get_visitors_between(*self.get_last_week())
+
+    def get_top_pages(self):
+        return self.get_top_pages_between(*self.get_this_week())
+
+    def get_top_sources(self):
+        return self.get_top_sources_between(*self.get_this_week())
+
+
+class RecordingClient(PlausibleQueryAPIClient):
+    """
+    A Plausible v2 client which keeps the queries it's asked, and answers them
+    with ``results``, or with what ``results`` returns given the query.
+    """
+
+    rate_limit_bucket = None
+
+    def __init__(self, results=None) -> None:
+        super().__init__("example.com", "key")
+        self.results = results or []
+        self.queries = []
+
+    def request(self, url, headers, data=None):
+        self.queries.append(data)
+        results = self.results(data) if callable(self.results) else self.results
+        return {"results": results}
+
+    async def arequest(self, url, headers, data=None):
+        return self.request(url, headers, data=data)
@@ -1,9 +1,21 @@
+import pytest
 from django.conf import settings
 
 
 def pytest_configure():
     settings.configure(
-        CACHES={"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}},
+        SECRET_KEY="wagtail-analytics-tests",
+        ALLOWED_HOSTS=["*"],
+        USE_TZ=True,
+        TIME_ZONE="UTC",
+        ROOT_URLCONF="tests.urls",
+        STATIC_URL="/static/",
+        DEFAULT_AUTO_FIELD="django.db.models.AutoField",
+        WAGTAIL_SITE_NAME="Tests",
+        WAGTAILADMIN_BASE_URL="http://localhost",
+        CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        },
         DATABASES={
             "default": {
                 "ENGINE": "django.db.backends.sqlite3",
@@ -11,6 +23,7 @@ def pytest_configure():
             }
         },
         INSTALLED_APPS=[
+            "wagtail.contrib.settings",
             "wagtail.embeds",
             "wagtail.sites",
             "wagtail.users",
@@ -30,7 +43,7 @@ def pytest_configure():
             "django.contrib.staticfiles",
             "wagtail_analytics",
         ],
-        MIDDLEWARE_CLASSES=[
+        MIDDLEWARE=[
             "django.middleware.security.SecurityMiddleware",
             "django.contrib.sessions.middleware.SessionMiddleware",
             "django.middleware.common.CommonMiddleware",
@@ -38,6 +51,31 @@ def pytest_configure():
             "django.contrib.auth.middleware.AuthenticationMiddleware",
             "django.contrib.messages.middleware.MessageMiddleware",
             "django.middleware.clickjacking.XFrameOptionsMiddleware",
-            "wagtail.middleware.SiteMiddleware",
         ],
+        TEMPLATES=[
+            {
+                "BACKEND": "django.template.backends.django.DjangoTemplates",
+                "APP_DIRS": True,
+                "OPTIONS": {
+                    "context_processors": [
+                        "django.template.context_processors.request",
+                        "django.contrib.auth.context_processors.auth",
+                        "django.contrib.messages.context_processors.messages",
+                    ]
+                },
+            }
+        ],
+        SILENCED_SYSTEM_CHECKS=["wagtail_analytics.W001"],
     )
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    from django.core.cache import cache
+
+    from wagtail_analytics.lib.settings_cache import settings_cache
+
+    cache.clear()
+    settings_cache.reset()
+    yield
+    cache.clear()
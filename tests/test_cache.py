@@ -0,0 +1,140 @@
+import threading
+import time
+
+import pytest
+from wagtail.models import Site
+
+from tests.clients import StubAPIClient
+from wagtail_analytics.lib.cache import ReportCache
+from wagtail_analytics.types import Report, Timeseries
+
+
+class Fetch:
+    def __init__(self, value="report", delay=0) -> None:
+        self.value = value
+        self.delay = delay
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        time.sleep(self.delay)
+        return self.value
+
+
+def wait_for_refreshes():
+    for thread in threading.enumerate():
+        if thread is not threading.current_thread() and thread.daemon:
+            thread.join(timeout=5)
+
+
+def test_get_or_fetch_caches():
+    report_cache = ReportCache(timeout=60)
+    fetch = Fetch()
+    assert report_cache.get_or_fetch("key", fetch) == "report"
+    assert report_cache.get_or_fetch("key", fetch) == "report"
+    assert fetch.calls == 1
+    assert report_cache.etag is not None
+
+
+def test_get_or_fetch_disabled():
+    report_cache = ReportCache(timeout=0)
+    fetch = Fetch()
+    report_cache.get_or_fetch("key", fetch)
+    report_cache.get_or_fetch("key", fetch)
+    assert fetch.calls == 2
+
+
+def test_concurrent_misses_fetch_once():
+    report_cache = ReportCache(timeout=60)
+    report_cache.poll_interval = 0.01
+    fetch = Fetch(delay=0.2)
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(report_cache.get_or_fetch("key", fetch))
+        )
+        for i in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ["report"] * 4
+    assert fetch.calls == 1
+
+
+def test_stale_entry_is_served_while_refreshing():
+    report_cache = ReportCache(timeout=60)
+    entry = report_cache.make_entry("old")
+    entry["expires"] = time.time() - 1
+    report_cache.cache.set("key", entry)
+
+    fetch = Fetch("new", delay=0.1)
+    assert report_cache.get_or_fetch("key", fetch) == "old"
+    # The refresh holds the lock, so a second stale read doesn't start another
+    assert report_cache.get_or_fetch("key", fetch) == "old"
+    wait_for_refreshes()
+    assert fetch.calls == 1
+    assert report_cache.get_or_fetch("key", fetch) == "new"
+
+
+def test_refresh_closes_its_database_connections(monkeypatch):
+    closed = []
+    monkeypatch.setattr(
+        "wagtail_analytics.lib.cache.close_old_connections",
+        lambda: closed.append(threading.current_thread()),
+    )
+    report_cache = ReportCache(timeout=60)
+    entry = report_cache.make_entry("old")
+    entry["expires"] = time.time() - 1
+    report_cache.cache.set("key", entry)
+
+    report_cache.get_or_fetch("key", Fetch("new"))
+    wait_for_refreshes()
+    assert len(closed) == 2
+    assert threading.current_thread() not in closed
+
+
+def test_reports_with_errors_are_not_cached():
+    report_cache = ReportCache(timeout=60)
+    fetch = Fetch(Report(Timeseries(), Timeseries(), [], [], errors=["top_pages"]))
+    report_cache.get_or_fetch("key", fetch)
+    report_cache.get_or_fetch("key", fetch)
+    assert fetch.calls == 2
+
+
+@pytest.mark.django_db
+def test_sections_are_taken_from_the_cached_report():
+    site = Site.objects.get(is_default_site=True)
+    client = StubAPIClient()
+    report_cache = ReportCache(timeout=60)
+    report = report_cache.get_report(site, client, refresh=True)
+    client.calls.clear()
+
+    section = report_cache.get_section(site, client, "top_pages")
+    assert section.data == {"top_pages": report.top_pages}
+    assert not client.calls
+
+
+@pytest.mark.django_db
+def test_sections_are_cached_on_their_own():
+    site = Site.objects.get(is_default_site=True)
+    client = StubAPIClient()
+    report_cache = ReportCache(timeout=60)
+    report_cache.get_section(site, client, "visitors")
+    report_cache.get_section(site, client, "visitors")
+    assert client.calls == {"visitors": 2}
+
+
+@pytest.mark.django_db
+def test_sections_of_batched_reports_share_one_fetch():
+    class BatchingClient(StubAPIClient):
+        def batches_reports(self):
+            return True
+
+    site = Site.objects.get(is_default_site=True)
+    client = BatchingClient()
+    report_cache = ReportCache(timeout=60)
+    for name in client.section_fields:
+        report_cache.get_section(site, client, name)
+    assert client.calls == {"visitors": 2, "top_pages": 1, "top_sources": 1}
@@ -0,0 +1,53 @@
+import threading
+
+import pytest
+from wagtail.models import Site
+
+from wagtail_analytics.lib.collect import (
+    GA_MAX_EVENTS,
+    EventQueue,
+    GoogleAnalyticsForwarder,
+)
+from wagtail_analytics.models import AnalyticsSettings
+from wagtail_analytics.types import Event
+
+
+class RecordingForwarder(GoogleAnalyticsForwarder):
+    def __init__(self) -> None:
+        super().__init__()
+        self.requests = []
+
+    def send(self, operation, method, url, **kwargs):
+        self.requests.append(kwargs["json"])
+
+
+@pytest.mark.django_db
+def test_ga_events_keep_their_own_time():
+    site = Site.objects.get(is_default_site=True)
+    analytics_settings = AnalyticsSettings.for_site(site)
+    events = [
+        Event(site.pk, "pageview", "http://localhost/%s/" % i, timestamp=1000 + i)
+        for i in range(GA_MAX_EVENTS + 1)
+    ]
+    forwarder = RecordingForwarder()
+    forwarder.forward(site, analytics_settings, events)
+
+    first, second = forwarder.requests
+    assert "timestamp_micros" not in first
+    assert [event["timestamp_micros"] for event in first["events"]] == [
+        (1000 + i) * 1000000 for i in range(GA_MAX_EVENTS)
+    ]
+    assert second["events"][0]["timestamp_micros"] == (1000 + GA_MAX_EVENTS) * 1000000
+
+
+def test_full_queue_refuses_events():
+    event_queue = EventQueue(maxsize=1, workers=1)
+    # Workers which don't take anything from the queue
+    stop = threading.Event()
+    event_queue.run = stop.wait
+    try:
+        assert event_queue.put(Event(1, "pageview", "http://localhost/"))
+        assert not event_queue.put(Event(1, "pageview", "http://localhost/"))
+        assert event_queue.dropped == 1
+    finally:
+        stop.set()
@@ -0,0 +1,52 @@
+from datetime import timedelta
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from wagtail.models import Site
+
+from tests.clients import StubAPIClient
+from wagtail_analytics.lib.cache import ReportCache
+from wagtail_analytics.management.commands import analytics_sync
+from wagtail_analytics.models import AnalyticsSettings, DailyTopPage, DailyVisitors
+
+
+@pytest.fixture
+def site():
+    site = Site.objects.get(is_default_site=True)
+    analytics_settings = AnalyticsSettings.for_site(site)
+    analytics_settings.plausible_enabled = True
+    analytics_settings.save()
+    return site
+
+
+@pytest.fixture
+def client_stub(monkeypatch):
+    stub = StubAPIClient(visitors=3)
+    monkeypatch.setattr(
+        analytics_sync, "get_api_client", lambda site, analytics_settings: stub
+    )
+    return stub
+
+
+@pytest.mark.django_db(transaction=True)
+def test_analytics_sync_stores_rollups(site, client_stub):
+    today = client_stub.get_today()
+    since = today - timedelta(days=2)
+    stdout = StringIO()
+    call_command("analytics_sync", "--since", since.isoformat(), stdout=stdout)
+
+    assert "localhost: synced 3 day(s)" in stdout.getvalue()
+    assert list(
+        DailyVisitors.objects.filter(site=site).values_list("date", "visitors")
+    ) == [(since + timedelta(days=i), 3) for i in range(3)]
+    assert DailyTopPage.objects.filter(site=site, date=since, url="/").exists()
+    # The dashboard report is warmed as well
+    client_stub.calls.clear()
+    ReportCache().get_report(site, client_stub)
+    assert not client_stub.calls
+
+    # Only today, which isn't over yet, is fetched again
+    stdout = StringIO()
+    call_command("analytics_sync", "--since", since.isoformat(), stdout=stdout)
+    assert "localhost: synced 1 day(s)" in stdout.getvalue()
@@ -0,0 +1,86 @@
+from datetime import date, datetime
+
+import pytest
+
+from wagtail_analytics.lib.dates import (
+    Period,
+    fill_days,
+    get_local_date,
+    get_period,
+    parse_periods,
+)
+
+
+def test_get_period():
+    day = date(2024, 3, 13)
+    assert get_period("day", day) == Period(day, day)
+    assert get_period("week", day) == Period(date(2024, 3, 11), date(2024, 3, 17))
+    assert get_period("month", day) == Period(date(2024, 3, 1), date(2024, 3, 31))
+    with pytest.raises(ValueError):
+        get_period("year", day)
+
+
+def test_previous_week():
+    week = get_period("week", date(2024, 3, 13))
+    assert week.previous() == Period(date(2024, 3, 4), date(2024, 3, 10))
+
+
+def test_previous_month_is_a_calendar_month():
+    march = get_period("month", date(2024, 3, 13))
+    assert march.previous() == Period(date(2024, 2, 1), date(2024, 2, 29))
+    assert Period(date(2024, 1, 1), date(2024, 3, 31)).previous() == Period(
+        date(2023, 10, 1), date(2023, 12, 31)
+    )
+
+
+def test_previous_year_of_a_month():
+    february = get_period("month", date(2024, 2, 10))
+    assert february.previous_year() == Period(date(2023, 2, 1), date(2023, 2, 28))
+    leap_day = Period(date(2024, 2, 29), date(2024, 2, 29))
+    assert leap_day.previous_year() == Period(date(2023, 2, 28), date(2023, 2, 28))
+
+
+def test_parse_periods():
+    assert parse_periods({}) == (None, None)
+    period, comparison = parse_periods(
+        {"start": "2024-01-10", "end": "2024-01-12"}, today=date(2024, 2, 1)
+    )
+    assert period == Period(date(2024, 1, 10), date(2024, 1, 12))
+    assert comparison == Period(date(2024, 1, 7), date(2024, 1, 9))
+
+    period, comparison = parse_periods(
+        {"period": "month", "date": "2024-03-05", "compare": "year"}
+    )
+    assert comparison == Period(date(2023, 3, 1), date(2023, 3, 31))
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"start": "2024-01-12", "end": "2024-01-10"},
+        {"start": "2000-01-01", "end": "2024-01-01"},
+        {"period": "week", "compare": "decade"},
+        {"start": "yesterday"},
+    ],
+)
+def test_parse_periods_invalid(params):
+    with pytest.raises(ValueError):
+        parse_periods(params, today=date(2024, 2, 1))
+
+
+def test_fill_days():
+    values = {"2024-01-02": 5}
+    assert fill_days(values, date(2024, 1, 1), date(2024, 1, 3)) == [
+        ("2024-01-01", 0),
+        ("2024-01-02", 5),
+        ("2024-01-03", 0),
+    ]
+
+
+def test_get_local_date(settings):
+    settings.TIME_ZONE = "Europe/Amsterdam"
+    naive = datetime(2024, 3, 1, 23, 30)
+    assert get_local_date(naive) == date(2024, 3, 1)
+    assert get_local_date(naive, "Asia/Tokyo") == date(2024, 3, 2)
+    aware = datetime.fromisoformat("2024-03-01T23:30:00+00:00")
+    assert get_local_date(aware, "Europe/Amsterdam") == date(2024, 3, 2)
@@ -0,0 +1,227 @@
+from datetime import date
+
+import pytest
+from google.analytics.data_v1beta.types import (
+    BatchRunReportsResponse,
+    DimensionHeader,
+    DimensionValue,
+    MetricValue,
+    Row,
+    RunReportResponse,
+)
+from google.api_core import exceptions as google_exceptions
+from wagtail.models import Site
+
+from wagtail_analytics import settings as wagtail_analytics_settings
+from wagtail_analytics.lib.dates import Period
+from wagtail_analytics.lib.exceptions import RateLimitError, UpstreamError
+from wagtail_analytics.lib.google_analytics import (
+    BetaAnalyticsDataClient,
+    GoogleAnalyticsAPIClient,
+    ga_client_registry,
+)
+from wagtail_analytics.lib.overview import get_overview
+from wagtail_analytics.models import AnalyticsSettings
+from wagtail_analytics.types import TopPage
+
+PERIOD = Period(date(2024, 3, 11), date(2024, 3, 17))
+COMPARISON = Period(date(2024, 3, 4), date(2024, 3, 10))
+
+
+class DataClientStub:
+    """Stands in for BetaAnalyticsDataClient, recording the calls it gets."""
+
+    def __init__(self, error=None, batch_error=None) -> None:
+        self.error = error
+        self.batch_error = batch_error
+        self.calls = []
+
+    def run_report(self, request, timeout=None):
+        self.calls.append(("run_report", timeout))
+        if self.error:
+            raise self.error
+        return self.respond(request)
+
+    def batch_run_reports(self, request, timeout=None):
+        self.calls.append(("batch_run_reports", timeout))
+        if self.batch_error:
+            raise self.batch_error
+        return BatchRunReportsResponse(
+            reports=[self.respond(report) for report in request.requests]
+        )
+
+    def respond(self, request):
+        if request.dimensions[0].name == "date":
+            value = request.date_ranges[0].start_date.replace("-", "")
+        else:
+            value = "/"
+        return RunReportResponse(
+            rows=[
+                Row(
+                    dimension_values=[DimensionValue(value=value)],
+                    metric_values=[MetricValue(value="5")],
+                )
+            ],
+            row_count=1,
+        )
+
+
+@pytest.fixture
+def data_client(monkeypatch):
+    stub = DataClientStub()
+    monkeypatch.setattr(ga_client_registry, "get_client", lambda credentials: stub)
+    monkeypatch.setattr(wagtail_analytics_settings, "GA_BATCH_REQUESTS", True)
+    return stub
+
+
+@pytest.fixture
+def client():
+    return GoogleAnalyticsAPIClient("1234", {"type": "service_account"})
+
+
+def test_report_is_one_batch_call(client, data_client):
+    report = client.get_report(PERIOD, COMPARISON)
+    assert [operation for operation, timeout in data_client.calls] == [
+        "batch_run_reports"
+    ]
+    assert report.errors == []
+    assert report.visitors_this_week.values == [5, 0, 0, 0, 0, 0, 0]
+    assert report.visitors_last_week.values == [5, 0, 0, 0, 0, 0, 0]
+    assert report.top_pages == [TopPage("/", 5)]
+
+
+def test_rejected_batch_falls_back_to_single_calls(client, data_client):
+    data_client.batch_error = google_exceptions.InvalidArgument("Too many requests")
+    report = client.get_report(PERIOD, COMPARISON)
+    operations = [operation for operation, timeout in data_client.calls]
+    assert operations == ["batch_run_reports"] + ["run_report"] * 4
+    assert report.errors == []
+    assert report.top_pages == [TopPage("/", 5)]
+
+
+def test_other_batch_errors_do_not_fall_back(client, data_client):
+    data_client.batch_error = google_exceptions.ServiceUnavailable("Down")
+    with pytest.raises(UpstreamError):
+        client.get_report(PERIOD, COMPARISON)
+    assert len(data_client.calls) == 1
+
+
+def test_exhausted_quota_is_a_rate_limit_error(client, data_client):
+    data_client.error = google_exceptions.ResourceExhausted("Quota exhausted")
+    with pytest.raises(RateLimitError) as excinfo:
+        client.get_top_pages_between(*PERIOD)
+    assert excinfo.value.upstream_status == 429
+
+
+def test_report_timeout_is_passed_on(client, data_client, monkeypatch):
+    monkeypatch.setattr(wagtail_analytics_settings, "REPORT_TIMEOUT", 3)
+    client.get_report(PERIOD, COMPARISON)
+    client.get_top_sources_between(*PERIOD)
+    assert data_client.calls == [("batch_run_reports", 3), ("run_report", 3)]
+
+
+def test_top_rows_are_ordered(client):
+    for request in (
+        client.get_top_pages_request(*PERIOD),
+        client.get_top_sources_request(*PERIOD),
+    ):
+        (order_by,) = request.order_bys
+        assert order_by.metric.metric_name == "activeUsers"
+        assert order_by.desc
+
+
+@pytest.fixture
+def created_clients(monkeypatch):
+    created = []
+
+    def from_service_account_info(info):
+        created.append(info)
+        return DataClientStub()
+
+    monkeypatch.setattr(
+        BetaAnalyticsDataClient,
+        "from_service_account_info",
+        staticmethod(from_service_account_info),
+    )
+    ga_client_registry.clear()
+    yield created
+    ga_client_registry.clear()
+
+
+@pytest.mark.django_db
+def test_data_clients_are_shared_per_service_account(
+    created_clients, django_capture_on_commit_callbacks
+):
+    credentials = {"type": "service_account", "client_email": "a@example.com"}
+    other_credentials = {"type": "service_account", "client_email": "b@example.com"}
+    first = GoogleAnalyticsAPIClient("1", credentials)
+    second = GoogleAnalyticsAPIClient("2", dict(credentials))
+    other = GoogleAnalyticsAPIClient("1", other_credentials)
+
+    assert first.client is second.client
+    assert other.client is not first.client
+    assert created_clients == [credentials, other_credentials]
+
+    # Saving the analytics settings doesn't change the service account
+    data_client = first.client
+    with django_capture_on_commit_callbacks(execute=True):
+        AnalyticsSettings.for_site(Site.objects.get(is_default_site=True)).save()
+    assert GoogleAnalyticsAPIClient("1", credentials).client is data_client
+    assert len(created_clients) == 2
+
+
+class HostnameTotalsStub(DataClientStub):
+    """Answers the totals of the overview with 3 and 2 visitors per hostname."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.requests = []
+
+    def respond(self, request):
+        self.requests.append(request)
+        hostnames = request.dimension_filter.filter.in_list_filter.values
+        return RunReportResponse(
+            dimension_headers=[
+                DimensionHeader(name="hostName"),
+                DimensionHeader(name="dateRange"),
+            ],
+            rows=[
+                Row(
+                    dimension_values=[
+                        DimensionValue(value=hostname),
+                        DimensionValue(value=date_range),
+                    ],
+                    metric_values=[MetricValue(value=str(visitors))],
+                )
+                for hostname in hostnames
+                for date_range, visitors in (("this_week", 3), ("last_week", 2))
+            ],
+        )
+
+
+@pytest.mark.django_db
+def test_sites_of_a_property_share_an_overview_call(monkeypatch):
+    stub = HostnameTotalsStub()
+    monkeypatch.setattr(ga_client_registry, "get_client", lambda credentials: stub)
+    credentials = {"type": "service_account", "client_email": "a@example.com"}
+    root_page = Site.objects.get(is_default_site=True).root_page
+    sites = [
+        Site.objects.create(hostname=hostname, root_page=root_page)
+        for hostname in ("a.example.com", "b.example.com")
+    ]
+
+    overview = get_overview(
+        [(site, GoogleAnalyticsAPIClient("1234", dict(credentials))) for site in sites]
+    )
+
+    assert [operation for operation, timeout in stub.calls] == ["run_report"]
+    (request,) = stub.requests
+    assert request.property == "properties/1234"
+    assert list(request.dimension_filter.filter.in_list_filter.values) == [
+        "a.example.com",
+        "b.example.com",
+    ]
+    assert [summary.visitors_this_week for summary in overview.sites] == [3, 3]
+    assert overview.visitors_this_week == 6
+    assert overview.visitors_last_week == 4
+    assert overview.errors == []
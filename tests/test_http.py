@@ -0,0 +1,57 @@
+import pytest
+import requests
+
+from wagtail_analytics.lib import http
+from wagtail_analytics.lib.exceptions import RateLimitError
+
+
+class SessionStub:
+    def __init__(self, *responses) -> None:
+        self.responses = list(responses)
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        return self.responses.pop(0)
+
+
+def make_response(status_code, retry_after=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = b"{}"
+    if retry_after is not None:
+        response.headers["Retry-After"] = retry_after
+    return response
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(http, "use_http2", lambda: False)
+    monkeypatch.setattr(http.time, "sleep", sleeps.append)
+    return sleeps
+
+
+def test_retry_after_is_honoured(monkeypatch, sleeps):
+    session = SessionStub(make_response(429, "2"), make_response(200))
+    monkeypatch.setattr(http, "get_session", lambda: session)
+    response = http.request("GET", "https://plausible.io/api/v1/stats/aggregate")
+    assert response.status_code == 200
+    assert response.retries == 1
+    assert sleeps == [2]
+
+
+def test_retry_after_above_the_maximum_backoff_raises(monkeypatch, sleeps):
+    session = SessionStub(make_response(429, "60"), make_response(200))
+    monkeypatch.setattr(http, "get_session", lambda: session)
+    with pytest.raises(RateLimitError) as excinfo:
+        http.request("GET", "https://plausible.io/api/v1/stats/aggregate")
+    assert excinfo.value.retry_after == 60
+    assert session.calls == 1
+    assert not sleeps
+
+
+def test_parse_retry_after():
+    assert http.parse_retry_after("3") == 3
+    assert http.parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+    assert http.parse_retry_after("soon") is None
@@ -0,0 +1,28 @@
+import threading
+
+import pytest
+from wagtail.models import Site
+
+from tests.clients import StubAPIClient
+from wagtail_analytics.lib.overview import get_overview
+
+
+class TotalsClient(StubAPIClient):
+    def get_visitor_totals(self):
+        self.calls["totals"] += 1
+        return 10, 8
+
+
+@pytest.mark.django_db
+def test_overview_workers_close_their_database_connections(monkeypatch):
+    closed = []
+    monkeypatch.setattr(
+        "wagtail_analytics.lib.overview.close_old_connections",
+        lambda: closed.append(threading.current_thread()),
+    )
+    site = Site.objects.get(is_default_site=True)
+    overview = get_overview([(site, TotalsClient())])
+    assert overview.visitors_this_week == 10
+    assert overview.change == 25.0
+    assert len(closed) == 2
+    assert threading.current_thread() not in closed
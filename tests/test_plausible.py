@@ -0,0 +1,133 @@
+from datetime import date
+
+from tests.clients import RecordingClient
+from wagtail_analytics import settings as wagtail_analytics_settings
+from wagtail_analytics.lib.dates import Period
+from wagtail_analytics.lib.plausible import PlausibleAPIClient, PlausibleQueryAPIClient
+from wagtail_analytics.lib.providers import PlausibleProvider, get_plausible_url
+from wagtail_analytics.types import TopPage
+
+THIS_WEEK = Period(date(2024, 3, 11), date(2024, 3, 17))
+LAST_WEEK = Period(date(2024, 3, 4), date(2024, 3, 10))
+
+
+def test_query():
+    client = RecordingClient()
+    query = client.build_query(["visitors"], THIS_WEEK, dimensions=["time:day"])
+    assert query == {
+        "site_id": "example.com",
+        "metrics": ["visitors"],
+        "date_range": ["2024-03-11", "2024-03-17"],
+        "dimensions": ["time:day"],
+    }
+    assert client.query_url == "https://plausible.io/api/v2/query"
+
+
+def test_adjacent_periods_are_one_query():
+    client = RecordingClient(
+        [
+            {"dimensions": ["2024-03-05"], "metrics": [4]},
+            {"dimensions": ["2024-03-12"], "metrics": [7]},
+        ]
+    )
+    query, parse = client.plan_visitors(THIS_WEEK, LAST_WEEK)
+    assert query["date_range"] == ["2024-03-04", "2024-03-17"]
+    assert "include" not in query
+
+    this_week, last_week = client.execute(query, parse)
+    assert len(this_week) == len(last_week) == 7
+    assert this_week[1] == ("2024-03-12", 7)
+    assert last_week[1] == ("2024-03-05", 4)
+    assert this_week[0] == ("2024-03-11", 0)
+
+
+def test_other_periods_are_compared():
+    last_year = Period(date(2023, 3, 11), date(2023, 3, 17))
+    client = RecordingClient(
+        [
+            {
+                "dimensions": ["2024-03-11"],
+                "metrics": [5],
+                "comparison": {"dimensions": ["2023-03-11"], "metrics": [2]},
+            }
+        ]
+    )
+    query, parse = client.plan_visitors(THIS_WEEK, last_year)
+    assert query["include"]["comparisons"] == {
+        "mode": "custom",
+        "date_range": ["2023-03-11", "2023-03-17"],
+    }
+    this_week, compared = client.execute(query, parse)
+    assert this_week[0] == ("2024-03-11", 5)
+    assert compared[0] == ("2023-03-11", 2)
+
+
+def test_top_pages():
+    client = RecordingClient([{"dimensions": ["/"], "metrics": [9]}])
+    assert client.get_top_pages_between(*THIS_WEEK, limit=5) == [
+        TopPage(url="/", pageviews=9)
+    ]
+    query = client.queries[0]
+    assert query["dimensions"] == ["event:page"]
+    assert query["order_by"] == [["visitors", "desc"]]
+    assert query["pagination"] == {"limit": 5, "offset": 0}
+
+
+def test_report_takes_three_queries():
+    client = RecordingClient()
+    client.is_concurrent = lambda: False
+    report = client.get_report(THIS_WEEK, LAST_WEEK)
+    assert len(client.queries) == 3
+    assert report.errors == []
+    assert report.visitors_this_week.values == [0] * 7
+
+
+def test_daily_top_pages_are_one_query():
+    client = RecordingClient(
+        [
+            {"dimensions": ["2024-03-11", "/"], "metrics": [5]},
+            {"dimensions": ["2024-03-11", "/a/"], "metrics": [3]},
+            {"dimensions": ["2024-03-11", "/b/"], "metrics": [1]},
+            {"dimensions": ["2024-03-12", "/a/"], "metrics": [2]},
+        ]
+    )
+    top_pages = client.get_daily_top_pages_between(
+        date(2024, 3, 11), date(2024, 3, 13), limit=2
+    )
+    assert len(client.queries) == 1
+    assert client.queries[0]["dimensions"] == ["time:day", "event:page"]
+    assert top_pages == {
+        "2024-03-11": [TopPage("/", 5), TopPage("/a/", 3)],
+        "2024-03-12": [TopPage("/a/", 2)],
+        "2024-03-13": [],
+    }
+
+
+def test_visitor_totals_are_two_aggregates():
+    client = RecordingClient([{"metrics": [7], "dimensions": []}])
+    assert client.get_visitor_totals() == (7, 7)
+    assert sorted(query["date_range"] for query in client.queries) == [
+        [start.isoformat(), end.isoformat()]
+        for start, end in (client.get_last_week(), client.get_this_week())
+    ]
+    assert not any("include" in query for query in client.queries)
+
+
+def test_v1_is_the_default(monkeypatch):
+    assert PlausibleProvider().get_client_class() is PlausibleAPIClient
+    monkeypatch.setattr(wagtail_analytics_settings, "PLAUSIBLE_API_VERSION", 2)
+    assert PlausibleProvider().get_client_class() is PlausibleQueryAPIClient
+
+
+def test_plausible_url():
+    assert get_plausible_url("plausible.io") == "https://plausible.io"
+    assert get_plausible_url("") == "https://plausible.io"
+    assert (
+        get_plausible_url("http://plausible.lan:8000/") == "http://plausible.lan:8000"
+    )
+
+
+def test_self_hosted_instance_over_http():
+    client = PlausibleQueryAPIClient("example.com", "key", "http://plausible.lan:8000")
+    assert client.base_url == "http://plausible.lan:8000/api/v1/stats"
+    assert client.query_url == "http://plausible.lan:8000/api/v2/query"
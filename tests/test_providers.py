@@ -0,0 +1,102 @@
+import json
+import subprocess
+import sys
+
+import pytest
+from django.contrib.auth import get_user_model
+from wagtail import hooks
+from wagtail.models import Site
+
+from tests.clients import StubAPIClient
+from wagtail_analytics.lib.providers import HOOK_NAME, Provider, provider_registry
+from wagtail_analytics.models import AnalyticsSettings
+
+
+class ThirdPartyClient(StubAPIClient):
+    provider = "third_party"
+
+
+class ThirdPartyProvider(Provider):
+    name = "third_party"
+    client_class = "tests.test_providers.ThirdPartyClient"
+
+    def is_enabled(self, analytics_settings) -> bool:
+        return analytics_settings.site.hostname == "localhost"
+
+    def get_client_kwargs(self, site, analytics_settings) -> dict:
+        return {"visitors": 7}
+
+
+@pytest.fixture
+def third_party_provider():
+    provider_registry.clear()
+    with hooks.register_temporarily(HOOK_NAME, ThirdPartyProvider, order=-1):
+        yield
+    provider_registry.clear()
+
+
+@pytest.fixture
+def analytics_settings():
+    analytics_settings = AnalyticsSettings.for_site(
+        Site.objects.get(is_default_site=True)
+    )
+    analytics_settings.plausible_enabled = True
+    analytics_settings.time_zone = "Europe/Amsterdam"
+    analytics_settings.save()
+    return analytics_settings
+
+
+@pytest.mark.django_db
+def test_registered_provider_is_used(third_party_provider, analytics_settings):
+    provider = provider_registry.get_provider(analytics_settings)
+    assert isinstance(provider, ThirdPartyProvider)
+    client = provider_registry.get_client(analytics_settings.site, analytics_settings)
+    assert isinstance(client, ThirdPartyClient)
+    assert client.visitors == 7
+    assert client.time_zone == "Europe/Amsterdam"
+
+
+@pytest.mark.django_db
+def test_registered_provider_serves_the_api(
+    third_party_provider, analytics_settings, client
+):
+    client.force_login(
+        get_user_model().objects.create_superuser("admin", "admin@example.com")
+    )
+    response = client.get("/analytics/api/%s/" % analytics_settings.site.pk)
+    assert response.status_code == 200
+    assert json.loads(response.content)["visitors_this_week"]["values"] == [7] * 7
+
+
+@pytest.mark.django_db
+def test_providers_fall_through_to_the_builtin_ones(
+    third_party_provider, analytics_settings
+):
+    site = analytics_settings.site
+    site.hostname = "example.com"
+    provider = provider_registry.get_provider(analytics_settings)
+    assert provider.name == "plausible"
+
+
+def test_google_analytics_is_not_imported_at_startup():
+    # A fresh interpreter, as the other tests import the Google client
+    code = "\n".join(
+        [
+            "import sys",
+            "import django",
+            "from tests.conftest import pytest_configure",
+            "pytest_configure()",
+            "django.setup()",
+            "from django.urls import resolve",
+            "from wagtail import hooks",
+            "resolve('/analytics/collect/')",
+            "hooks.get_hooks('register_wagtail_analytics_provider')",
+            "import wagtail_analytics.views, wagtail_analytics.lib.analytics",
+            "print(sorted(name for name in sys.modules"
+            " if name.split('.')[0] == 'grpc' or name.startswith('google.analytics')))",
+        ]
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == "[]"
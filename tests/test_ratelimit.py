@@ -0,0 +1,85 @@
+import time
+from datetime import datetime
+
+import pytest
+
+from wagtail_analytics.lib.dates import get_time_zone
+from wagtail_analytics.lib.exceptions import RateLimitError
+from wagtail_analytics.lib.ratelimit import (
+    BACKGROUND,
+    QUOTA_TIME_ZONE,
+    TokenBucket,
+    get_quota_reset,
+)
+
+
+def test_takes_tokens_up_to_the_burst():
+    bucket = TokenBucket("test", rate=1, burst=3, reserve=0)
+    assert [bucket.take() for i in range(3)] == [0, 0, 0]
+    assert bucket.take() == pytest.approx(1, abs=0.1)
+
+
+def test_background_requests_leave_the_reserve():
+    bucket = TokenBucket("test", rate=1, burst=4, reserve=0.5)
+    assert bucket.take(BACKGROUND) == 0
+    assert bucket.take(BACKGROUND) == 0
+    assert bucket.take(BACKGROUND) > 0
+    assert bucket.take() == 0
+
+
+def test_block():
+    bucket = TokenBucket("test", rate=10, burst=10)
+    bucket.block(30)
+    assert bucket.take() == pytest.approx(30, abs=1)
+    with pytest.raises(RateLimitError):
+        bucket.acquire()
+
+
+def test_quota_slows_down_the_refill():
+    bucket = TokenBucket("test", rate=10, burst=1, reserve=0)
+    bucket.report_quota({"tokensPerHour": {"consumed": 90, "remaining": 10}})
+    assert bucket.take() == 0
+    # A tenth of the quota left refills at a fifth of the rate
+    assert bucket.take() == pytest.approx(1 / 2, abs=0.05)
+
+
+def test_lock_of_another_request_is_left_alone():
+    bucket = TokenBucket("test", rate=10, burst=10)
+    bucket.lock_timeout = 0.05
+    lock_key = bucket.key + ":lock"
+    bucket.cache.add(lock_key, "other", timeout=5)
+
+    assert bucket.take() == bucket.lock_interval
+    assert bucket.cache.get(lock_key) == "other"
+    assert bucket.cache.get(bucket.key) is None
+
+
+def test_quota_resets():
+    now = datetime(2024, 3, 11, 23, 30, tzinfo=get_time_zone(QUOTA_TIME_ZONE))
+    assert get_quota_reset("tokens_per_day", now.timestamp()) == 30 * 60
+    assert get_quota_reset("tokens_per_hour", now.timestamp()) == 30 * 60
+    now = now.replace(hour=10)
+    assert get_quota_reset("tokens_per_day", now.timestamp()) == 13.5 * 3600
+    assert get_quota_reset("tokens_per_hour", now.timestamp()) == 30 * 60
+
+
+def test_exhausted_daily_quota_blocks_until_it_is_reset(monkeypatch):
+    bucket = TokenBucket("test", rate=10, burst=10)
+    bucket.report_quota(
+        {
+            "tokens_per_day": {"consumed": 200000, "remaining": 0},
+            "tokens_per_hour": {"consumed": 100, "remaining": 39900},
+        }
+    )
+    now = time.time()
+    with pytest.raises(RateLimitError) as excinfo:
+        bucket.acquire()
+    assert excinfo.value.retry_after == pytest.approx(
+        get_quota_reset("tokens_per_day", now), abs=5
+    )
+
+    # Still blocked after the bucket itself would have refilled
+    monkeypatch.setattr(time, "time", lambda: now + 120)
+    assert bucket.take() == pytest.approx(
+        get_quota_reset("tokens_per_day", now) - 120, abs=5
+    )
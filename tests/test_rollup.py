@@ -0,0 +1,144 @@
+from datetime import date, datetime, timezone
+
+import pytest
+from wagtail.models import Site
+
+from tests.clients import StubAPIClient
+from wagtail_analytics.lib.dates import Period
+from wagtail_analytics.lib.rollup import (
+    RollupAPIClient,
+    get_missing_days,
+    get_ranges,
+    store_day,
+    sync_site,
+)
+from wagtail_analytics.models import DailyTopPage, DailyVisitors
+from wagtail_analytics.types import TopPage, TopSource
+
+THIS_WEEK = Period(date(2024, 3, 11), date(2024, 3, 17))
+LAST_WEEK = Period(date(2024, 3, 4), date(2024, 3, 10))
+
+
+@pytest.fixture
+def site():
+    return Site.objects.get(is_default_site=True)
+
+
+def test_get_ranges():
+    days = [date(2024, 3, day) for day in (1, 2, 3, 5, 7, 8)]
+    assert get_ranges(days) == [
+        Period(date(2024, 3, 1), date(2024, 3, 3)),
+        Period(date(2024, 3, 5), date(2024, 3, 5)),
+        Period(date(2024, 3, 7), date(2024, 3, 8)),
+    ]
+
+
+@pytest.mark.django_db
+def test_days_stored_before_they_were_over_are_missing(site):
+    complete = DailyVisitors.objects.create(site=site, date=date(2024, 3, 1))
+    partial = DailyVisitors.objects.create(site=site, date=date(2024, 3, 2))
+    DailyVisitors.objects.filter(pk=complete.pk).update(
+        updated_at=datetime(2024, 3, 2, 1, tzinfo=timezone.utc)
+    )
+    DailyVisitors.objects.filter(pk=partial.pk).update(
+        updated_at=datetime(2024, 3, 2, 20, tzinfo=timezone.utc)
+    )
+
+    since, until = date(2024, 3, 1), date(2024, 3, 3)
+    assert get_missing_days(site, since, until) == [date(2024, 3, 2), date(2024, 3, 3)]
+    # Still the 1st of March in New York
+    assert get_missing_days(site, since, until, "America/New_York") == [
+        date(2024, 3, 1),
+        date(2024, 3, 2),
+        date(2024, 3, 3),
+    ]
+
+
+@pytest.mark.django_db
+def test_sync_site(site):
+    client = StubAPIClient(visitors=4, top_pages=[TopPage("/", 3), TopPage("/a/", 1)])
+    since, until = date(2024, 3, 1), date(2024, 3, 3)
+
+    assert sync_site(site, client, since=since, until=until) == [
+        date(2024, 3, 1),
+        date(2024, 3, 2),
+        date(2024, 3, 3),
+    ]
+    assert client.calls["visitors"] == 1
+    assert DailyVisitors.objects.filter(site=site, visitors=4).count() == 3
+    assert DailyTopPage.objects.filter(site=site, date=since).count() == 2
+
+    # Stored days aren't fetched again
+    client.calls.clear()
+    assert sync_site(site, client, since=since, until=until) == []
+    assert not client.calls
+
+
+@pytest.mark.django_db
+def test_rollup_report(site):
+    client = StubAPIClient(visitors=2, top_pages=[TopPage("/", 3)])
+    sync_site(site, client, since=date(2024, 3, 4), until=date(2024, 3, 17))
+
+    report = RollupAPIClient(site).get_report(
+        Period(date(2024, 3, 11), date(2024, 3, 17)),
+        Period(date(2024, 3, 4), date(2024, 3, 10)),
+    )
+    assert report.errors == []
+    assert report.visitors_this_week.values == [2] * 7
+    assert report.visitors_last_week.values == [2] * 7
+    assert report.top_pages == [TopPage("/", 21)]
+
+
+@pytest.mark.django_db
+def test_store_day_is_atomic(site):
+    day = date(2024, 3, 1)
+    store_day(site, day, 4, [TopPage("/", 3)], [])
+    with pytest.raises(ValueError):
+        store_day(site, day, 9, [TopPage("/new/", 5)], [TopSource("Google", "many")])
+    assert list(
+        DailyTopPage.objects.filter(site=site, date=day).values_list("url", flat=True)
+    ) == ["/"]
+    assert DailyVisitors.objects.get(site=site, date=day).visitors == 4
+
+
+@pytest.mark.django_db
+def test_sync_keeps_the_days_stored_before_a_failure(site):
+    class FailingClient(StubAPIClient):
+        def get_daily_top_sources_between(self, start, end, limit=10):
+            return {
+                "2024-03-01": [TopSource("Google", 2)],
+                "2024-03-02": [TopSource("Google", "many")],
+            }
+
+    with pytest.raises(ValueError):
+        sync_site(site, FailingClient(), since=date(2024, 3, 1), until=date(2024, 3, 2))
+    assert list(
+        DailyVisitors.objects.filter(site=site).values_list("date", flat=True)
+    ) == [date(2024, 3, 1)]
+    assert not DailyTopPage.objects.filter(site=site, date=date(2024, 3, 2)).exists()
+
+
+@pytest.mark.django_db
+def test_rollup_report_has_the_shape_of_a_live_report(site):
+    live_client = StubAPIClient(visitors=2)
+    sync_site(site, live_client, since=LAST_WEEK.start, until=THIS_WEEK.end)
+    # A day that wasn't synced
+    DailyVisitors.objects.filter(site=site, date=date(2024, 3, 12)).delete()
+
+    live = live_client.get_report(THIS_WEEK, LAST_WEEK)
+    report = RollupAPIClient(site).get_report(THIS_WEEK, LAST_WEEK)
+    assert report.visitors_this_week.dates == live.visitors_this_week.dates
+    assert report.visitors_last_week.dates == live.visitors_last_week.dates
+    assert report.visitors_this_week.values == [2, 0, 2, 2, 2, 2, 2]
+    assert type(report.top_pages[0]) is type(live.top_pages[0])
+    assert type(report.top_sources[0]) is type(live.top_sources[0])
+
+
+@pytest.mark.django_db
+def test_page_report_counts_the_daily_top_pages_as_visitors(site):
+    store_day(site, date(2024, 3, 11), 10, [TopPage("/a/", 3), TopPage("/", 7)], [])
+    store_day(site, date(2024, 3, 13), 10, [TopPage("/a/", 5)], [])
+
+    report = RollupAPIClient(site).get_page_report("/a/", THIS_WEEK, LAST_WEEK)
+    assert report.visitors_this_week.values == [3, 0, 5, 0, 0, 0, 0]
+    assert report.visitors_last_week.values == [0] * 7
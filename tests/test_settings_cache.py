@@ -0,0 +1,54 @@
+import pytest
+from wagtail.models import Site
+
+from wagtail_analytics.lib.settings_cache import SettingsCache, settings_cache
+from wagtail_analytics.models import AnalyticsSettings
+
+
+@pytest.fixture
+def site():
+    return Site.objects.get(is_default_site=True)
+
+
+@pytest.mark.django_db
+def test_settings_are_cached(site, django_assert_num_queries):
+    settings_cache.get_settings(site)
+    with django_assert_num_queries(0):
+        settings_cache.get_settings(site)
+
+
+@pytest.mark.django_db
+def test_saving_settings_clears_the_cache(site, django_capture_on_commit_callbacks):
+    assert not settings_cache.get_settings(site).collect_enabled
+
+    with django_capture_on_commit_callbacks(execute=False) as callbacks:
+        analytics_settings = AnalyticsSettings.for_site(site)
+        analytics_settings.collect_enabled = True
+        analytics_settings.save()
+    # Until the commit, other requests could cache the old settings again
+    assert not settings_cache.get_settings(site).collect_enabled
+
+    for callback in callbacks:
+        callback()
+    assert settings_cache.get_settings(site).collect_enabled
+
+
+@pytest.mark.django_db
+def test_saving_a_site_clears_the_cache(site, django_capture_on_commit_callbacks):
+    assert settings_cache.get_site(site.pk).site_name != "Renamed"
+    with django_capture_on_commit_callbacks(execute=True):
+        site.site_name = "Renamed"
+        site.save()
+    assert settings_cache.get_site(site.pk).site_name == "Renamed"
+
+
+@pytest.mark.django_db
+def test_other_processes_see_the_new_version(site, django_capture_on_commit_callbacks):
+    other_process = SettingsCache(check_interval=0)
+    assert not other_process.get_settings(site).collect_enabled
+
+    with django_capture_on_commit_callbacks(execute=True):
+        analytics_settings = AnalyticsSettings.for_site(site)
+        analytics_settings.collect_enabled = True
+        analytics_settings.save()
+    assert other_process.get_settings(site).collect_enabled
@@ -0,0 +1,66 @@
+import pytest
+from django.core.exceptions import ValidationError
+from django.template import engines
+from django.test import RequestFactory
+from wagtail.models import Site
+
+from wagtail_analytics.lib.snippets import NONCE_MARKER, get_snippet
+from wagtail_analytics.models import AnalyticsSettings
+
+
+@pytest.fixture
+def analytics_settings():
+    analytics_settings = AnalyticsSettings.for_site(
+        Site.objects.get(is_default_site=True)
+    )
+    analytics_settings.plausible_enabled = True
+    analytics_settings.save()
+    return analytics_settings
+
+
+@pytest.mark.django_db
+def test_plausible_script_of_an_http_instance(analytics_settings):
+    analytics_settings.plausible_domain = "http://plausible.lan:8000"
+    analytics_settings.full_clean()
+    analytics_settings.save()
+    html = get_snippet(RequestFactory().get("/"), "head")
+    assert 'src="http://plausible.lan:8000/js/script.js"' in html
+    assert 'href="http://plausible.lan:8000"' in html
+
+
+@pytest.mark.django_db
+def test_plausible_domain_takes_http_urls_only(analytics_settings):
+    analytics_settings.plausible_domain = "ftp://plausible.lan"
+    with pytest.raises(ValidationError):
+        analytics_settings.full_clean()
+
+
+def render_head(request, **context):
+    template = engines["django"].from_string(
+        "{% load wagtail_analytics_tags %}{% analytics_head %}"
+    )
+    return template.render({"request": request, **context})
+
+
+@pytest.mark.django_db
+def test_cached_snippet_gets_the_nonce_of_each_request(
+    analytics_settings, django_assert_num_queries
+):
+    request = RequestFactory().get("/")
+    first = render_head(request, csp_nonce="first")
+    assert first.count('nonce="first"') == 1
+
+    with django_assert_num_queries(0):
+        second = render_head(RequestFactory().get("/"), csp_nonce="second")
+    assert second == first.replace('nonce="first"', 'nonce="second"')
+
+    without_nonce = render_head(RequestFactory().get("/"))
+    assert "nonce" not in without_nonce
+    assert NONCE_MARKER not in without_nonce
+
+
+@pytest.mark.django_db
+def test_nonce_is_escaped(analytics_settings):
+    html = get_snippet(RequestFactory().get("/"), "head", nonce='"><script>')
+    assert '"><script>' not in html
+    assert 'nonce="&quot;&gt;&lt;script&gt;"' in html
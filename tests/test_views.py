@@ -0,0 +1,399 @@
+import json
+import threading
+
+import pytest
+import requests
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import override_settings
+from wagtail.models import Page, Site
+
+from tests.clients import RecordingClient, StubAPIClient
+from wagtail_analytics import settings as wagtail_analytics_settings
+from wagtail_analytics import signals, views
+from wagtail_analytics.lib import http
+from wagtail_analytics.lib.collect import EventQueue
+from wagtail_analytics.lib.plausible import PlausibleQueryAPIClient
+from wagtail_analytics.models import AnalyticsSettings
+
+
+@pytest.fixture
+def site():
+    return Site.objects.get(is_default_site=True)
+
+
+@pytest.fixture
+def client_stub(monkeypatch):
+    stub = StubAPIClient()
+    monkeypatch.setattr(
+        views.AnalyticsAPIView, "get_client", lambda self, site, settings: stub
+    )
+    return stub
+
+
+@pytest.fixture
+def admin_client(client):
+    user = get_user_model().objects.create_superuser("admin", "admin@example.com")
+    client.force_login(user)
+    return client
+
+
+class QueueStub:
+    def __init__(self, accept=True) -> None:
+        self.accept = accept
+        self.events = []
+
+    def put(self, event) -> bool:
+        if self.accept:
+            self.events.append(event)
+        return self.accept
+
+
+@pytest.mark.django_db
+def test_report_revalidation(admin_client, client_stub, site):
+    url = "/analytics/api/%s/" % site.pk
+    response = admin_client.get(url)
+    assert response.status_code == 200
+    assert response["ETag"]
+    assert "max-age" in response["Cache-Control"]
+    assert json.loads(response.content)["top_pages"]
+
+    response = admin_client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+    assert response.status_code == 304
+    assert client_stub.calls["top_pages"] == 1
+
+
+@pytest.mark.django_db
+def test_report_needs_admin_access(client, client_stub, site):
+    response = client.get("/analytics/api/%s/" % site.pk)
+    assert response.status_code == 403
+
+
+@pytest.mark.django_db
+def test_unknown_section(admin_client, client_stub, site):
+    response = admin_client.get("/analytics/api/%s/sections/nope/" % site.pk)
+    assert response.status_code == 404
+
+
+@pytest.fixture
+def plausible_stub(monkeypatch):
+    def get_results(query):
+        if query.get("dimensions") == ["time:day"]:
+            return [{"dimensions": [today], "metrics": [5]}]
+        if "filters" not in query:
+            # Top pages and sources of the site
+            return [{"dimensions": ["/"], "metrics": [9]}]
+        # Pageviews by page, filtered by path
+        (paths,) = [paths for op, dimension, paths in query["filters"]]
+        return [
+            {"dimensions": [path], "metrics": [index + 1]}
+            for index, path in enumerate(paths)
+        ]
+
+    stub = RecordingClient(get_results)
+    today = stub.get_today().isoformat()
+    monkeypatch.setattr(
+        views.AnalyticsAPIView, "get_client", lambda self, site, settings: stub
+    )
+    return stub
+
+
+@pytest.fixture
+def upstream_stub(monkeypatch):
+    def request(method, url, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'{"results": []}'
+        response.retries = 0
+        return response
+
+    monkeypatch.setattr(http, "request", request)
+    client = PlausibleQueryAPIClient("localhost", "key")
+    client.rate_limit_bucket = None
+    monkeypatch.setattr(
+        views.AnalyticsAPIView, "get_client", lambda self, site, settings: client
+    )
+    return client
+
+
+@pytest.fixture
+def received():
+    received = []
+
+    def receiver(signal, **kwargs):
+        received.append((signal, kwargs))
+
+    for signal in (
+        signals.upstream_request_finished,
+        signals.report_built,
+        signals.report_cache_lookup,
+    ):
+        signal.connect(receiver, weak=False)
+    yield received
+    for signal in (
+        signals.upstream_request_finished,
+        signals.report_built,
+        signals.report_cache_lookup,
+    ):
+        signal.disconnect(receiver)
+
+
+@pytest.mark.django_db
+def test_report_instrumentation(admin_client, upstream_stub, site, received):
+    response = admin_client.get("/analytics/api/%s/" % site.pk)
+    assert response.status_code == 200
+    metrics = [metric.split(";")[0] for metric in response["Server-Timing"].split(", ")]
+    assert "cache" in metrics
+    assert "report" in metrics
+    assert {"plausible-visitors", "plausible-top_pages", "plausible-top_sources"} <= (
+        set(metrics)
+    )
+
+    upstream = [
+        kwargs
+        for signal, kwargs in received
+        if signal is signals.upstream_request_finished
+    ]
+    assert sorted(kwargs["section"] for kwargs in upstream) == [
+        "top_pages",
+        "top_sources",
+        "visitors",
+    ]
+    assert all(kwargs["status"] == 200 for kwargs in upstream)
+    (built,) = [kwargs for signal, kwargs in received if signal is signals.report_built]
+    assert built["provider"] == "plausible"
+    assert built["report_type"] == "report"
+    lookups = [
+        kwargs["result"]
+        for signal, kwargs in received
+        if signal is signals.report_cache_lookup
+    ]
+    assert lookups == ["miss"]
+
+    received.clear()
+    admin_client.get("/analytics/api/%s/" % site.pk)
+    assert [kwargs["result"] for signal, kwargs in received] == ["hit"]
+
+
+@pytest.fixture
+def page(site):
+    return site.root_page.add_child(instance=Page(title="About", slug="about"))
+
+
+@pytest.mark.django_db
+def test_page_report_is_one_query(admin_client, plausible_stub, site, page):
+    response = admin_client.get("/analytics/api/%s/pages/%s/" % (site.pk, page.pk))
+    assert response.status_code == 200
+    data = json.loads(response.content)
+    assert data["path"] == "/about/"
+    assert sum(data["visitors_this_week"]["values"]) == 5
+    assert len(data["visitors_last_week"]["values"]) == 7
+    (query,) = plausible_stub.queries
+    assert query["filters"] == [["is", "event:page", ["/about/"]]]
+
+
+@pytest.mark.django_db
+def test_pageviews_are_one_query(admin_client, plausible_stub, site, page):
+    response = admin_client.get(
+        "/analytics/api/%s/pageviews/" % site.pk,
+        {"path": ["/", "/contact/"], "page_id": [page.pk, "nope"]},
+    )
+    assert response.status_code == 200
+    assert json.loads(response.content) == {
+        "pageviews": {"/": 1, "/about/": 2, "/contact/": 3},
+        "pages": {str(page.pk): 2},
+    }
+    (query,) = plausible_stub.queries
+    assert query["dimensions"] == ["event:page"]
+
+
+class SyncClient:
+    """Calls an AsyncClient from a sync test."""
+
+    def __init__(self, async_client) -> None:
+        self.async_client = async_client
+
+    def get(self, *args, **kwargs):
+        return async_to_sync(self.async_client.get)(*args, **kwargs)
+
+
+def get_api_responses(admin_client, site, page):
+    return [
+        admin_client.get("/analytics/api/%s/" % site.pk),
+        admin_client.get("/analytics/api/%s/sections/top_pages/" % site.pk),
+        admin_client.get("/analytics/api/%s/pages/%s/" % (site.pk, page.pk)),
+        admin_client.get(
+            "/analytics/api/%s/pageviews/" % site.pk,
+            {"path": ["/", "/contact/"], "page_id": [page.pk]},
+        ),
+    ]
+
+
+@pytest.mark.django_db
+def test_async_views_return_the_same_json(
+    admin_client, async_client, plausible_stub, site, page
+):
+    expected = get_api_responses(admin_client, site, page)
+    cache.clear()
+
+    async_client.force_login(get_user_model().objects.get(username="admin"))
+    with override_settings(ROOT_URLCONF="tests.async_urls"):
+        responses = get_api_responses(SyncClient(async_client), site, page)
+
+    assert [response.status_code for response in responses] == [200] * 4
+    assert [json.loads(response.content) for response in responses] == [
+        json.loads(response.content) for response in expected
+    ]
+
+
+@pytest.mark.django_db
+def test_async_views_need_admin_access(async_client, plausible_stub, site):
+    with override_settings(ROOT_URLCONF="tests.async_urls"):
+        response = async_to_sync(async_client.get)("/analytics/api/%s/" % site.pk)
+    assert response.status_code == 403
+    assert plausible_stub.queries == []
+
+
+@pytest.mark.django_db
+def test_export_streams_rows_page_by_page(admin_client, site, monkeypatch):
+    paths = ["/page-%s/" % index for index in range(5)]
+
+    def get_results(query):
+        offset, limit = query["pagination"]["offset"], query["pagination"]["limit"]
+        return [
+            {"dimensions": [path], "metrics": [2, 3]} for path in paths[offset:][:limit]
+        ]
+
+    stub = RecordingClient(get_results)
+    monkeypatch.setattr(
+        views.AnalyticsAPIView, "get_client", lambda self, site, settings: stub
+    )
+    monkeypatch.setattr(wagtail_analytics_settings, "EXPORT_PAGE_SIZE", 2)
+
+    response = admin_client.get(
+        "/admin/analytics/api/%s/export/" % site.pk,
+        {"dimension": "page", "start": "2024-03-01", "end": "2024-03-31"},
+    )
+    assert response.status_code == 200
+    assert response.streaming
+    # Only the first page is fetched before the response is sent
+    assert len(stub.queries) == 1
+
+    lines = b"".join(response.streaming_content).decode().splitlines()
+    assert lines == ["page,visitors,pageviews"] + ["%s,2,3" % path for path in paths]
+    assert [query["pagination"] for query in stub.queries] == [
+        {"limit": 2, "offset": 0},
+        {"limit": 2, "offset": 2},
+        {"limit": 2, "offset": 4},
+    ]
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    "url", ["/admin/", "/admin/analytics/overview/", "/admin/pages/%(page)s/edit/"]
+)
+def test_admin_pages_without_charts_skip_chart_js(admin_client, page, url):
+    response = admin_client.get(url % {"page": page.pk})
+    assert response.status_code == 200
+    assert b"Chart.min.js" not in response.content
+    assert b"moment" not in response.content
+
+
+@pytest.mark.django_db
+def test_dashboard_defers_chart_js(admin_client, site):
+    response = admin_client.get("/admin/analytics/%s/" % site.pk)
+    assert response.status_code == 200
+    assert b'<script defer src="/static/chart.js/Chart.min.js">' in response.content
+    assert b"Chart.bundle.min.js" not in response.content
+
+
+@pytest.fixture
+def collect(monkeypatch, site):
+    analytics_settings = AnalyticsSettings.for_site(site)
+    analytics_settings.collect_enabled = True
+    analytics_settings.save()
+    queue = QueueStub()
+    monkeypatch.setattr(views.CollectView, "event_queue", queue)
+    return queue
+
+
+def post_event(client, data, **extra):
+    return client.post(
+        "/analytics/collect/",
+        json.dumps(data),
+        content_type="text/plain",
+        HTTP_HOST="localhost",
+        **extra,
+    )
+
+
+@pytest.mark.django_db
+def test_collect(client, collect, site):
+    response = post_event(
+        client,
+        {"n": "Signup", "u": "http://localhost/join/", "p": {"plan": "pro"}},
+        HTTP_USER_AGENT="Browser",
+    )
+    assert response.status_code == 202
+    (event,) = collect.events
+    assert event.site_id == site.pk
+    assert event.name == "Signup"
+    assert event.props == {"plan": "pro"}
+    assert event.user_agent == "Browser"
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    "data",
+    [
+        {"u": "javascript:alert(1)"},
+        {"n": "pageview"},
+    ],
+)
+def test_collect_invalid(client, collect, data):
+    assert post_event(client, data).status_code == 400
+    assert not collect.events
+
+
+@pytest.mark.django_db
+def test_collect_too_large(client, collect):
+    data = {"u": "http://localhost/", "p": {"x": "x" * 5000}}
+    assert post_event(client, data).status_code == 413
+
+
+@pytest.mark.django_db
+def test_collect_disabled(client, site):
+    assert post_event(client, {"u": "http://localhost/"}).status_code == 404
+
+
+@pytest.mark.django_db
+def test_collect_queue_full(client, collect):
+    collect.accept = False
+    response = post_event(client, {"u": "http://localhost/"})
+    assert response.status_code == 503
+    assert response["Retry-After"]
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    "url", ["https://example.com/", "http://localhost.example.com/", "http://other/"]
+)
+def test_collect_rejects_events_of_other_hosts(client, collect, url):
+    assert post_event(client, {"u": url}).status_code == 400
+    assert not collect.events
+
+
+@pytest.mark.django_db
+def test_collect_full_event_queue(client, collect, monkeypatch):
+    event_queue = EventQueue(maxsize=1, workers=1)
+    stop = threading.Event()
+    event_queue.run = stop.wait
+    monkeypatch.setattr(views.CollectView, "event_queue", event_queue)
+    try:
+        assert post_event(client, {"u": "http://localhost/"}).status_code == 202
+        response = post_event(client, {"u": "http://localhost/"})
+        assert response.status_code == 503
+        assert response["Retry-After"]
+    finally:
+        stop.set()